@@ -0,0 +1,43 @@
+from quantimage2_backend_common.training_lock import get_redis_client
+
+CANCELLATION_PREFIX = "cancelled:"
+
+# The flags are only needed while the cancelled tasks are still running
+CANCELLATION_TIMEOUT = 24 * 60 * 60
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+def get_extraction_cancellation_key(feature_extraction_id):
+    return f"{CANCELLATION_PREFIX}extraction:{feature_extraction_id}"
+
+
+def get_training_cancellation_key(run_id):
+    # Training IDs only depend on the extraction & collection, a new run of the
+    # same training must not be affected by the cancellation of a previous run
+    return f"{CANCELLATION_PREFIX}training:{run_id}"
+
+
+def request_cancellation(key):
+    """
+    Ask the running tasks of an extraction or training to stop, the tasks check
+    the flag between their steps (see is_cancelled)
+
+    :param key: The cancellation key of the extraction or training
+    """
+    get_redis_client().set(key, 1, ex=CANCELLATION_TIMEOUT)
+
+
+def is_cancelled(key):
+    return get_redis_client().exists(key) > 0
+
+
+def check_cancellation(key):
+    if is_cancelled(key):
+        raise TaskCancelled("Cancelled by the user")
+
+
+def clear_cancellation(key):
+    get_redis_client().delete(key)
@@ -27,6 +27,12 @@ class TRAINING_PHASES(Enum):
     TESTING = "testing"
 
 
+class SEARCH_STRATEGIES(Enum):
+    GRID = "grid"
+    HALVING = "halving"
+    RANDOM = "random"
+
+
 RIESZ_FEATURE_PREFIXES = ["tex"]
 ZRAD_FEATURE_PREFIXES = ["zrad"]
 PYRADIOMICS_FEATURE_PREFIXES = [
@@ -47,10 +53,13 @@ featureIDMatcher = re.compile(
     rf"(?P<modality>.*?){FEATURE_ID_SEPARATOR}(?P<roi>.*?){FEATURE_ID_SEPARATOR}(?P<feature>(?:{'|'.join(prefixes)}).*)"
 )
 
-FAKE_SCORER_KEY = "fake"
+# Hyper-parameter search budgets
+HALVING_FACTOR = 3
+RANDOM_SEARCH_ITERATIONS = 30
 
 QUEUE_EXTRACTION = "extraction"
 QUEUE_TRAINING = "training"
+QUEUE_PREDICTION = "prediction"
 
 PET_MODALITY = "PT"
 
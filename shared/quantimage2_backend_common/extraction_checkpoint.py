@@ -0,0 +1,155 @@
+import os
+import pickle
+import shutil
+from time import time
+
+# Shared volume between the workers, so that any worker can resume a task
+EXTRACTION_CHECKPOINTS_BASE_DIR = "/quantimage2-data/extraction-checkpoints"
+
+# Stages of an extraction task, a stage is complete once its checkpoint exists
+DOWNLOAD_CHECKPOINT = "dicom"
+FEATURES_CHECKPOINT = "features.pkl"
+
+# Suffix of the checkpoints being written (renamed once complete)
+PARTIAL_SUFFIX = ".partial"
+
+# Number of times the task was started (including redeliveries after a crash)
+ATTEMPTS_FILE = "attempts"
+
+# Checkpoints left for longer are considered leaked (e.g. revoked tasks)
+EXTRACTION_CHECKPOINT_TIMEOUT = 24 * 60 * 60
+
+
+def get_checkpoint_dir(feature_extraction_task_id):
+    checkpoint_dir = os.path.join(
+        EXTRACTION_CHECKPOINTS_BASE_DIR, str(feature_extraction_task_id)
+    )
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    return checkpoint_dir
+
+
+def register_attempt(checkpoint_dir):
+    """
+    Count the attempts of an extraction task, Celery's retry counter doesn't
+    include the redeliveries of tasks whose worker died (e.g. out of memory)
+
+    :param checkpoint_dir: The checkpoint directory of the task
+    :returns: The number of the current attempt (starting at 1)
+    """
+    attempts_path = os.path.join(checkpoint_dir, ATTEMPTS_FILE)
+
+    attempt = 1
+
+    if os.path.exists(attempts_path):
+        with open(attempts_path) as attempts_file:
+            attempt = int(attempts_file.read() or 0) + 1
+
+    with open(attempts_path, "w") as attempts_file:
+        attempts_file.write(str(attempt))
+
+    return attempt
+
+
+def get_partial_download_dir(checkpoint_dir):
+    # Files of an interrupted download can't be trusted, start from scratch
+    download_dir = os.path.join(checkpoint_dir, DOWNLOAD_CHECKPOINT + PARTIAL_SUFFIX)
+    shutil.rmtree(download_dir, True)
+
+    return download_dir
+
+
+def save_download_checkpoint(checkpoint_dir, download_dir):
+    """
+    Mark the download of a study as complete
+
+    :param checkpoint_dir: The checkpoint directory of the task
+    :param download_dir: The directory of the downloaded files (from
+                         get_partial_download_dir)
+    :returns: The path of the checkpointed directory of the downloaded files
+    """
+    dicom_dir = os.path.join(checkpoint_dir, DOWNLOAD_CHECKPOINT)
+
+    # Atomic, the checkpoint either contains the whole study or doesn't exist
+    try:
+        os.replace(download_dir, dicom_dir)
+    except OSError:
+        # Already downloaded meanwhile (prefetched), keep the existing files
+        if not os.path.isdir(dicom_dir):
+            raise
+
+        shutil.rmtree(download_dir, True)
+
+    return dicom_dir
+
+
+def get_download_checkpoint(checkpoint_dir):
+    dicom_dir = os.path.join(checkpoint_dir, DOWNLOAD_CHECKPOINT)
+
+    return dicom_dir if os.path.isdir(dicom_dir) else None
+
+
+def save_features_checkpoint(checkpoint_dir, features):
+    """
+    Save the features extracted from a study, which makes its downloaded files
+    unnecessary (they are deleted)
+
+    :param checkpoint_dir: The checkpoint directory of the task
+    :param features: The features extracted by okapy
+    """
+    features_path = os.path.join(checkpoint_dir, FEATURES_CHECKPOINT)
+
+    with open(features_path + PARTIAL_SUFFIX, "wb") as features_file:
+        pickle.dump(features, features_file)
+
+    os.replace(features_path + PARTIAL_SUFFIX, features_path)
+
+    shutil.rmtree(os.path.join(checkpoint_dir, DOWNLOAD_CHECKPOINT), True)
+
+
+def has_features_checkpoint(checkpoint_dir):
+    return os.path.exists(os.path.join(checkpoint_dir, FEATURES_CHECKPOINT))
+
+
+def load_features_checkpoint(checkpoint_dir):
+    features_path = os.path.join(checkpoint_dir, FEATURES_CHECKPOINT)
+
+    if not os.path.exists(features_path):
+        return None
+
+    with open(features_path, "rb") as features_file:
+        return pickle.load(features_file)
+
+
+def delete_checkpoint(checkpoint_dir):
+    shutil.rmtree(checkpoint_dir, True)
+
+
+def get_checkpoints_disk_usage():
+    disk_usage = 0
+
+    for directory, subdirectories, files in os.walk(EXTRACTION_CHECKPOINTS_BASE_DIR):
+        for file in files:
+            try:
+                disk_usage += os.path.getsize(os.path.join(directory, file))
+            except OSError:
+                # Deleted meanwhile (completed task)
+                pass
+
+    return disk_usage
+
+
+def delete_stale_checkpoints():
+    if not os.path.isdir(EXTRACTION_CHECKPOINTS_BASE_DIR):
+        return
+
+    now = time()
+
+    for name in os.listdir(EXTRACTION_CHECKPOINTS_BASE_DIR):
+        checkpoint_dir = os.path.join(EXTRACTION_CHECKPOINTS_BASE_DIR, name)
+
+        try:
+            if now - os.path.getmtime(checkpoint_dir) > EXTRACTION_CHECKPOINT_TIMEOUT:
+                delete_checkpoint(checkpoint_dir)
+        except OSError:
+            pass
@@ -0,0 +1,211 @@
+from time import time
+
+from quantimage2_backend_common.kheops_utils import dicomFields
+from quantimage2_backend_common.training_lock import get_redis_client
+
+EXTRACTION_MEMORY_PREFIX = "extraction-memory:"
+EXTRACTION_MEMORY_METRICS_PREFIX = "extraction-memory-metrics:"
+
+# Reservations held for longer are considered leaked (e.g. worker crash)
+EXTRACTION_MEMORY_TIMEOUT = 6 * 60 * 60
+
+# Approximate size of an image (in bytes) by modality, the QIDO metadata only
+# gives the number of images of each series
+IMAGE_BYTES_BY_MODALITY = {
+    "CT": 512 * 512 * 2,
+    "MR": 256 * 256 * 2,
+    "PT": 256 * 256 * 2,
+}
+DEFAULT_IMAGE_BYTES = 512 * 512 * 2
+
+# Metrics of the admission decisions (forced: admitted over budget, as the only task)
+ADMITTED_METRIC = "admitted"
+DEFERRED_METRIC = "deferred"
+FORCED_METRIC = "forced"
+
+# cgroup v2 & v1 files with the memory limit & usage of the container
+CGROUP_MEMORY_FILES = [
+    ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+    (
+        "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+        "/sys/fs/cgroup/memory/memory.usage_in_bytes",
+    ),
+]
+
+# Limits above this value mean that the container is not limited (cgroup v1)
+UNLIMITED_MEMORY = 2**60
+
+
+def get_study_image_bytes(study_series):
+    """
+    Estimate the size of the images of a study from its QIDO series metadata
+
+    :param study_series: The series of the study, from get_series_from_study
+    :returns: The estimated size of the images (in bytes)
+    """
+    image_bytes = 0
+
+    for series in study_series:
+        modality = series[dicomFields.MODALITY][dicomFields.VALUE][0]
+        n_instances = series.get(dicomFields.NUMBER_OF_SERIES_INSTANCES, {}).get(
+            dicomFields.VALUE, [1]
+        )[0]
+
+        image_bytes += int(n_instances) * IMAGE_BYTES_BY_MODALITY.get(
+            modality, DEFAULT_IMAGE_BYTES
+        )
+
+    return image_bytes
+
+
+def get_memory_status():
+    """
+    Get the memory of the worker's container (or of the host if the container
+    is not limited)
+
+    :returns: The total & available memory (in bytes)
+    """
+    for limit_path, usage_path in CGROUP_MEMORY_FILES:
+        try:
+            with open(limit_path) as limit_file, open(usage_path) as usage_file:
+                limit = limit_file.read().strip()
+                usage = int(usage_file.read().strip())
+        except OSError:
+            continue
+
+        if limit != "max" and int(limit) < UNLIMITED_MEMORY:
+            return int(limit), int(limit) - usage
+
+    meminfo = {}
+
+    with open("/proc/meminfo") as meminfo_file:
+        for line in meminfo_file:
+            name, value = line.split(":", 1)
+            meminfo[name] = int(value.split()[0]) * 1024
+
+    return meminfo["MemTotal"], meminfo["MemAvailable"]
+
+
+def reserve_extraction_memory(hostname, task_id, required_bytes, budget_ratio):
+    """
+    Admit an extraction task on a worker if its estimated memory fits in the
+    worker's budget, with the memory reserved by the other running tasks
+
+    A task is always admitted if no other task runs on the worker, so that
+    studies larger than the budget are still extracted (one at a time).
+
+    :param hostname: The hostname of the Celery worker (one per container)
+    :param task_id: The ID of the Celery task requesting the memory
+    :param required_bytes: The estimated memory used by the task (in bytes)
+    :param budget_ratio: The part of the worker's memory that tasks can reserve
+    :returns: True if the task can run (its memory is then reserved)
+    """
+    client = get_redis_client()
+    key = f"{EXTRACTION_MEMORY_PREFIX}{hostname}"
+    total_bytes, available_bytes = get_memory_status()
+    admitted = False
+    decision = DEFERRED_METRIC
+
+    def reserve(pipeline):
+        nonlocal admitted, decision
+
+        now = time()
+        reservations = {
+            other_task_id.decode(): tuple(map(float, reservation.split(b":")))
+            for other_task_id, reservation in pipeline.hgetall(key).items()
+        }
+        running = {
+            other_task_id: reserved_bytes
+            for other_task_id, (reserved_bytes, reserved_at) in reservations.items()
+            if now - reserved_at < EXTRACTION_MEMORY_TIMEOUT
+            and other_task_id != task_id
+        }
+        fits_budget = (
+            sum(running.values()) + required_bytes <= total_bytes * budget_ratio
+            and required_bytes <= available_bytes
+        )
+
+        admitted = fits_budget or not running
+
+        if not admitted:
+            decision = DEFERRED_METRIC
+        elif fits_budget:
+            decision = ADMITTED_METRIC
+        else:
+            decision = FORCED_METRIC
+
+        pipeline.multi()
+
+        # Also forget the reservations of crashed tasks
+        stale_task_ids = set(reservations) - set(running) - {task_id}
+        if stale_task_ids:
+            pipeline.hdel(key, *stale_task_ids)
+
+        if admitted:
+            pipeline.hset(key, task_id, f"{required_bytes}:{now}")
+            pipeline.expire(key, EXTRACTION_MEMORY_TIMEOUT)
+
+    # Retried if another task of the worker reserved memory at the same time
+    client.transaction(reserve, key)
+
+    record_admission(hostname, decision, required_bytes, total_bytes, available_bytes)
+
+    return admitted
+
+
+def release_extraction_memory(hostname, task_id):
+    get_redis_client().hdel(f"{EXTRACTION_MEMORY_PREFIX}{hostname}", task_id)
+
+
+def clear_extraction_memory(hostname):
+    get_redis_client().delete(f"{EXTRACTION_MEMORY_PREFIX}{hostname}")
+
+
+def record_admission(hostname, decision, required_bytes, total_bytes, available_bytes):
+    print(
+        f"Memory admission on {hostname}: {decision} task requiring"
+        f" {required_bytes / 2**20:.0f}MB ({available_bytes / 2**20:.0f}MB available"
+        f" out of {total_bytes / 2**20:.0f}MB)"
+    )
+
+    # Counters & last values, read by the metrics exporter
+    client = get_redis_client()
+    metrics_key = f"{EXTRACTION_MEMORY_METRICS_PREFIX}{hostname}"
+    pipeline = client.pipeline()
+    pipeline.hincrby(metrics_key, decision, 1)
+    pipeline.hset(
+        metrics_key,
+        mapping={
+            "last_required_bytes": required_bytes,
+            "total_bytes": total_bytes,
+            "available_bytes": available_bytes,
+        },
+    )
+    pipeline.execute()
+
+
+def get_memory_admission_metrics():
+    """
+    Get the admission metrics of all the extraction workers
+
+    :returns: The metrics by worker hostname, with the currently reserved memory
+    """
+    client = get_redis_client()
+    metrics = {}
+
+    for metrics_key in client.scan_iter(f"{EXTRACTION_MEMORY_METRICS_PREFIX}*"):
+        hostname = metrics_key.decode()[len(EXTRACTION_MEMORY_METRICS_PREFIX) :]
+        host_metrics = {
+            name.decode(): float(value)
+            for name, value in client.hgetall(metrics_key).items()
+        }
+
+        reservations = client.hvals(f"{EXTRACTION_MEMORY_PREFIX}{hostname}")
+        host_metrics["reserved_bytes"] = sum(
+            float(reservation.split(b":")[0]) for reservation in reservations
+        )
+        host_metrics["running_tasks"] = len(reservations)
+
+        metrics[hostname] = host_metrics
+
+    return metrics
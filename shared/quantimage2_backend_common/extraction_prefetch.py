@@ -0,0 +1,31 @@
+from quantimage2_backend_common.training_lock import get_redis_client
+
+EXTRACTION_DOWNLOAD_PREFIX = "extraction-download:"
+
+# Claims held for longer are considered leaked (e.g. worker crash)
+EXTRACTION_DOWNLOAD_TIMEOUT = 30 * 60
+
+
+def claim_download(feature_extraction_task_id, downloader_id):
+    """
+    Claim the download of a study, so that a study is not downloaded by its
+    task and prefetched by another task at the same time
+
+    :param feature_extraction_task_id: The ID of the Feature Extraction Task
+    :param downloader_id: The ID of the claimer (Celery task ID, or a prefetch ID)
+    :returns: True if the study can be downloaded by the claimer
+    """
+    client = get_redis_client()
+    key = f"{EXTRACTION_DOWNLOAD_PREFIX}{feature_extraction_task_id}"
+
+    if client.set(key, downloader_id, nx=True, ex=EXTRACTION_DOWNLOAD_TIMEOUT):
+        return True
+
+    # A redelivered task takes over the download it started before crashing
+    return client.get(key) == downloader_id.encode()
+
+
+def release_download(feature_extraction_task_id):
+    get_redis_client().delete(
+        f"{EXTRACTION_DOWNLOAD_PREFIX}{feature_extraction_task_id}"
+    )
@@ -0,0 +1,142 @@
+import json
+from time import time
+
+from quantimage2_backend_common.training_lock import get_redis_client
+
+# Broker priorities, Redis emulates them with one list per priority (0 is the highest)
+EXTRACTION_PRIORITY_STEPS = list(range(10))
+
+# Extraction tasks are acknowledged once complete, Redis redelivers the tasks
+# that are not acknowledged within this delay (it must exceed their duration)
+EXTRACTION_VISIBILITY_TIMEOUT = 6 * 60 * 60
+
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    "priority_steps": EXTRACTION_PRIORITY_STEPS,
+    "sep": ":",
+    "queue_order_strategy": "priority",
+    "visibility_timeout": EXTRACTION_VISIBILITY_TIMEOUT,
+}
+
+# Number of studies of an extraction sent with the same priority
+EXTRACTION_PRIORITY_BATCH_SIZE = 10
+
+EXTRACTION_SLOTS_PREFIX = "extraction-slots:"
+
+# Slots held for longer are considered leaked (e.g. worker crash)
+EXTRACTION_SLOT_TIMEOUT = EXTRACTION_VISIBILITY_TIMEOUT
+
+# Tasks of a user waiting for a free slot, in the order they were received
+EXTRACTION_WAITING_PREFIX = "extraction-waiting:"
+
+# Take a slot, or add the task to the waiting list of the user if all are taken
+# (a task that was handed a slot already holds it, see HAND_OVER_SLOTS_SCRIPT)
+ACQUIRE_SLOT_SCRIPT = """
+redis.call("zremrangebyscore", KEYS[1], "-inf", ARGV[2] - ARGV[3])
+if redis.call("zscore", KEYS[1], ARGV[1])
+    or redis.call("zcard", KEYS[1]) < tonumber(ARGV[4]) then
+    redis.call("zadd", KEYS[1], ARGV[2], ARGV[1])
+    redis.call("expire", KEYS[1], ARGV[3])
+    return 1
+end
+redis.call("rpush", KEYS[2], ARGV[5])
+return 0
+"""
+
+# Release a slot & hand the free slots over to the first waiting tasks of the user
+# (0 slots means no limit, e.g. the limit was removed while tasks were waiting)
+HAND_OVER_SLOTS_SCRIPT = """
+redis.call("zrem", KEYS[1], ARGV[1])
+redis.call("zremrangebyscore", KEYS[1], "-inf", ARGV[2] - ARGV[3])
+local max_slots = tonumber(ARGV[4])
+if max_slots == 0 then
+    max_slots = math.huge
+end
+local started = {}
+while redis.call("zcard", KEYS[1]) < max_slots do
+    local waiting = redis.call("lpop", KEYS[2])
+    if not waiting then
+        break
+    end
+    redis.call("zadd", KEYS[1], ARGV[2], cjson.decode(waiting)["task-id"])
+    table.insert(started, waiting)
+end
+redis.call("expire", KEYS[1], ARGV[3])
+return started
+"""
+
+
+def get_extraction_priority(task_index):
+    """
+    Get the priority of a study in its extraction, the first studies of every
+    extraction have the highest priority so that small extractions are not
+    queued behind all the studies of large ones (round-robin between extractions)
+
+    :param task_index: The index of the study in the extraction
+    :returns: The priority of the task (0 is the highest)
+    """
+    return min(
+        task_index // EXTRACTION_PRIORITY_BATCH_SIZE, EXTRACTION_PRIORITY_STEPS[-1]
+    )
+
+
+def acquire_extraction_slot(user_id, task_id, max_slots, task):
+    """
+    Limit the number of studies of a user that are extracted at the same time,
+    the tasks over the limit wait in a list of the user instead of the queue
+
+    :param user_id: The ID of the user running the extraction
+    :param task_id: The ID of the Celery task requesting a slot
+    :param max_slots: The maximum number of concurrent tasks per user (0 for no limit)
+    :param task: The serialized task, kept in the waiting list if it can't run
+    :returns: True if the task can run, False if it was added to the waiting list
+              (it is returned by release_extraction_slot once a slot is free)
+    """
+    if not max_slots:
+        return True
+
+    acquired = get_redis_client().eval(
+        ACQUIRE_SLOT_SCRIPT,
+        2,
+        f"{EXTRACTION_SLOTS_PREFIX}{user_id}",
+        f"{EXTRACTION_WAITING_PREFIX}{user_id}",
+        task_id,
+        time(),
+        EXTRACTION_SLOT_TIMEOUT,
+        max_slots,
+        json.dumps({"task-id": task_id, "task": task}),
+    )
+
+    return bool(acquired)
+
+
+def release_extraction_slot(user_id, task_id, max_slots):
+    """
+    Release the slot of a task, the free slots are handed over to the waiting
+    tasks of the user (in order)
+
+    :param user_id: The ID of the user running the extraction
+    :param task_id: The ID of the Celery task releasing its slot (None to only
+                    hand the free slots over, e.g. after a worker restart)
+    :param max_slots: The maximum number of concurrent tasks per user (0 for no limit)
+    :returns: The serialized tasks that got a slot, to be sent again
+    """
+    started = get_redis_client().eval(
+        HAND_OVER_SLOTS_SCRIPT,
+        2,
+        f"{EXTRACTION_SLOTS_PREFIX}{user_id}",
+        f"{EXTRACTION_WAITING_PREFIX}{user_id}",
+        task_id or "",
+        time(),
+        EXTRACTION_SLOT_TIMEOUT,
+        max_slots,
+    )
+
+    return [json.loads(waiting)["task"] for waiting in started]
+
+
+def get_waiting_extraction_users():
+    # Users with tasks waiting for a slot
+    return [
+        key.decode()[len(EXTRACTION_WAITING_PREFIX) :]
+        for key in get_redis_client().scan_iter(f"{EXTRACTION_WAITING_PREFIX}*")
+    ]
@@ -0,0 +1,146 @@
+import os
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+
+import numpy as np
+
+# Stages of an extraction task
+QUEUE_STAGE = "queue"
+DOWNLOAD_STAGE = "download"
+EXTRACT_STAGE = "extract"
+STORE_STAGE = "store"
+STATUS_STAGE = "status"
+
+# Percentiles of the stage durations in the profile of an extraction
+PROFILE_PERCENTILES = [50, 90, 99]
+
+# Timings of the stages run by the current task (see start_timings)
+current_timings = ContextVar("current_timings", default=None)
+
+
+def start_timings():
+    """
+    Start collecting the timings of the stages run by the current task
+
+    :returns: A token to pass to stop_timings
+    """
+    return current_timings.set([])
+
+
+def stop_timings(token):
+    """
+    Stop collecting the timings of the stages run by the current task
+
+    :param token: The token returned by start_timings
+    :returns: The timings of the stages (stage, duration, bytes, rows & failed)
+    """
+    timings = current_timings.get()
+    current_timings.reset(token)
+
+    return timings
+
+
+def record_stage(stage, duration, n_bytes=None, rows=None, failed=False):
+    timings = current_timings.get()
+
+    # Not collecting timings (e.g. background thread)
+    if timings is None:
+        return
+
+    timings.append(
+        {
+            "stage": stage,
+            "duration": duration,
+            "bytes": n_bytes,
+            "rows": rows,
+            "failed": failed,
+        }
+    )
+
+
+@contextmanager
+def time_stage(stage):
+    """
+    Time a stage of the current task, the block can set the "bytes" & "rows"
+    processed by the stage in the yielded dictionary
+
+    :param stage: The name of the stage (e.g. DOWNLOAD_STAGE)
+    """
+    counts = {"bytes": None, "rows": None}
+    started_at = perf_counter()
+    failed = False
+
+    try:
+        yield counts
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        record_stage(
+            stage,
+            perf_counter() - started_at,
+            n_bytes=counts["bytes"],
+            rows=counts["rows"],
+            failed=failed,
+        )
+
+
+def timed_stage(stage):
+    # Decorator version of time_stage, for functions that are a whole stage
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with time_stage(stage):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def get_directory_bytes(directory):
+    return sum(
+        os.path.getsize(os.path.join(path, file))
+        for path, subdirectories, files in os.walk(directory)
+        for file in files
+    )
+
+
+def get_stage_profile(timings):
+    """
+    Aggregate the timings of the tasks of an extraction by stage
+
+    :param timings: The stage timings (FeatureExtractionTaskTiming instances)
+    :returns: The number of tasks & the statistics of each stage (in seconds)
+    """
+    timings_by_stage = defaultdict(list)
+
+    for timing in timings:
+        timings_by_stage[timing.stage].append(timing)
+
+    stages = {}
+
+    for stage, stage_timings in timings_by_stage.items():
+        durations = np.array([timing.duration for timing in stage_timings])
+
+        stages[stage] = {
+            "count": len(stage_timings),
+            "failed": sum(timing.failed for timing in stage_timings),
+            "total": float(durations.sum()),
+            "mean": float(durations.mean()),
+            "max": float(durations.max()),
+            **{
+                f"p{percentile}": float(np.percentile(durations, percentile))
+                for percentile in PROFILE_PERCENTILES
+            },
+            "bytes": sum(timing.bytes or 0 for timing in stage_timings),
+            "rows": sum(timing.rows or 0 for timing in stage_timings),
+        }
+
+    return {
+        "tasks": len({timing.feature_extraction_task_id for timing in timings}),
+        "stages": stages,
+    }
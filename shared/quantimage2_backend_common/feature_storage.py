@@ -1,3 +1,4 @@
+from quantimage2_backend_common.metrics import FEATURE_ROWS_STORED
 from quantimage2_backend_common.models import (
     Modality,
     ROI,
@@ -56,8 +57,12 @@ def store_features(feature_extraction_task_id, feature_extraction_id, features):
 
         feature_value_instances.append(feature_value_instance)
 
-    # Batch create the instances
-    FeatureValue.save_features_batch(feature_value_instances)
+    # Batch create the instances (replacing those of a previous attempt)
+    FeatureValue.replace_task_features_batch(
+        feature_extraction_task_id, feature_value_instances
+    )
+    FEATURE_ROWS_STORED.inc(len(feature_value_instances))
+
     return feature_value_instances
 
 
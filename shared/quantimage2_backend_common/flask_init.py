@@ -5,6 +5,9 @@ from flask import Flask
 from flask_compress import Compress
 from get_docker_secret import get_docker_secret
 
+from quantimage2_backend_common.extraction_scheduling import (
+    CELERY_BROKER_TRANSPORT_OPTIONS,
+)
 from quantimage2_backend_common.models import db
 
 # Initialize Flask Compress
@@ -29,6 +32,7 @@ def create_app():
 
     app.config["CELERY_BROKER_URL"] = os.environ["CELERY_BROKER_URL"]
     app.config["CELERY_RESULT_BACKEND"] = os.environ["CELERY_RESULT_BACKEND"]
+    app.config["BROKER_TRANSPORT_OPTIONS"] = CELERY_BROKER_TRANSPORT_OPTIONS
 
     app.config["UPLOAD_FOLDER"] = "/quantimage2-data/feature-presets"
 
@@ -3,6 +3,8 @@ import requests
 
 from datetime import datetime, timedelta
 
+from quantimage2_backend_common.metrics import KHEOPS_REQUEST_DURATION
+
 # Backend client
 kheopsBaseURL = os.environ["KHEOPS_BASE_URL"]
 
@@ -37,6 +39,7 @@ dicomFields.PATIENT_ID = "00100020"
 dicomFields.PATIENT_NAME = "00100010"
 dicomFields.MODALITY = "00080060"
 dicomFields.MODALITIES = "00080061"
+dicomFields.NUMBER_OF_SERIES_INSTANCES = "00201209"
 dicomFields.DICOM_FILE_URL = "7FE00010"
 dicomFields.RETRIEVE_URL = "00081190"
 dicomFields.VALUE = "Value"
@@ -76,12 +79,54 @@ def get_user_token(album_id, token):
         "expiration_time": tomorrow_str,
     }
 
-    response = requests.post(
-        f"{kheopsBaseEndpoint}{endpoints.capabilities}",
-        headers=get_token_header(token),
-        data=data,
-    )
+    with KHEOPS_REQUEST_DURATION.labels("capability").time():
+        response = requests.post(
+            f"{kheopsBaseEndpoint}{endpoints.capabilities}",
+            headers=get_token_header(token),
+            data=data,
+        )
 
     response_json = response.json()
 
     return response_json["id"], response_json["secret"]
+
+
+def get_album_details(album_id, token):
+    album_url = f"{endpoints.albums}/{album_id}"
+
+    access_token = get_token_header(token)
+
+    with KHEOPS_REQUEST_DURATION.labels("album").time():
+        album_details = requests.get(album_url, headers=access_token).json()
+
+    return album_details
+
+
+def get_studies_from_album(album_id, token):
+    album_studies_url = f"{endpoints.studies}?{endpoints.album_parameter}={album_id}"
+
+    access_token = get_token_header(token)
+
+    with KHEOPS_REQUEST_DURATION.labels("album_studies").time():
+        album_studies = requests.get(album_studies_url, headers=access_token).json()
+
+    return album_studies
+
+
+def get_series_from_study(study_uid, modalities, album_id, token):
+    study_series_url = f"{endpoints.studies}/{study_uid}/series?album={album_id}"
+
+    if modalities is not None:
+        params = [
+            f"&{dicomFields.MODALITY}={modality}"
+            for i, modality in enumerate(modalities)
+        ]
+
+        study_series_url += "".join(params)
+
+    access_token = get_token_header(token)
+
+    with KHEOPS_REQUEST_DURATION.labels("study_series").time():
+        study_series = requests.get(study_series_url, headers=access_token).json()
+
+    return study_series
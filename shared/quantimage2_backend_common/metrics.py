@@ -0,0 +1,90 @@
+from time import perf_counter
+
+from flask import g, has_request_context
+from prometheus_client import Counter, Histogram
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+METRICS_PREFIX = "quantimage2_"
+
+# Buckets of the durations of the tasks (in seconds), from seconds to hours
+TASK_DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400)
+
+# Buckets of the number of DB queries of a request
+DB_QUERIES_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+HTTP_REQUEST_DURATION = Histogram(
+    f"{METRICS_PREFIX}http_request_duration_seconds",
+    "Duration of the HTTP requests",
+    ["method", "endpoint", "status"],
+)
+
+DB_QUERY_DURATION = Histogram(
+    f"{METRICS_PREFIX}db_query_duration_seconds", "Duration of the DB queries"
+)
+
+DB_QUERIES_PER_REQUEST = Histogram(
+    f"{METRICS_PREFIX}db_queries_per_request",
+    "Number of DB queries of the HTTP requests",
+    ["endpoint"],
+    buckets=DB_QUERIES_BUCKETS,
+)
+
+DB_DURATION_PER_REQUEST = Histogram(
+    f"{METRICS_PREFIX}db_duration_per_request_seconds",
+    "Total duration of the DB queries of the HTTP requests",
+    ["endpoint"],
+)
+
+KHEOPS_REQUEST_DURATION = Histogram(
+    f"{METRICS_PREFIX}kheops_request_duration_seconds",
+    "Duration of the requests to Kheops",
+    ["operation"],
+    buckets=TASK_DURATION_BUCKETS,
+)
+
+CELERY_TASK_DURATION = Histogram(
+    f"{METRICS_PREFIX}celery_task_duration_seconds",
+    "Duration of the Celery tasks",
+    ["task", "state"],
+    buckets=TASK_DURATION_BUCKETS,
+)
+
+FEATURE_ROWS_STORED = Counter(
+    f"{METRICS_PREFIX}feature_rows_stored",
+    "Number of feature values stored by the extractions",
+)
+
+CACHE_REQUESTS = Counter(
+    f"{METRICS_PREFIX}cache_requests",
+    "Lookups of the caches (features, reused studies & candidates) by result",
+    ["cache", "result"],
+)
+
+SOCKETIO_EMITS = Counter(
+    f"{METRICS_PREFIX}socketio_emits",
+    "Number of Socket.IO messages sent to the clients",
+    ["event"],
+)
+
+
+def record_cache_lookups(cache, hits, misses):
+    CACHE_REQUESTS.labels(cache, "hit").inc(hits)
+    CACHE_REQUESTS.labels(cache, "miss").inc(misses)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started_at", []).append(perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    duration = perf_counter() - conn.info["query_started_at"].pop()
+
+    DB_QUERY_DURATION.observe(duration)
+
+    # Totals of the current request, observed once it ends
+    if has_request_context():
+        g.db_queries = g.get("db_queries", 0) + 1
+        g.db_duration = g.get("db_duration", 0) + duration
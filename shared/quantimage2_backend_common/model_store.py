@@ -0,0 +1,81 @@
+import os
+import tempfile
+from functools import lru_cache
+
+import joblib
+
+# Shared volume between the webapp & the workers
+MODELS_BASE_DIR = "/quantimage2-data/models"
+
+MODEL_EXTENSION = ".joblib"
+
+# Number of models kept in memory by each process for predictions
+MODEL_CACHE_SIZE = 8
+
+
+def save_model(model, metadata, user_id, album_id, compress=0):
+    """
+    Save a trained model along with its metadata, identical models (same
+    content hash) are only stored once
+
+    :param model: The fitted estimator
+    :param metadata: Dictionary describing the model (feature names, label type, etc.)
+    :param user_id: The ID of the user who trained the model
+    :param album_id: The ID of the album the model was trained on
+    :param compress: The joblib compression level (0 keeps the arrays memory-mappable)
+    :returns: The path of the saved model
+    """
+    artefact = {"model": model, "metadata": metadata}
+
+    models_dir = os.path.join(MODELS_BASE_DIR, user_id, album_id)
+    model_path = os.path.join(
+        models_dir, f"model_{joblib.hash(artefact)}{MODEL_EXTENSION}"
+    )
+
+    if os.path.exists(model_path):
+        return model_path
+
+    os.makedirs(models_dir, exist_ok=True)
+
+    # Write to a temporary file first, so that a partially written model is never read
+    fd, tmp_path = tempfile.mkstemp(dir=models_dir, suffix=".tmp")
+    os.close(fd)
+
+    try:
+        joblib.dump(artefact, tmp_path, compress=compress)
+        os.replace(tmp_path, model_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    return model_path
+
+
+def load_model(model_path, mmap=True):
+    """
+    Load a model saved by save_model
+
+    :param model_path: The path of the saved model
+    :param mmap: Memory-map the arrays of the model (only for uncompressed models)
+    :returns: The fitted estimator & its metadata
+    """
+    artefact = joblib.load(model_path, mmap_mode="r" if mmap else None)
+
+    # Models saved before the store only contain the estimator
+    if not isinstance(artefact, dict) or "model" not in artefact:
+        return artefact, {}
+
+    return artefact["model"], artefact["metadata"]
+
+
+@lru_cache(maxsize=MODEL_CACHE_SIZE)
+def load_cached_model(model_path):
+    # Model files never change once written (named by their content), caching is safe
+    return load_model(model_path)
+
+
+def delete_model(model_path):
+    try:
+        os.unlink(model_path)
+    except FileNotFoundError:
+        pass
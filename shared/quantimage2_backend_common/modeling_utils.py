@@ -1,5 +1,16 @@
-from sklearn.model_selection import RepeatedStratifiedKFold
-from sksurv.metrics import concordance_index_censored
+import math
+
+import numpy as np
+from sklearn.model_selection import RepeatedStratifiedKFold, ParameterGrid
+
+from quantimage2_backend_common.const import (
+    SEARCH_STRATEGIES,
+    HALVING_FACTOR,
+    RANDOM_SEARCH_ITERATIONS,
+)
+
+# Tolerance for considering two risk estimates as tied (same as scikit-survival)
+TIED_TOLERANCE = 1e-8
 
 
 class SurvivalRepeatedStratifiedKFold(RepeatedStratifiedKFold):
@@ -9,6 +20,102 @@ class SurvivalRepeatedStratifiedKFold(RepeatedStratifiedKFold):
             yield train_index, test_index
 
 
+def get_search_n_steps(search_strategy, parameter_grid, n_splits, n_samples, n_classes):
+    """
+    Get the number of fits that the hyper-parameter search will perform
+
+    :param search_strategy: The search strategy (see SEARCH_STRATEGIES)
+    :param parameter_grid: The grid of parameters to explore
+    :param n_splits: The total number of cross-validation splits (folds x repetitions)
+    :param n_samples: The number of training samples
+    :param n_classes: The number of classes (or event values for survival)
+    :returns: The number of fits (one progress step each)
+    """
+    n_candidates = len(ParameterGrid(parameter_grid))
+
+    if SEARCH_STRATEGIES(search_strategy) == SEARCH_STRATEGIES.HALVING:
+        min_resources, n_candidates_per_iteration = get_halving_schedule(
+            n_candidates, n_samples, n_splits, n_classes
+        )
+        n_fits_per_split = sum(n_candidates_per_iteration)
+    elif SEARCH_STRATEGIES(search_strategy) == SEARCH_STRATEGIES.RANDOM:
+        n_fits_per_split = min(RANDOM_SEARCH_ITERATIONS, n_candidates)
+    else:
+        n_fits_per_split = n_candidates
+
+    return n_fits_per_split * n_splits
+
+
+def get_halving_schedule(
+    n_candidates, n_samples, n_splits, n_classes, factor=HALVING_FACTOR
+):
+    """
+    Reproduce the schedule of HalvingGridSearchCV with min_resources="exhaust",
+    so that the number of steps is known before the search is run
+
+    :param n_candidates: The number of parameter combinations to explore
+    :param n_samples: The number of training samples (maximum resources)
+    :param n_splits: The total number of cross-validation splits
+    :param n_classes: The number of classes (or event values for survival)
+    :param factor: The proportion of candidates kept at each iteration (1 / factor)
+    :returns: The number of samples used in the first iteration & the number of
+              candidates evaluated at each iteration
+    """
+    smallest_resources = min(2 * n_splits * n_classes, n_samples)
+
+    n_required_iterations = 1 + math.floor(math.log(n_candidates, factor))
+    min_resources = max(
+        smallest_resources, n_samples // factor ** (n_required_iterations - 1)
+    )
+    n_possible_iterations = 1 + math.floor(
+        math.log(n_samples // min_resources, factor)
+    )
+    n_iterations = min(n_possible_iterations, n_required_iterations)
+
+    n_candidates_per_iteration = [
+        math.ceil(n_candidates / factor**iteration) for iteration in range(n_iterations)
+    ]
+
+    return min_resources, n_candidates_per_iteration
+
+
+def resolve_search_strategy(
+    search_strategy, parameter_grid, n_splits, n_samples, n_classes
+):
+    """
+    Get the search strategy to run, successive halving falls back to a randomized
+    search when its schedule would fit more samples (e.g. small cohorts, where the
+    first iteration already needs most of the samples & the grid is barely reduced)
+
+    :param search_strategy: The requested search strategy (see SEARCH_STRATEGIES)
+    :param parameter_grid: The grid of parameters to explore
+    :param n_splits: The total number of cross-validation splits (folds x repetitions)
+    :param n_samples: The number of training samples
+    :param n_classes: The number of classes (or event values for survival)
+    :returns: The search strategy to run
+    """
+    if SEARCH_STRATEGIES(search_strategy) != SEARCH_STRATEGIES.HALVING:
+        return search_strategy
+
+    n_candidates = len(ParameterGrid(parameter_grid))
+    min_resources, n_candidates_per_iteration = get_halving_schedule(
+        n_candidates, n_samples, n_splits, n_classes
+    )
+
+    # Number of samples fitted on each split by each strategy
+    halving_samples = sum(
+        n_iteration_candidates
+        * min(min_resources * HALVING_FACTOR**iteration, n_samples)
+        for iteration, n_iteration_candidates in enumerate(n_candidates_per_iteration)
+    )
+    random_samples = min(RANDOM_SEARCH_ITERATIONS, n_candidates) * n_samples
+
+    if halving_samples >= random_samples:
+        return SEARCH_STRATEGIES.RANDOM.value
+
+    return search_strategy
+
+
 def c_index_score(y_true, y_pred):
     name_event, name_time = y_true.dtype.names
 
@@ -17,3 +124,254 @@ def c_index_score(y_true, y_pred):
     )
 
     return c_index
+
+
+def batch_c_index_score(y_true, y_pred):
+    """
+    Calculate the concordance index of many resampled test sets at once
+
+    :param y_true: Structured array (n_repetitions x n_samples) with the Event & Time fields
+    :param y_pred: Risk estimates (n_repetitions x n_samples)
+    :returns: The concordance index of each repetition (NaN if it has no comparable pairs)
+    """
+    name_event, name_time = y_true.dtype.names
+
+    concordant, discordant, tied_risk, tied_time = batch_concordance_counts(
+        y_true[name_event], y_true[name_time], y_pred
+    )
+
+    comparable = concordant + discordant + tied_risk
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (concordant + 0.5 * tied_risk) / comparable
+
+
+def concordance_index_censored(
+    event_indicator, event_time, estimate, tied_tol=TIED_TOLERANCE
+):
+    """
+    Drop-in replacement for sksurv.metrics.concordance_index_censored,
+    running in O(n log n) instead of O(n^2)
+
+    Unlike scikit-survival, data without comparable pairs gives a NaN concordance
+    index instead of raising an error, so that a resampled test set without
+    comparable pairs doesn't fail a whole batch of bootstrap repetitions.
+
+    :param event_indicator: Boolean array, True if the event occurred
+    :param event_time: Time of the event or of censoring
+    :param estimate: Estimated risk of experiencing the event
+    :param tied_tol: Tolerance for considering two risk estimates as tied
+    :returns: A tuple with the concordance index & the number of concordant pairs,
+              discordant pairs, pairs tied on the risk estimate & pairs tied on the time
+    """
+    event_indicator = np.asarray(event_indicator)
+    event_time = np.asarray(event_time, dtype=float)
+    estimate = np.asarray(estimate, dtype=float)
+
+    if not (len(event_indicator) == len(event_time) == len(estimate)):
+        raise ValueError("Event indicator, time and estimate must have the same length")
+    if event_indicator.dtype != bool:
+        raise ValueError("Event indicator must be a boolean array")
+    if len(event_time) < 2:
+        raise ValueError("Need a minimum of two samples")
+    if not event_indicator.any():
+        raise ValueError("All samples are censored")
+    if not np.all(np.isfinite(estimate)):
+        raise ValueError("Risk estimates must be finite")
+
+    concordant, discordant, tied_risk, tied_time = batch_concordance_counts(
+        event_indicator[np.newaxis, :],
+        event_time[np.newaxis, :],
+        estimate[np.newaxis, :],
+        tied_tol=tied_tol,
+    )
+    concordant, discordant, tied_risk, tied_time = (
+        concordant[0],
+        discordant[0],
+        tied_risk[0],
+        tied_time[0],
+    )
+
+    comparable = concordant + discordant + tied_risk
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        c_index = (concordant + 0.5 * tied_risk) / comparable
+
+    return c_index, concordant, discordant, tied_risk, tied_time
+
+
+def batch_concordance_counts(
+    event_indicator, event_time, estimate, tied_tol=TIED_TOLERANCE
+):
+    """
+    Count concordant, discordant & tied pairs for many samples at once
+
+    A pair (i, j) is comparable if i experienced the event and j survived
+    longer than i (or was censored at the same time). Samples are sorted by
+    time and inserted in a Fenwick tree (binary indexed tree) indexed by the
+    rank of their risk estimate, from the longest survival to the shortest,
+    so that each event only needs O(log n) operations to count the comparable
+    samples with a lower (or equal) risk. All rows are processed in lockstep.
+
+    :param event_indicator: Boolean array (n_repetitions x n_samples)
+    :param event_time: Time of the event or of censoring (n_repetitions x n_samples)
+    :param estimate: Estimated risk (n_repetitions x n_samples)
+    :param tied_tol: Tolerance for considering two risk estimates as tied
+    :returns: A tuple of arrays (one value per row) with the number of concordant
+              pairs, discordant pairs, pairs tied on risk & pairs tied on time
+    """
+    event_indicator = np.asarray(event_indicator, dtype=bool)
+    event_time = np.asarray(event_time, dtype=float)
+    estimate = np.asarray(estimate, dtype=float)
+
+    n_rows, n_samples = event_time.shape
+
+    # Dense rank (starting at 1) of the estimates, values closer than tied_tol share a rank
+    estimate_order = np.argsort(estimate, axis=1, kind="mergesort")
+    sorted_estimates = np.take_along_axis(estimate, estimate_order, axis=1)
+    sorted_ranks = 1 + np.concatenate(
+        [
+            np.zeros((n_rows, 1), dtype=int),
+            np.cumsum(np.diff(sorted_estimates, axis=1) > tied_tol, axis=1),
+        ],
+        axis=1,
+    )
+    ranks = np.empty_like(sorted_ranks)
+    np.put_along_axis(ranks, estimate_order, sorted_ranks, axis=1)
+
+    # Sort by time, then events before censored samples, then by rank
+    censored = ~event_indicator
+    order = np.lexsort((ranks, censored, event_time), axis=1)
+    time_sorted = np.take_along_axis(event_time, order, axis=1)
+    censored_sorted = np.take_along_axis(censored, order, axis=1)
+    ranks_sorted = np.take_along_axis(ranks, order, axis=1)
+
+    # Last position of the group of samples sharing the same time (+ censoring, + rank)
+    same_time = time_sorted[:, 1:] == time_sorted[:, :-1]
+    same_key = same_time & (censored_sorted[:, 1:] == censored_sorted[:, :-1])
+    same_rank = same_key & (ranks_sorted[:, 1:] == ranks_sorted[:, :-1])
+    time_group_end = _group_end(same_time)
+    key_group_end = _group_end(same_key)
+    rank_group_end = _group_end(same_rank)
+
+    positions = np.arange(n_samples)
+
+    # Samples with a longer time, or censored at the same time as an event
+    comparable = np.where(censored_sorted, 0, n_samples - 1 - key_group_end)
+    tied_time = np.where(censored_sorted, 0, time_group_end - key_group_end)
+
+    # Number of samples already inserted with the same time/censoring & rank
+    # (they should not count as tied on risk)
+    same_key_tied_risk = rank_group_end - positions
+
+    if n_rows == 1:
+        # Plain Python is faster than NumPy for a single row
+        concordant, tied_risk = _fenwick_counts_single(
+            ranks_sorted[0], censored_sorted[0], same_key_tied_risk[0]
+        )
+    else:
+        concordant, tied_risk = _fenwick_counts_batch(
+            ranks_sorted, censored_sorted, same_key_tied_risk
+        )
+
+    comparable = comparable.sum(axis=1)
+    discordant = comparable - concordant - tied_risk
+
+    return concordant, discordant, tied_risk, tied_time.sum(axis=1)
+
+
+def _fenwick_counts_batch(ranks_sorted, censored_sorted, same_key_tied_risk):
+    n_rows, n_samples = ranks_sorted.shape
+    rows = np.arange(n_rows)
+
+    tree = np.zeros((n_rows, n_samples + 1), dtype=int)
+    concordant = np.zeros(n_rows, dtype=int)
+    tied_risk = np.zeros(n_rows, dtype=int)
+
+    for position in range(n_samples - 1, -1, -1):
+        rank = ranks_sorted[:, position]
+        is_event = ~censored_sorted[:, position]
+
+        lower = _fenwick_prefix_sum(tree, rows, rank - 1)
+        lower_or_equal = _fenwick_prefix_sum(tree, rows, rank)
+
+        concordant += np.where(is_event, lower, 0)
+        tied_risk += np.where(
+            is_event, lower_or_equal - lower - same_key_tied_risk[:, position], 0
+        )
+
+        _fenwick_add(tree, rows, rank)
+
+    return concordant, tied_risk
+
+
+def _fenwick_counts_single(ranks_sorted, censored_sorted, same_key_tied_risk):
+    ranks_sorted = ranks_sorted.tolist()
+    censored_sorted = censored_sorted.tolist()
+    same_key_tied_risk = same_key_tied_risk.tolist()
+
+    n_samples = len(ranks_sorted)
+
+    tree = [0] * (n_samples + 1)
+    concordant = 0
+    tied_risk = 0
+
+    for position in range(n_samples - 1, -1, -1):
+        rank = ranks_sorted[position]
+
+        if not censored_sorted[position]:
+            lower = 0
+            index = rank - 1
+            while index > 0:
+                lower += tree[index]
+                index -= index & -index
+
+            lower_or_equal = 0
+            index = rank
+            while index > 0:
+                lower_or_equal += tree[index]
+                index -= index & -index
+
+            concordant += lower
+            tied_risk += lower_or_equal - lower - same_key_tied_risk[position]
+
+        index = rank
+        while index <= n_samples:
+            tree[index] += 1
+            index += index & -index
+
+    return np.array([concordant]), np.array([tied_risk])
+
+
+def _group_end(same_as_next):
+    # For each position, index of the last position of its run of equal values
+    n_rows, n_pairs = same_as_next.shape
+    n_samples = n_pairs + 1
+
+    is_end = np.concatenate(
+        [~same_as_next, np.ones((n_rows, 1), dtype=bool)], axis=1
+    )
+    ends = np.where(is_end, np.arange(n_samples), n_samples - 1)
+
+    return np.minimum.accumulate(ends[:, ::-1], axis=1)[:, ::-1]
+
+
+def _fenwick_prefix_sum(tree, rows, index):
+    total = np.zeros(len(rows), dtype=int)
+    index = index.copy()
+
+    while np.any(index > 0):
+        total += np.where(index > 0, tree[rows, index], 0)
+        index -= index & -index
+
+    return total
+
+
+def _fenwick_add(tree, rows, index):
+    index = index.copy()
+    size = tree.shape[1]
+
+    while np.any(index < size):
+        valid = index < size
+        tree[rows[valid], index[valid]] += 1
+        index[valid] += index[valid] & -index[valid]
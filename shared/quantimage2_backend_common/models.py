@@ -176,6 +176,9 @@ class FeatureExtraction(BaseModel, db.Model):
     # Extraction configuration file
     config_file = db.Column(db.String(255))
 
+    # Hash of the extraction configuration & ROIs (for incremental extractions)
+    config_hash = db.Column(db.String(64), nullable=True)
+
     # Data splitting type
     data_splitting_type = db.Column(
         db.String(255), default=DATA_SPLITTING_TYPES.TRAINTESTSPLIT.value
@@ -255,6 +258,20 @@ class FeatureExtraction(BaseModel, db.Model):
 
         return query_result
 
+    @classmethod
+    def find_latest_by_user_album_and_config(cls, user_id, album_id, config_hash):
+        query_result = (
+            cls.query.filter(
+                cls.user_id == user_id,
+                cls.album_id == album_id,
+                cls.config_hash == config_hash,
+            )
+            .order_by(db.desc(FeatureExtraction.id))
+            .first()
+        )
+
+        return query_result
+
     @classmethod
     def find_by_user(cls, user_id):
         query_results = cls.query.filter(cls.user_id == user_id).all()
@@ -355,6 +372,11 @@ class FeatureExtractionTask(BaseModel, db.Model):
     # Associate feature extraction task with feature values
     feature_values = db.relationship("FeatureValue")
 
+    # Associate feature extraction task with the timings of its stages
+    timings = db.relationship(
+        "FeatureExtractionTaskTiming", back_populates="feature_extraction_task"
+    )
+
     @classmethod
     def find_by_user(cls, user_id):
         query_results = (
@@ -386,6 +408,69 @@ class FeatureExtractionTask(BaseModel, db.Model):
 
         return latest_task
 
+    @classmethod
+    def find_successful_by_extraction(cls, feature_extraction_id):
+        # Only the tasks that succeeded have stored feature values
+        query_results = cls.query.filter(
+            cls.feature_extraction_id == feature_extraction_id,
+            cls.feature_values.any(),
+        ).all()
+
+        return query_results
+
+    @classmethod
+    def find_pending_after(
+        cls, feature_extraction_id, feature_extraction_task_id, limit
+    ):
+        # Tasks are created in the order they are queued (see create_tasks_batch)
+        query_results = (
+            cls.query.filter(
+                cls.feature_extraction_id == feature_extraction_id,
+                cls.id > feature_extraction_task_id,
+                ~cls.feature_values.any(),
+            )
+            .order_by(cls.id)
+            .limit(limit)
+            .all()
+        )
+
+        return query_results
+
+    @classmethod
+    def create_tasks_batch(cls, feature_extraction_id, study_uids, task_ids=None):
+        """
+        Create the tasks of a feature extraction in bulk (without committing)
+
+        :param feature_extraction_id: The ID of the Feature Extraction
+        :param study_uids: The UIDs of the studies to extract
+        :param task_ids: The Celery task IDs of the studies (optional)
+        :returns: The IDs of the created tasks, in the same order as the study UIDs
+        """
+        if task_ids is None:
+            task_ids = [None] * len(study_uids)
+
+        db.session.bulk_insert_mappings(
+            cls,
+            [
+                {
+                    "feature_extraction_id": feature_extraction_id,
+                    "study_uid": study_uid,
+                    "task_id": task_id,
+                }
+                for study_uid, task_id in zip(study_uids, task_ids)
+            ],
+        )
+
+        # The auto-incremented IDs follow the insertion order
+        task_ids = (
+            db.session.query(cls.id)
+            .filter(cls.feature_extraction_id == feature_extraction_id)
+            .order_by(cls.id)
+            .all()
+        )
+
+        return [task_id for task_id, in task_ids]
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -397,6 +482,83 @@ class FeatureExtractionTask(BaseModel, db.Model):
         }
 
 
+# Duration of a stage of a feature extraction task (download, extract, store, ...)
+class FeatureExtractionTaskTiming(BaseModel, db.Model):
+    def __init__(
+        self,
+        feature_extraction_task_id,
+        attempt,
+        stage,
+        duration,
+        bytes=None,
+        rows=None,
+        failed=False,
+    ):
+        self.feature_extraction_task_id = feature_extraction_task_id
+        self.attempt = attempt
+        self.stage = stage
+        self.duration = duration
+        self.bytes = bytes
+        self.rows = rows
+        self.failed = failed
+
+    # Attempt of the task (see register_attempt)
+    attempt = db.Column(db.Integer, nullable=False)
+
+    # Name of the stage (see extraction_timing)
+    stage = db.Column(db.String(32), nullable=False)
+
+    # Duration of the stage (in seconds)
+    duration = db.Column(db.Float, nullable=False)
+
+    # Size of the data processed by the stage (in bytes)
+    bytes = db.Column(db.BigInteger, nullable=True)
+
+    # Number of rows processed by the stage (e.g. feature values)
+    rows = db.Column(db.Integer, nullable=True)
+
+    # Whether the stage raised an error
+    failed = db.Column(db.Boolean, nullable=False, default=False)
+
+    # Associate timing with a feature extraction task
+    feature_extraction_task_id = db.Column(
+        db.Integer,
+        ForeignKey(
+            "feature_extraction_task.id", ondelete="CASCADE", onupdate="CASCADE"
+        ),
+    )
+    feature_extraction_task = db.relationship(
+        "FeatureExtractionTask", back_populates="timings"
+    )
+
+    @classmethod
+    def find_by_extraction(cls, feature_extraction_id):
+        query_results = (
+            cls.query.join(FeatureExtractionTask)
+            .filter(
+                FeatureExtractionTask.feature_extraction_id == feature_extraction_id
+            )
+            .all()
+        )
+
+        return query_results
+
+    @classmethod
+    def save_timings_batch(cls, feature_extraction_task_id, attempt, timings):
+        db.session.bulk_insert_mappings(
+            cls,
+            [
+                {
+                    **timing,
+                    "feature_extraction_task_id": feature_extraction_task_id,
+                    "attempt": attempt,
+                }
+                for timing in timings
+            ],
+        )
+        db.session.commit()
+
+
 # One type of feature
 class FeatureDefinition(BaseModel, db.Model):
     def __init__(self, name):
@@ -457,6 +619,84 @@ class FeatureValue(BaseModel, db.Model):
         db.session.bulk_insert_mappings(cls, feature_instances)
         db.session.commit()
 
+    @classmethod
+    def replace_task_features_batch(cls, feature_extraction_task_id, feature_instances):
+        """
+        Replace the feature values of a task in a single transaction, so that a
+        retried task never leaves duplicate or partial values
+
+        :param feature_extraction_task_id: The ID of the Feature Extraction Task
+        :param feature_instances: The feature values to save (as dictionaries)
+        """
+        try:
+            db.session.query(cls).filter(
+                cls.feature_extraction_task_id == feature_extraction_task_id
+            ).delete(synchronize_session=False)
+            db.session.bulk_insert_mappings(cls, feature_instances)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    @classmethod
+    def copy_features_batch(
+        cls, previous_extraction_id, feature_extraction_id, study_uids
+    ):
+        """
+        Copy the feature values of some studies from a previous extraction to the
+        tasks of a new extraction, in a single statement (without committing)
+
+        :param previous_extraction_id: The ID of the Feature Extraction to copy from
+        :param feature_extraction_id: The ID of the Feature Extraction to copy to
+        :param study_uids: The UIDs of the studies to copy
+        """
+        feature_value = cls.__table__
+        previous_task = FeatureExtractionTask.__table__.alias("previous_task")
+        now = datetime.datetime.utcnow()
+        new_task = FeatureExtractionTask.__table__.alias("new_task")
+
+        copied_features = (
+            db.select(
+                [
+                    feature_value.c.value,
+                    feature_value.c.feature_definition_id,
+                    new_task.c.id,
+                    feature_value.c.modality_id,
+                    feature_value.c.roi_id,
+                    db.literal(now),
+                    db.literal(now),
+                ]
+            )
+            .select_from(
+                feature_value.join(
+                    previous_task,
+                    feature_value.c.feature_extraction_task_id == previous_task.c.id,
+                ).join(new_task, new_task.c.study_uid == previous_task.c.study_uid)
+            )
+            .where(
+                db.and_(
+                    previous_task.c.feature_extraction_id == previous_extraction_id,
+                    new_task.c.feature_extraction_id == feature_extraction_id,
+                    previous_task.c.study_uid.in_(study_uids),
+                )
+            )
+        )
+
+        db.session.execute(
+            feature_value.insert().from_select(
+                [
+                    "value",
+                    "feature_definition_id",
+                    "feature_extraction_task_id",
+                    "modality_id",
+                    "roi_id",
+                    "created_at",
+                    "updated_at",
+                ],
+                copied_features,
+            )
+        )
+
     @classmethod
     def get_for_collection(cls, collection):
 
@@ -995,8 +1235,8 @@ class Model(BaseModel, db.Model):
     # Patients used for testing the model (OPTIONAL)
     test_patient_ids = db.Column(db.JSON, nullable=True, unique=False)
 
-    # Path to pickled version of the model
-    model_path = db.Column(db.String(255), nullable=False, unique=True)
+    # Path to pickled version of the model (shared by identical models)
+    model_path = db.Column(db.String(255), nullable=False, unique=False)
 
     # Model metrics (JSON) - Training
     training_metrics = db.Column(db.JSON, nullable=True, unique=False)
@@ -1041,6 +1281,11 @@ class Model(BaseModel, db.Model):
         instances = cls.query.filter_by(user_id=user_id).all()
         return instances
 
+    @classmethod
+    def find_by_model_path(cls, model_path):
+        instances = cls.query.filter_by(model_path=model_path).all()
+        return instances
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -1069,6 +1314,43 @@ class Model(BaseModel, db.Model):
         }
 
 
+# Cross-validation scores of a candidate (pipeline + parameters) of a hyper-parameter search
+class CandidateCVResult(BaseModel, db.Model):
+    def __init__(self, fingerprint, scores, fit_times):
+        self.fingerprint = fingerprint
+        self.scores = scores
+        self.fit_times = fit_times
+
+    # Hash of the training data, the CV splits & the candidate (see get_candidate_fingerprint)
+    fingerprint = db.Column(db.String(64), nullable=False, unique=True)
+
+    # Score of each split, by metric
+    scores = db.Column(db.JSON, nullable=False, unique=False)
+
+    # Fit time of each split
+    fit_times = db.Column(db.JSON, nullable=False, unique=False)
+
+    @classmethod
+    def find_by_fingerprints(cls, fingerprints):
+        instances = cls.query.filter(cls.fingerprint.in_(fingerprints)).all()
+        return {instance.fingerprint: instance for instance in instances}
+
+    @classmethod
+    def save_results_batch(cls, results):
+        # Results may have been saved in the meantime by an identical training
+        existing = cls.find_by_fingerprints([r["fingerprint"] for r in results])
+        new_results = [r for r in results if r["fingerprint"] not in existing]
+
+        if not new_results:
+            return
+
+        try:
+            db.session.bulk_insert_mappings(cls, new_results)
+            db.session.commit()
+        except sqlalchemy.exc.IntegrityError:
+            db.session.rollback()
+
+
 # Data Label Category
 class LabelCategory(BaseModel, db.Model):
     def __init__(self, album_id, label_type, name, user_id, pos_label=None):
@@ -0,0 +1,48 @@
+"""
+Upgrades of the existing tables, applied when the webapp starts (db.create_all
+only creates the missing tables). Each upgrade checks whether it is still
+needed, so that all of them can run on every start.
+"""
+from sqlalchemy import MetaData, Table
+
+from quantimage2_backend_common.models import FeatureExtraction, Model
+
+
+def upgrade_schema(engine):
+    for upgrade in SCHEMA_UPGRADES:
+        upgrade(engine)
+
+
+def reflect_table(engine, table_name):
+    # Current state of the table in the database (not the state of the models)
+    return Table(
+        table_name,
+        MetaData(),
+        autoload=True,
+        autoload_with=engine,
+        resolve_fks=False,
+    )
+
+
+def drop_model_path_unique_index(engine):
+    # Identical models share the same file in the model store
+    table = reflect_table(engine, Model.__tablename__)
+
+    for index in list(table.indexes):
+        if index.unique and [column.name for column in index.columns] == ["model_path"]:
+            print(f"Dropping unique index {index.name} of {table.name}.model_path")
+            index.drop(bind=engine)
+
+
+def add_feature_extraction_config_hash(engine):
+    # Incremental extractions look up the previous extraction by its config hash
+    table = reflect_table(engine, FeatureExtraction.__tablename__)
+
+    if "config_hash" not in table.columns:
+        print(f"Adding column {table.name}.config_hash")
+        engine.execute(
+            f"ALTER TABLE {table.name} ADD COLUMN config_hash VARCHAR(64) NULL"
+        )
+
+
+SCHEMA_UPGRADES = [drop_model_path_unique_index, add_feature_extraction_config_hash]
@@ -0,0 +1,88 @@
+import os
+import shutil
+import uuid
+
+import joblib
+import numpy as np
+
+# Shared volume between the webapp & the workers
+TRAINING_DATA_BASE_DIR = "/quantimage2-data/training-data"
+
+TRAINING_DATA_EXTENSION = ".npy"
+
+# Settings of the training that grow with the data (e.g. feature names, patients)
+# or are objects (e.g. pipeline, cross-validation), kept out of the task messages
+TRAINING_SETTING_EXTENSION = ".joblib"
+
+# Sub-directory caching the preprocessing transforms of the training
+TRANSFORM_CACHE_DIR = "transform-cache"
+
+
+def save_training_data(training_id, settings=None, **arrays):
+    """
+    Save the arrays & settings used for training a model to the shared volume,
+    so that only their location needs to be sent to the training worker
+
+    :param training_id: The ID of the training (used as a prefix of the directory)
+    :param settings: The settings to save, by name (see save_training_settings)
+    :param arrays: The arrays to save, by name (None values are skipped)
+    :returns: The path of the directory containing the arrays & settings
+    """
+    training_data_dir = os.path.join(
+        TRAINING_DATA_BASE_DIR, f"{training_id}-{uuid.uuid4().hex}"
+    )
+    os.makedirs(training_data_dir, exist_ok=True)
+
+    for name, array in arrays.items():
+        if array is None:
+            continue
+
+        np.save(
+            os.path.join(training_data_dir, f"{name}{TRAINING_DATA_EXTENSION}"),
+            np.asarray(array),
+            allow_pickle=False,
+        )
+
+    save_training_settings(training_data_dir, **(settings or {}))
+
+    return training_data_dir
+
+
+def save_training_settings(training_data_dir, **settings):
+    for name, value in settings.items():
+        joblib.dump(
+            value,
+            os.path.join(training_data_dir, f"{name}{TRAINING_SETTING_EXTENSION}"),
+        )
+
+
+def load_training_setting(training_data_dir, name):
+    return joblib.load(
+        os.path.join(training_data_dir, f"{name}{TRAINING_SETTING_EXTENSION}")
+    )
+
+
+def load_training_data(training_data_dir, name):
+    """
+    Load an array saved by save_training_data as a read-only memory-map,
+    which joblib passes to its workers by reference instead of copying it
+
+    :param training_data_dir: The path of the directory containing the arrays
+    :param name: The name of the array to load
+    :returns: The memory-mapped array (None if it was not saved)
+    """
+    array_path = os.path.join(training_data_dir, f"{name}{TRAINING_DATA_EXTENSION}")
+
+    if not os.path.exists(array_path):
+        return None
+
+    return np.load(array_path, mmap_mode="r", allow_pickle=False)
+
+
+def get_transform_cache_dir(training_data_dir):
+    # Stored with the training data so that all training workers share it
+    return os.path.join(training_data_dir, TRANSFORM_CACHE_DIR)
+
+
+def delete_training_data(training_data_dir):
+    shutil.rmtree(training_data_dir, True)
@@ -0,0 +1,128 @@
+import json
+import os
+from functools import lru_cache
+
+import redis
+
+TRAINING_LOCK_PREFIX = "training-lock:"
+
+# The tasks of a training refresh its lock (see refresh_training_lock), so that
+# the lock of a training whose tasks stopped (e.g. worker crash) expires quickly
+TRAINING_LOCK_TIMEOUT = 30 * 60
+
+TRAINING_RUNS_PREFIX = "training-runs:"
+
+# Runs are unregistered once complete, this only forgets the runs of crashed workers
+TRAINING_RUNS_TIMEOUT = 24 * 60 * 60
+
+# Get the lock, or the training holding it if it is already taken
+ACQUIRE_LOCK_SCRIPT = """
+if redis.call("set", KEYS[1], ARGV[1], "NX", "EX", ARGV[2]) then
+    return false
+end
+return redis.call("get", KEYS[1])
+"""
+
+# Release & refresh the lock only while it is held by the same run of the training
+# (a late task of a previous run must not release the lock of a newer run)
+RELEASE_LOCK_SCRIPT = """
+local lock = redis.call("get", KEYS[1])
+if lock and cjson.decode(lock)["run-id"] == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+REFRESH_LOCK_SCRIPT = """
+local lock = redis.call("get", KEYS[1])
+if lock and cjson.decode(lock)["run-id"] == ARGV[1] then
+    return redis.call("expire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+@lru_cache(maxsize=None)
+def get_redis_client():
+    # Thread-safe & reconnects after forking, can be shared by all the callers
+    return redis.Redis.from_url(os.environ["CELERY_BROKER_URL"])
+
+
+def acquire_training_lock(training_fingerprint, training_id, n_steps, run_id):
+    """
+    Make sure that only one training with a given fingerprint runs at a time
+
+    :param training_fingerprint: The fingerprint of the training (data, labels, splits & search)
+    :param training_id: The ID of the training (used for progress reports)
+    :param n_steps: The number of progress steps of the training
+    :param run_id: The unique ID of this run of the training (owner of the lock)
+    :returns: None if the lock was acquired, otherwise the training ID, number
+              of steps & run ID of the identical training that is already running
+    """
+    running_training = json.dumps(
+        {"training-id": training_id, "n-steps": n_steps, "run-id": run_id}
+    )
+
+    existing_training = get_redis_client().eval(
+        ACQUIRE_LOCK_SCRIPT,
+        1,
+        f"{TRAINING_LOCK_PREFIX}{training_fingerprint}",
+        running_training,
+        TRAINING_LOCK_TIMEOUT,
+    )
+
+    return json.loads(existing_training) if existing_training else None
+
+
+def refresh_training_lock(training_fingerprint, run_id):
+    if training_fingerprint is None:
+        return
+
+    get_redis_client().eval(
+        REFRESH_LOCK_SCRIPT,
+        1,
+        f"{TRAINING_LOCK_PREFIX}{training_fingerprint}",
+        run_id,
+        TRAINING_LOCK_TIMEOUT,
+    )
+
+
+def release_training_lock(training_fingerprint, run_id):
+    if training_fingerprint is None:
+        return
+
+    get_redis_client().eval(
+        RELEASE_LOCK_SCRIPT, 1, f"{TRAINING_LOCK_PREFIX}{training_fingerprint}", run_id
+    )
+
+
+def register_training_run(user_id, training_id, run_id, training_fingerprint):
+    # Keep the runs of a training that are still running, so the user can cancel them
+    key = f"{TRAINING_RUNS_PREFIX}{user_id}:{training_id}"
+
+    pipeline = get_redis_client().pipeline()
+    pipeline.hset(key, run_id, training_fingerprint)
+    pipeline.expire(key, TRAINING_RUNS_TIMEOUT)
+    pipeline.execute()
+
+
+def get_training_runs(user_id, training_id):
+    """
+    Get the runs of a training that are still running
+
+    :param user_id: The ID of the user running the training
+    :param training_id: The ID of the training (same for all its runs)
+    :returns: The fingerprint of each run, by run ID
+    """
+    runs = get_redis_client().hgetall(f"{TRAINING_RUNS_PREFIX}{user_id}:{training_id}")
+
+    return {
+        run_id.decode(): training_fingerprint.decode()
+        for run_id, training_fingerprint in runs.items()
+    }
+
+
+def unregister_training_run(user_id, training_id, run_id):
+    if run_id is None:
+        return
+
+    get_redis_client().hdel(f"{TRAINING_RUNS_PREFIX}{user_id}:{training_id}", run_id)
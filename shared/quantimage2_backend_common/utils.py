@@ -8,14 +8,12 @@ from enum import Enum
 from pathlib import Path
 
 import numpy as np
-from sklearn.model_selection import RepeatedStratifiedKFold
 from ttictoc import tic, toc
 
 import celery.states as celerystates
 import requests
 from celery import Celery
 from flask import jsonify
-from numpy.core.records import ndarray
 
 from quantimage2_backend_common.models import FeatureExtraction
 
@@ -249,12 +247,16 @@ def get_socketio_body_feature_task(
     return socketio_body
 
 
-def get_socketio_body_extraction(feature_extraction_id, status):
+def get_socketio_body_extraction(feature_extraction_id, status, status_message=None):
     socketio_body = {
         "feature_extraction_id": feature_extraction_id,
         "status": status,
     }
 
+    if status_message:
+        # Progress of the extraction launch (before its tasks are started)
+        socketio_body["status_message"] = status_message
+
     return socketio_body
 
 
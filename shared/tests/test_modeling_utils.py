@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+from sksurv.metrics import concordance_index_censored as sksurv_concordance_index
+
+from quantimage2_backend_common.modeling_utils import (
+    TIED_TOLERANCE,
+    batch_c_index_score,
+    batch_concordance_counts,
+    concordance_index_censored,
+)
+
+SEEDS = range(20)
+
+
+def make_survival_data(random_state, n_samples):
+    # Few distinct times & rounded risks, so that there are ties of both kinds
+    event_indicator = random_state.rand(n_samples) < 0.6
+    event_indicator[random_state.randint(n_samples)] = True
+    event_time = random_state.randint(1, n_samples // 2 + 2, size=n_samples)
+    estimate = np.round(random_state.randn(n_samples), 1)
+
+    return event_indicator, event_time.astype(float), estimate
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("n_samples", [2, 5, 30, 200])
+def test_concordance_index_matches_sksurv(seed, n_samples):
+    random_state = np.random.RandomState(seed)
+    event_indicator, event_time, estimate = make_survival_data(random_state, n_samples)
+
+    try:
+        expected = sksurv_concordance_index(event_indicator, event_time, estimate)
+    except ValueError:
+        # No comparable pairs, see test_concordance_index_no_comparable_pairs
+        pytest.skip("No comparable pairs")
+
+    result = concordance_index_censored(event_indicator, event_time, estimate)
+
+    assert result[0] == pytest.approx(expected[0], nan_ok=True)
+    assert tuple(result[1:]) == tuple(expected[1:])
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_concordance_index_tied_tolerance(seed):
+    random_state = np.random.RandomState(seed)
+    event_indicator, event_time, estimate = make_survival_data(random_state, 50)
+
+    # Risks closer than the tolerance are tied
+    estimate = estimate + random_state.choice([0, TIED_TOLERANCE / 10], size=50)
+
+    expected = sksurv_concordance_index(event_indicator, event_time, estimate)
+    result = concordance_index_censored(event_indicator, event_time, estimate)
+
+    assert result[0] == pytest.approx(expected[0], nan_ok=True)
+    assert tuple(result[1:]) == tuple(expected[1:])
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_batch_concordance_counts_match_sksurv(seed):
+    random_state = np.random.RandomState(seed)
+    rows = [make_survival_data(random_state, 40) for _ in range(10)]
+    event_indicator, event_time, estimate = map(np.array, zip(*rows))
+
+    concordant, discordant, tied_risk, tied_time = batch_concordance_counts(
+        event_indicator, event_time, estimate
+    )
+
+    for row, (row_event, row_time, row_estimate) in enumerate(rows):
+        expected = sksurv_concordance_index(row_event, row_time, row_estimate)
+
+        assert (concordant[row], discordant[row], tied_risk[row], tied_time[row]) == (
+            expected[1:]
+        )
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_batch_c_index_score_matches_sksurv(seed):
+    random_state = np.random.RandomState(seed)
+    rows = [make_survival_data(random_state, 40) for _ in range(10)]
+
+    y_true = np.array(
+        [list(zip(row_event, row_time)) for row_event, row_time, _ in rows],
+        dtype=[("Event", bool), ("Time", float)],
+    )
+    y_pred = np.array([row_estimate for _, _, row_estimate in rows])
+
+    expected = [sksurv_concordance_index(*row)[0] for row in rows]
+
+    assert batch_c_index_score(y_true, y_pred) == pytest.approx(expected)
+
+
+def test_concordance_index_no_comparable_pairs():
+    # The only event has the longest time, no sample survived longer
+    event_indicator = np.array([False, False, True])
+    event_time = np.array([1.0, 2.0, 3.0])
+    estimate = np.array([0.1, 0.2, 0.3])
+
+    with pytest.raises(ValueError):
+        sksurv_concordance_index(event_indicator, event_time, estimate)
+
+    # Deliberately NaN instead of an error, so that a bootstrap repetition
+    # without comparable pairs doesn't fail the whole batch
+    c_index, concordant, discordant, tied_risk, tied_time = concordance_index_censored(
+        event_indicator, event_time, estimate
+    )
+
+    assert np.isnan(c_index)
+    assert (concordant, discordant, tied_risk, tied_time) == (0, 0, 0, 0)
+
+
+@pytest.mark.parametrize(
+    "event_indicator, event_time, estimate",
+    [
+        ([True, False], [1.0, 2.0, 3.0], [0.1, 0.2, 0.3]),
+        ([1, 0, 1], [1.0, 2.0, 3.0], [0.1, 0.2, 0.3]),
+        ([True], [1.0], [0.1]),
+        ([False, False], [1.0, 2.0], [0.1, 0.2]),
+        ([True, False], [1.0, 2.0], [0.1, np.nan]),
+    ],
+)
+def test_concordance_index_invalid_input(event_indicator, event_time, estimate):
+    with pytest.raises(ValueError):
+        concordance_index_censored(
+            np.array(event_indicator), np.array(event_time), np.array(estimate)
+        )
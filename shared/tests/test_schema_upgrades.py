@@ -0,0 +1,117 @@
+import pytest
+from flask import Flask
+from sklearn.linear_model import LogisticRegression
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from quantimage2_backend_common import model_store
+from quantimage2_backend_common.model_store import save_model
+from quantimage2_backend_common.models import FeatureExtraction, Model, db
+from quantimage2_backend_common.schema_upgrades import upgrade_schema
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'db.sqlite'}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+
+    with app.app_context():
+        # Only the upgraded tables (the others use MySQL collations)
+        Model.metadata.create_all(
+            bind=db.engine, tables=[Model.__table__, FeatureExtraction.__table__]
+        )
+
+        # Tables created before the model store had a unique model path
+        db.engine.execute("CREATE UNIQUE INDEX model_path ON model (model_path)")
+
+        # Tables created before incremental extractions had no config hash
+        db.engine.execute("ALTER TABLE feature_extraction DROP COLUMN config_hash")
+
+        yield db
+
+        db.session.remove()
+
+
+def save_trained_model(model_path):
+    Model(
+        "Model",
+        "LogisticRegression",
+        None,
+        None,
+        None,
+        None,
+        None,
+        None,
+        ["feature"],
+        ["P1", "P2"],
+        None,
+        model_path,
+        None,
+        None,
+        "user-id",
+        "album-id",
+        None,
+        None,
+    ).save_to_db()
+
+
+def test_save_identical_models(legacy_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(model_store, "MODELS_BASE_DIR", str(tmp_path / "models"))
+
+    estimator = LogisticRegression().fit([[0.0], [1.0]], [0, 1])
+    model_paths = [
+        save_model(estimator, {"feature_names": ["feature"]}, "user-id", "album-id")
+        for _ in range(2)
+    ]
+
+    # Identical models share the same file
+    assert model_paths[0] == model_paths[1]
+
+    save_trained_model(model_paths[0])
+
+    with pytest.raises(IntegrityError):
+        save_trained_model(model_paths[1])
+
+    legacy_db.session.rollback()
+
+    upgrade_schema(legacy_db.engine)
+
+    save_trained_model(model_paths[1])
+
+    assert len(Model.find_by_model_path(model_paths[0])) == 2
+
+
+def test_add_feature_extraction_config_hash(legacy_db):
+    with pytest.raises(OperationalError):
+        FeatureExtraction.find_latest_by_user_album_and_config(
+            "user-id", "album-id", "config-hash"
+        )
+
+    legacy_db.session.rollback()
+
+    upgrade_schema(legacy_db.engine)
+
+    extraction = FeatureExtraction("user-id", "album-id")
+    extraction.config_hash = "config-hash"
+    extraction.save_to_db()
+
+    assert (
+        FeatureExtraction.find_latest_by_user_album_and_config(
+            "user-id", "album-id", "config-hash"
+        )
+        == extraction
+    )
+
+
+def test_upgrade_schema_is_idempotent(legacy_db):
+    upgrade_schema(legacy_db.engine)
+    upgrade_schema(legacy_db.engine)
+
+    inspector = inspect(legacy_db.engine)
+
+    assert not any(index["unique"] for index in inspector.get_indexes("model"))
+    assert "config_hash" in [
+        column["name"] for column in inspector.get_columns("feature_extraction")
+    ]
@@ -0,0 +1,62 @@
+import numpy as np
+from sklearn.model_selection import RepeatedStratifiedKFold
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from quantimage2_backend_common import training_data
+from quantimage2_backend_common.training_data import (
+    load_training_data,
+    load_training_setting,
+    save_training_data,
+    save_training_settings,
+)
+
+
+def test_training_data_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(training_data, "TRAINING_DATA_BASE_DIR", str(tmp_path))
+
+    X_train = np.arange(12.0).reshape(4, 3)
+    cv = RepeatedStratifiedKFold(n_splits=2, n_repeats=2, random_state=42)
+
+    training_data_dir = save_training_data(
+        "training-id",
+        settings={
+            "feature_names": ["CT-GTV-a", "CT-GTV-b", "CT-GTV-c"],
+            "training_patients": ["P1", "P2", "P3", "P4"],
+            "pipeline": Pipeline([("preprocessor", StandardScaler())]),
+            "cv": cv,
+        },
+        X_train=X_train,
+        X_test=None,
+    )
+
+    np.testing.assert_array_equal(
+        load_training_data(training_data_dir, "X_train"), X_train
+    )
+    assert load_training_data(training_data_dir, "X_test") is None
+
+    assert load_training_setting(training_data_dir, "training_patients") == [
+        "P1",
+        "P2",
+        "P3",
+        "P4",
+    ]
+    assert isinstance(
+        load_training_setting(training_data_dir, "pipeline")["preprocessor"],
+        StandardScaler,
+    )
+
+    # Same splits as the original cross-validation object
+    y = np.array([0, 1, 0, 1])
+    loaded_cv = load_training_setting(training_data_dir, "cv")
+
+    for (train_index, test_index), (expected_train, expected_test) in zip(
+        loaded_cv.split(X_train, y), cv.split(X_train, y)
+    ):
+        np.testing.assert_array_equal(train_index, expected_train)
+        np.testing.assert_array_equal(test_index, expected_test)
+
+    # Settings added later by the worker (e.g. the splits of the fits)
+    save_training_settings(training_data_dir, splits=list(cv.split(X_train, y)))
+
+    assert len(load_training_setting(training_data_dir, "splits")) == 4
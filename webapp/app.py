@@ -25,6 +25,7 @@ from flask import jsonify
 
 from quantimage2_backend_common.flask_init import create_app
 from quantimage2_backend_common.models import db
+from quantimage2_backend_common.schema_upgrades import upgrade_schema
 from quantimage2_backend_common.utils import InvalidUsage
 
 # Routes
@@ -37,6 +38,7 @@ from routes.labels import bp as labels_bp
 from routes.charts import bp as charts_bp
 from routes.navigation_history import bp as navigation_bp
 from routes.albums import bp as albums_bp
+from routes.metrics import bp as metrics_bp
 
 print("App is Starting!")
 
@@ -121,6 +123,9 @@ def setup_app(app):
 
     db.create_all(app=app)
 
+    # Changes of the existing tables, which create_all doesn't apply
+    upgrade_schema(db.get_engine(app))
+
     # Celery
     # set broker url and result backend from app config
     # Create celery
@@ -149,6 +154,7 @@ def setup_app(app):
         app.register_blueprint(charts_bp)
         app.register_blueprint(navigation_bp)
         app.register_blueprint(albums_bp)
+        app.register_blueprint(metrics_bp)
 
 
 if __name__ == "__main__":
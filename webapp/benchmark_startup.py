@@ -0,0 +1,91 @@
+"""
+Measure the startup cost of the webapp (import time & memory) and check
+that the machine learning stack is not loaded until it is needed
+
+Usage (in the webapp container): python benchmark_startup.py
+Exits with an error if one of the lazily-loaded packages is imported at startup.
+"""
+import re
+import resource
+import subprocess
+import sys
+
+# Packages that should only be imported on first use
+LAZY_PACKAGES = ["sklearn", "sksurv", "melampus", "pandas", "requests_toolbelt"]
+
+# Number of slowest imports to report
+N_SLOWEST_IMPORTS = 15
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(.+)")
+
+LOADED_PACKAGES_PREFIX = "Loaded packages:"
+
+CHECK_SCRIPT = f"""
+import sys
+import app
+loaded = [p for p in {LAZY_PACKAGES!r} if p in sys.modules]
+print("{LOADED_PACKAGES_PREFIX}" + ",".join(loaded))
+"""
+
+
+def run_startup():
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHECK_SCRIPT],
+        capture_output=True,
+        text=True,
+    )
+
+    if process.returncode != 0:
+        print(process.stderr)
+        sys.exit(process.returncode)
+
+    loaded_packages = [
+        line[len(LOADED_PACKAGES_PREFIX) :]
+        for line in process.stdout.splitlines()
+        if line.startswith(LOADED_PACKAGES_PREFIX)
+    ][0]
+
+    # Maximum resident set size of the child process (in kilobytes on Linux)
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    return process.stderr, loaded_packages, max_rss
+
+
+def parse_import_times(import_time_output):
+    # Top-level imports (no indentation) with their cumulative time (in microseconds)
+    import_times = []
+
+    for line in import_time_output.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+
+        if match:
+            self_time, cumulative_time, indent, module = match.groups()
+            import_times.append((int(cumulative_time), len(indent) == 1, module))
+
+    return import_times
+
+
+def main():
+    import_time_output, loaded_packages, max_rss = run_startup()
+    import_times = parse_import_times(import_time_output)
+
+    total_time = sum(
+        cumulative for cumulative, top_level, module in import_times if top_level
+    )
+
+    print(f"Total import time: {total_time / 1e6:.2f}s")
+    print(f"Max RSS: {max_rss / 1024:.1f}MB")
+    print("Slowest imports:")
+
+    for cumulative, top_level, module in sorted(import_times, reverse=True)[
+        :N_SLOWEST_IMPORTS
+    ]:
+        print(f"  {cumulative / 1e6:.3f}s {module.strip()}")
+
+    if loaded_packages:
+        print(f"Packages loaded at startup (should be lazy): {loaded_packages}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,27 @@
 import abc
+import uuid
 
+import joblib
 import numpy
 from flask import current_app, g
-from sklearn.model_selection import GridSearchCV, ParameterGrid
 from ttictoc import tic, toc
 
 from quantimage2_backend_common.const import (
     DATA_SPLITTING_TYPES,
     QUEUE_TRAINING,
     MODEL_TYPES,
+    SEARCH_STRATEGIES,
+)
+from quantimage2_backend_common.modeling_utils import (
+    get_search_n_steps,
+    resolve_search_strategy,
+)
+from quantimage2_backend_common.training_data import save_training_data
+from quantimage2_backend_common.training_lock import (
+    acquire_training_lock,
+    register_training_run,
+    release_training_lock,
+    unregister_training_run,
 )
 from quantimage2_backend_common.utils import CV_SPLITS
 from modeling.utils import (
@@ -42,6 +55,7 @@ class Modeling:
         refit_metric,
         n_jobs=1,
         training_id,
+        search_strategy=SEARCH_STRATEGIES.GRID.value,
     ):
 
         # Album ID & Other Metadata
@@ -111,6 +125,9 @@ class Modeling:
         # Estimator Step (for scoring calculation)
         self.estimator_step = estimator_step
 
+        # Hyper-parameter search strategy (grid, successive halving, randomized)
+        self.search_strategy = SEARCH_STRATEGIES(search_strategy).value
+
     def is_train_test(self):
         return (
             DATA_SPLITTING_TYPES(self.data_splitting_type)
@@ -148,41 +165,121 @@ class Modeling:
         cv = self.get_cv(n_splits=n_splits)
         scoring = self.get_scoring()
 
-        current_app.my_celery.send_task(
-            "quantimage2tasks.train",
-            kwargs={
-                "feature_extraction_id": self.feature_extraction_id,
-                "collection_id": self.collection_id,
-                "album": self.album,
-                "feature_selection": self.feature_selection,
-                "feature_names": self.feature_names,
-                "pipeline": pipeline,
-                "parameter_grid": parameter_grid,
-                "estimator_step": self.estimator_step,
-                "scoring": scoring,
-                "refit_metric": self.refit_metric,
-                "cv": cv,
-                "n_jobs": self.n_jobs,
-                "X_train": self.X_train,
-                "X_test": self.X_test if self.is_train_test() else None,
-                "label_category": self.label_category,
-                "data_splitting_type": self.data_splitting_type,
-                "train_test_splitting_type": self.train_test_splitting_type,
-                "training_patients": self.training_patients,
-                "test_patients": self.test_patients,
-                "y_train_encoded": y_train_encoded,
-                "y_test_encoded": y_test_encoded if self.is_train_test() else None,
-                "is_train_test": self.is_train_test(),
-                "random_seed": self.random_seed,
-                "training_id": self.training_id,
-                "user_id": g.user,
-            },
-            serializer="pickle",
-            queue=QUEUE_TRAINING,
+        # Successive halving doesn't pay off with small cohorts
+        search_strategy = resolve_search_strategy(
+            self.search_strategy,
+            parameter_grid,
+            cv.get_n_splits(),
+            len(self.X_train),
+            len(unique),
+        )
+        if search_strategy != self.search_strategy:
+            print(
+                f"Running a {search_strategy} search instead of {self.search_strategy},"
+                f" which would fit more samples"
+            )
+            self.search_strategy = search_strategy
+
+        n_steps = get_search_n_steps(
+            self.search_strategy,
+            parameter_grid,
+            cv.get_n_splits(),
+            len(self.X_train),
+            len(unique),
         )
 
-        pg = ParameterGrid(parameter_grid)
-        n_steps = len(pg) * cv.get_n_splits()
+        X_train = numpy.asarray(self.X_train, dtype=float)
+        X_test = None
+        if self.is_train_test():
+            X_test = numpy.asarray(self.X_test, dtype=float)
+        else:
+            y_test_encoded = None
+
+        # Identical trainings (same data, labels, splits & search) only run once
+        # at a time, later requests follow the progress of the running one
+        training_fingerprint = joblib.hash(
+            (
+                X_train,
+                X_test,
+                y_train_encoded,
+                y_test_encoded,
+                self.feature_names,
+                pipeline,
+                parameter_grid,
+                cv,
+                sorted(scoring),
+                self.refit_metric,
+                self.search_strategy,
+                self.label_category.id,
+                self.training_id,
+                g.user,
+            )
+        )
+        # Owner of the lock, a late task of a previous run can't release it
+        run_id = uuid.uuid4().hex
+
+        running_training = acquire_training_lock(
+            training_fingerprint, self.training_id, n_steps, run_id
+        )
+
+        if running_training is not None:
+            print(f"Identical training {running_training['training-id']} is running")
+            return running_training["n-steps"]
+
+        try:
+            # Save the data & the settings to the shared volume, only their location
+            # & the scalar settings are sent to the worker (few KB for any dataset)
+            training_data_dir = save_training_data(
+                self.training_id,
+                settings={
+                    "feature_names": self.feature_names,
+                    "training_patients": self.training_patients,
+                    "test_patients": self.test_patients,
+                    "pipeline": pipeline,
+                    "parameter_grid": parameter_grid,
+                    "cv": cv,
+                },
+                X_train=X_train,
+                X_test=X_test,
+                y_train=y_train_encoded,
+                y_test=y_test_encoded,
+            )
+
+            # The user can cancel the run with the training ID
+            register_training_run(
+                g.user, self.training_id, run_id, training_fingerprint
+            )
+
+            current_app.my_celery.send_task(
+                "quantimage2tasks.train",
+                kwargs={
+                    "feature_extraction_id": self.feature_extraction_id,
+                    "collection_id": self.collection_id,
+                    "album": self.album,
+                    "feature_selection": self.feature_selection,
+                    "estimator_step": self.estimator_step,
+                    "scoring": scoring,
+                    "refit_metric": self.refit_metric,
+                    "search_strategy": self.search_strategy,
+                    "n_jobs": self.n_jobs,
+                    "training_data_dir": training_data_dir,
+                    "training_fingerprint": training_fingerprint,
+                    "run_id": run_id,
+                    "label_category_id": self.label_category.id,
+                    "data_splitting_type": self.data_splitting_type,
+                    "train_test_splitting_type": self.train_test_splitting_type,
+                    "is_train_test": self.is_train_test(),
+                    "random_seed": self.random_seed,
+                    "training_id": self.training_id,
+                    "user_id": g.user,
+                },
+                serializer="pickle",
+                queue=QUEUE_TRAINING,
+            )
+        except Exception:
+            release_training_lock(training_fingerprint, run_id)
+            unregister_training_run(g.user, self.training_id, run_id)
+            raise
 
         return n_steps
 
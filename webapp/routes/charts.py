@@ -1,8 +1,5 @@
-import pandas
 from flask import Blueprint, jsonify, request, g
 
-from sklearn.preprocessing import StandardScaler
-
 from quantimage2_backend_common.const import MODEL_TYPES
 from quantimage2_backend_common.models import (
     FeatureExtraction,
@@ -21,8 +18,6 @@ from service.feature_transformation import (
     OUTCOME_FIELD_SURVIVAL_EVENT,
 )
 
-from melampus.feature_ranking import MelampusFeatureRank
-
 # Define blueprint
 bp = Blueprint(__name__, "charts")
 
@@ -39,6 +34,9 @@ def format_chart_labels(labels):
 
 
 def format_chart_data(features_df, label_category, labels):
+    # Imported on first use to keep the webapp startup light
+    import pandas
+    from sklearn.preprocessing import StandardScaler
 
     # Flatten features by Modality & ROI to calculate ranks
     concatenated_features_df = concatenate_modalities_rois(features_df)
@@ -77,6 +75,9 @@ def format_chart_data(features_df, label_category, labels):
 
 
 def calculate_feature_rankings(label_category, labels, concatenated_features_df):
+    import pandas
+    from melampus.feature_ranking import MelampusFeatureRank
+
     ranking_field_name = (
         OUTCOME_FIELD_CLASSIFICATION
         if MODEL_TYPES(label_category.label_type) == MODEL_TYPES.CLASSIFICATION
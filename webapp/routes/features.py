@@ -8,25 +8,29 @@ from quantimage2_backend_common.const import (
     FIRSTORDER_PYRADIOMICS_PREFIX,
 )
 
-from requests_toolbelt import MultipartEncoder
 
 from ttictoc import tic, toc
 
 from config import FEATURES_CACHE_BASE_DIR
-from quantimage2_backend_common.kheops_utils import get_user_token
 from quantimage2_backend_common.utils import (
     fetch_extraction_result,
     format_extraction,
     read_config_file,
+    InvalidUsage,
 )
 from service.feature_extraction import (
     run_feature_extraction,
+    cancel_feature_extraction,
     get_studies_from_album,
     get_album_details,
+    get_user_token,
 )
 
+from quantimage2_backend_common.extraction_timing import get_stage_profile
+from quantimage2_backend_common.metrics import record_cache_lookups
 from quantimage2_backend_common.models import (
     FeatureExtraction,
+    FeatureExtractionTaskTiming,
     Label,
     Album,
     LabelCategory,
@@ -46,7 +50,6 @@ from zipfile import ZipFile, ZIP_DEFLATED
 
 import io
 import os
-import pandas
 
 
 # Define blueprint
@@ -97,6 +100,8 @@ def extraction_features_by_id(extraction_id):
         label_category = LabelCategory.find_by_id(album_outcome.outcome_id)
         labels = Label.find_by_label_category(label_category.id)
 
+    from requests_toolbelt import MultipartEncoder
+
     tic()
     chart_df = format_chart_data(features_df, label_category, labels)
     elapsed = toc()
@@ -115,6 +120,8 @@ def extraction_features_by_id(extraction_id):
 
 
 def get_features_cache_or_db(extraction, studies):
+    import pandas
+
     features_cache_folder = f"extraction-{extraction.id}"
     features_cache_path = f"{FEATURES_CACHE_BASE_DIR}/{features_cache_folder}"
     features_file_name = "features.h5"
@@ -123,12 +130,16 @@ def get_features_cache_or_db(extraction, studies):
 
     # Does the features file exist?
     if Path(features_cache_file_path).exists():
+        record_cache_lookups("features", 1, 0)
+
         tic()
         features_df = pandas.read_hdf(features_cache_file_path, features_key)
         header = features_df.columns
         elapsed = toc()
         print("Parsing features from cached HDF5 file took", elapsed)
     else:
+        record_cache_lookups("features", 0, 1)
+
         header, features_df = transform_studies_features_to_df(extraction, studies)
 
         # Persist features DataFrame for caching
@@ -244,6 +255,34 @@ def extraction_status(extraction_id):
     return jsonify(response)
 
 
+# Durations of the stages of a feature extraction's tasks
+@bp.route("/extractions/<extraction_id>/profile")
+def extraction_profile(extraction_id):
+    extraction = FeatureExtraction.find_by_id(extraction_id)
+
+    if extraction is None or extraction.user_id != g.user:
+        raise InvalidUsage(f"Extraction {extraction_id} does not exist")
+
+    profile = get_stage_profile(
+        FeatureExtractionTaskTiming.find_by_extraction(extraction.id)
+    )
+
+    return jsonify({"extraction-id": extraction.id, **profile})
+
+
+# Cancel a running feature extraction
+@bp.route("/extractions/<extraction_id>/run", methods=["DELETE"])
+def cancel_extraction(extraction_id):
+    extraction = FeatureExtraction.find_by_id(extraction_id)
+
+    if extraction is None or extraction.user_id != g.user:
+        raise InvalidUsage(f"Extraction {extraction_id} does not exist")
+
+    cancel_feature_extraction(extraction)
+
+    return jsonify(format_extraction(extraction))
+
+
 # Update a feature extraction
 @bp.route("/extractions/<extraction_id>", methods=["PATCH"])
 def update_extraction(extraction_id):
@@ -264,13 +303,17 @@ def extract_album(album_id):
     feature_extraction_config_dict = request_body["config"]
     rois = request_body["rois"]
 
+    # Only extract new & failed studies (reuse the features of the latest extraction)
+    incremental = request_body.get("incremental", False)
+
     # Get album metadata for hard-coded labels mapping
     album_metadata = get_album_details(album_id, token)
 
-    # Get a read/write token for the user (valid only for 24 hours)
+    # Get a read/write token for the user (valid only for 24 hours), the access
+    # token of the request may expire before the extraction is dispatched
     user_token_id, user_token = get_user_token(album_id, token)
 
-    # Run the feature extraction
+    # Run the feature extraction in the background
     feature_extraction = run_feature_extraction(
         user_id,
         album_id,
@@ -278,6 +321,7 @@ def extract_album(album_id):
         feature_extraction_config_dict,
         rois,
         user_token,
+        incremental=incremental,
     )
 
-    return jsonify(format_extraction(feature_extraction))
+    return jsonify(format_extraction(feature_extraction)), 202
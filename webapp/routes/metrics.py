@@ -0,0 +1,159 @@
+import hmac
+import os
+from time import perf_counter
+
+from flask import Blueprint, Response, abort, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from quantimage2_backend_common.const import (
+    QUEUE_EXTRACTION,
+    QUEUE_PREDICTION,
+    QUEUE_TRAINING,
+)
+from quantimage2_backend_common.extraction_memory import (
+    ADMITTED_METRIC,
+    DEFERRED_METRIC,
+    FORCED_METRIC,
+    get_memory_admission_metrics,
+)
+from quantimage2_backend_common.extraction_scheduling import (
+    CELERY_BROKER_TRANSPORT_OPTIONS,
+    EXTRACTION_PRIORITY_STEPS,
+)
+from quantimage2_backend_common.metrics import (
+    DB_DURATION_PER_REQUEST,
+    DB_QUERIES_PER_REQUEST,
+    HTTP_REQUEST_DURATION,
+    METRICS_PREFIX,
+)
+from quantimage2_backend_common.training_lock import get_redis_client
+
+# Define blueprint (scraped by Prometheus with the METRICS_TOKEN bearer token,
+# not with the Keycloak tokens of the users)
+bp = Blueprint(__name__, "metrics")
+
+
+def make_broker_metric_families():
+    queue_depth = GaugeMetricFamily(
+        f"{METRICS_PREFIX}celery_queue_depth",
+        "Number of tasks waiting in the Celery queues",
+        labels=["queue", "priority"],
+    )
+    reserved_bytes = GaugeMetricFamily(
+        f"{METRICS_PREFIX}extraction_reserved_memory_bytes",
+        "Memory reserved by the running studies of the extraction workers",
+        labels=["worker"],
+    )
+    running_tasks = GaugeMetricFamily(
+        f"{METRICS_PREFIX}extraction_running_studies",
+        "Number of studies running on the extraction workers",
+        labels=["worker"],
+    )
+    admissions = CounterMetricFamily(
+        f"{METRICS_PREFIX}extraction_memory_admissions",
+        "Memory admission decisions of the extraction workers",
+        labels=["worker", "decision"],
+    )
+
+    return queue_depth, reserved_bytes, running_tasks, admissions
+
+
+class BrokerCollector(object):
+    """
+    Collect the metrics kept in Redis when they are scraped (queue depths &
+    memory admission of the extraction workers), only registered by the webapp
+    so that they are reported once
+    """
+
+    def describe(self):
+        # Registering the collector only needs the names, not the values in Redis
+        return make_broker_metric_families()
+
+    def collect(self):
+        client = get_redis_client()
+        separator = CELERY_BROKER_TRANSPORT_OPTIONS["sep"]
+
+        queue_depth, reserved_bytes, running_tasks, admissions = (
+            make_broker_metric_families()
+        )
+
+        for queue in [QUEUE_EXTRACTION, QUEUE_TRAINING, QUEUE_PREDICTION]:
+            for priority in EXTRACTION_PRIORITY_STEPS:
+                # Kombu keeps the tasks of each priority in a separate list
+                key = queue if priority == 0 else f"{queue}{separator}{priority}"
+                queue_depth.add_metric([queue, str(priority)], client.llen(key))
+
+        for worker, worker_metrics in get_memory_admission_metrics().items():
+            reserved_bytes.add_metric([worker], worker_metrics["reserved_bytes"])
+            running_tasks.add_metric([worker], worker_metrics["running_tasks"])
+
+            for decision in [ADMITTED_METRIC, DEFERRED_METRIC, FORCED_METRIC]:
+                admissions.add_metric(
+                    [worker, decision], worker_metrics.get(decision, 0)
+                )
+
+        return [queue_depth, reserved_bytes, running_tasks, admissions]
+
+
+# Registered once on import rather than on each registration of the blueprint
+# (e.g. by the tests, which create an app per test)
+REGISTRY.register(BrokerCollector())
+
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started_at = perf_counter()
+
+
+@bp.after_app_request
+def observe_request(response):
+    # Label by endpoint (e.g. "routes.features.extraction_by_id") rather than
+    # by path, which would create a series per extraction/model ID
+    endpoint = request.endpoint or "unmatched"
+
+    if "request_started_at" in g:
+        HTTP_REQUEST_DURATION.labels(
+            request.method, endpoint, response.status_code
+        ).observe(perf_counter() - g.request_started_at)
+
+    DB_QUERIES_PER_REQUEST.labels(endpoint).observe(g.get("db_queries", 0))
+    DB_DURATION_PER_REQUEST.labels(endpoint).observe(g.get("db_duration", 0))
+
+    return response
+
+
+def get_metrics_registry():
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+
+    # Aggregate the metrics of all the processes, as for the workers
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(BrokerCollector())
+
+    return registry
+
+
+@bp.route("/metrics")
+def metrics():
+    metrics_token = os.environ.get("METRICS_TOKEN")
+
+    # The metrics are disabled if no token is set
+    if not metrics_token:
+        abort(404)
+
+    authorization = request.headers.get("Authorization", "")
+
+    if not hmac.compare_digest(authorization, f"Bearer {metrics_token}"):
+        abort(401)
+
+    return Response(
+        generate_latest(get_metrics_registry()), mimetype=CONTENT_TYPE_LATEST
+    )
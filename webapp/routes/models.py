@@ -1,14 +1,20 @@
-import os
 import traceback
 
 from sqlalchemy.orm import joinedload
-from flask import Blueprint, jsonify, request, g, make_response
-from quantimage2_backend_common.const import MODEL_TYPES
+from flask import Blueprint, jsonify, request, g, make_response, Response
+from quantimage2_backend_common.cancellation import (
+    get_training_cancellation_key,
+    request_cancellation,
+)
+from quantimage2_backend_common.const import MODEL_TYPES, SEARCH_STRATEGIES
 from quantimage2_backend_common.models import Model, LabelCategory
-from quantimage2_backend_common.utils import get_training_id, format_model
+from quantimage2_backend_common.model_store import delete_model
+from quantimage2_backend_common.training_lock import (
+    get_training_runs,
+    release_training_lock,
+)
+from quantimage2_backend_common.utils import get_training_id, format_model, InvalidUsage
 from routes.utils import validate_decorate
-from service.classification import train_classification_model
-from service.survival import train_survival_model
 
 # Define blueprint
 bp = Blueprint(__name__, "models")
@@ -34,6 +40,21 @@ def models_by_album(album_id):
         # of the features (including patient ID)
         body = request.json
 
+        # Validate before training, an unknown strategy would only fail in the
+        # training service (reported as a server error)
+        search_strategy = body.get("search-strategy", SEARCH_STRATEGIES.GRID.value)
+        search_strategies = [strategy.value for strategy in SEARCH_STRATEGIES]
+
+        if search_strategy not in search_strategies:
+            raise InvalidUsage(
+                f"Unknown search strategy {search_strategy}, "
+                f"must be one of {', '.join(search_strategies)}"
+            )
+
+        # Training modules (scikit-learn, scikit-survival) are loaded on first use
+        from service.classification import train_classification_model
+        from service.survival import train_survival_model
+
         label_category = LabelCategory.find_by_id(body["label-category-id"])
 
         feature_extraction_id = body["extraction-id"]
@@ -61,6 +82,7 @@ def models_by_album(album_id):
                     training_patients,
                     test_patients,
                     gt,
+                    search_strategy=search_strategy,
                 )
             elif MODEL_TYPES(label_category.label_type) == MODEL_TYPES.SURVIVAL:
                 n_steps = train_survival_model(
@@ -75,6 +97,7 @@ def models_by_album(album_id):
                     training_patients,
                     test_patients,
                     gt,
+                    search_strategy=search_strategy,
                 )
             else:
                 raise NotImplementedError
@@ -89,6 +112,18 @@ def models_by_album(album_id):
             return make_response(jsonify(error_message), 500)
 
 
+@bp.route("/models/training/<training_id>", methods=["DELETE"])
+def cancel_training(training_id):
+    for run_id, training_fingerprint in get_training_runs(g.user, training_id).items():
+        # The training tasks stop at their next step, the progress stream is notified
+        request_cancellation(get_training_cancellation_key(run_id))
+
+        # An identical request starts a new run instead of following the cancelled one
+        release_training_lock(training_fingerprint, run_id)
+
+    return jsonify({"training-id": training_id, "cancelled": True})
+
+
 @bp.route("/models/<id>", methods=["DELETE"])
 def model(id):
     the_model = Model.delete_by_id(
@@ -99,14 +134,75 @@ def model(id):
         ),
     )
     formatted_model = format_model(the_model)
-    model_path = the_model.model_path
-    try:
-        os.unlink(model_path)
-    except FileNotFoundError as e:
-        pass
+
+    # Identical models share the same file, keep it while it is still used
+    if not Model.find_by_model_path(the_model.model_path):
+        delete_model(the_model.model_path)
+
     return jsonify(formatted_model)
 
 
+@bp.route("/models/<id>/predict", methods=["POST"])
+def predict(id):
+    from service.prediction import predict_model
+
+    the_model = get_user_model(id)
+    body = request.json
+
+    # The prediction runs in the background, its result is polled with its ID
+    prediction_id = predict_model(
+        the_model, body["extraction-id"], body.get("collection-id"), body["studies"]
+    )
+
+    return jsonify({"model-id": the_model.id, "prediction-id": prediction_id}), 202
+
+
+@bp.route("/models/<id>/predictions/<prediction_id>")
+def prediction_by_id(id, prediction_id):
+    from service.prediction import get_prediction
+
+    the_model = get_user_model(id)
+
+    completed, total, predictions = get_prediction(prediction_id)
+
+    response = {
+        "model-id": the_model.id,
+        "prediction-id": prediction_id,
+        "completed": completed,
+        "total": total,
+    }
+
+    # Not complete yet, poll again later
+    if predictions is None:
+        return jsonify(response), 202
+
+    return jsonify({**response, "predictions": predictions})
+
+
+@bp.route("/models/<id>/predict/stream", methods=["POST"])
+def predict_stream(id):
+    from service.prediction import stream_model_predictions
+
+    the_model = get_user_model(id)
+    body = request.json
+
+    # Newline-delimited JSON, one line per patient
+    predictions = stream_model_predictions(
+        the_model, body["extraction-id"], body.get("collection-id"), body["studies"]
+    )
+
+    return Response(predictions, mimetype="application/x-ndjson")
+
+
+def get_user_model(id):
+    the_model = Model.find_by_id(id)
+
+    if the_model is None or the_model.user_id != g.user:
+        raise InvalidUsage(f"Model {id} does not exist")
+
+    return the_model
+
+
 @bp.route("/models")
 def models_by_user():
     albums = Model.find_by_user(g.user)
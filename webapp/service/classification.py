@@ -1,6 +1,6 @@
 import os
 
-from quantimage2_backend_common.const import ESTIMATOR_STEP
+from quantimage2_backend_common.const import ESTIMATOR_STEP, SEARCH_STRATEGIES
 from quantimage2_backend_common.models import FeatureExtraction, FeatureCollection
 from quantimage2_backend_common.utils import get_training_id
 from modeling.classification import Classification
@@ -26,6 +26,7 @@ def train_classification_model(
     training_patients,
     test_patients,
     gt,
+    search_strategy=SEARCH_STRATEGIES.GRID.value,
 ):
     features_df, labels_df_indexed = get_features_labels(
         extraction_id,
@@ -59,6 +60,7 @@ def train_classification_model(
         refit_metric="auc",
         n_jobs=int(os.environ["GRID_SEARCH_CONCURRENCY"]),
         training_id=training_id,
+        search_strategy=search_strategy,
     )
 
     # Run modeling pipeline depending on the type of validation (full CV, train/test)
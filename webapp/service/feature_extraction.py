@@ -1,26 +1,31 @@
+import hashlib
+import json
 import os
 
 import requests
 
 import yaml
-from ttictoc import tic, toc
-from celery import chord
 from flask import current_app
 
 from config import EXTRACTIONS_BASE_DIR, CONFIGS_SUBDIR
-from quantimage2_backend_common.const import QUEUE_EXTRACTION
-
-from quantimage2_backend_common.kheops_utils import endpoints, get_token_header, dicomFields
-from quantimage2_backend_common.utils import (
-    MessageType,
-    get_socketio_body_extraction,
-    fetch_extraction_result,
+from quantimage2_backend_common.cancellation import (
+    get_extraction_cancellation_key,
+    request_cancellation,
 )
-from quantimage2_backend_common.models import (
-    FeatureExtraction,
-    FeatureExtractionTask,
-    db,
+from quantimage2_backend_common.const import QUEUE_EXTRACTION
+from quantimage2_backend_common.extraction_scheduling import EXTRACTION_PRIORITY_STEPS
+
+# The album, study & series listings and album tokens are also used by the routes
+from quantimage2_backend_common.kheops_utils import (
+    endpoints,
+    get_token_header,
+    get_album_details,
+    get_user_token,
+    get_studies_from_album,
+    get_series_from_study,
 )
+from quantimage2_backend_common.metrics import KHEOPS_REQUEST_DURATION
+from quantimage2_backend_common.models import FeatureExtraction, db
 
 
 def run_feature_extraction(
@@ -29,170 +34,92 @@ def run_feature_extraction(
     album_name,
     feature_extraction_config,
     rois,
-    user_token=None,
+    user_token,
+    incremental=False,
 ):
-
-    tic()
+    """
+    Create a feature extraction & launch it in the background, the album's
+    studies are listed & their tasks created by the dispatcher task
+
+    :param user_id: The ID of the user running the extraction
+    :param album_id: The ID of the Kheops album to extract
+    :param album_name: The name of the Kheops album
+    :param feature_extraction_config: The configuration of the feature families
+    :param rois: The ROIs to extract the features from
+    :param user_token: The album token of the user (see get_user_token)
+    :param incremental: Only extract the studies that are new or that failed in
+                        the latest extraction of the album with the same config
+    :returns: The (not yet started) feature extraction
+    """
+    config_hash = get_config_hash(feature_extraction_config, rois)
+
+    previous_extraction = None
+
+    if incremental:
+        previous_extraction = FeatureExtraction.find_latest_by_user_album_and_config(
+            user_id, album_id, config_hash
+        )
 
     # Create Feature Extraction object
     feature_extraction = FeatureExtraction(user_id, album_id)
-    feature_extraction.save_to_db()
-
-    print(f"Creating the feature extraction object")
-    print(toc())
-    print(f"---------------------------------------------------------")
-
-    task_signatures = []
-
-    tic()
-
-    # Assemble study UIDs
-    album_studies = get_studies_from_album(album_id, user_token)
-    study_uids = list(
-        map(
-            lambda study: study[dicomFields.STUDY_UID][dicomFields.VALUE][0],
-            album_studies,
-        )
-    )
-    print(study_uids)
+    feature_extraction.config_hash = config_hash
+    feature_extraction.flush_to_db()
 
     # Save config for this extraction
     config_path = save_config(
         feature_extraction, feature_extraction_config, user_id, album_id
     )
     feature_extraction.config_file = config_path
-    feature_extraction.save_to_db()
-
-    # Create extraction task and run it
-    for study_uid in study_uids:
-        feature_extraction_task = FeatureExtractionTask(
-            feature_extraction.id,
-            study_uid,
-            None,
-        )
-        feature_extraction_task.save_to_db()
-
-        # Create new task signature
-        task_signature = current_app.my_celery.signature(
-            "quantimage2tasks.extract",
-            args=[
-                feature_extraction.id,
-                user_id,
-                feature_extraction_task.id,
-                study_uid,
-                album_id,
-                album_name,
-                user_token,
-                config_path,
-                rois,
-            ],
-            kwargs={},
-            countdown=1,
-            link=current_app.my_celery.signature(
-                "quantimage2tasks.finalize_extraction_task",
-                args=[feature_extraction.id, feature_extraction_task.id],
-                queue=QUEUE_EXTRACTION,
-            ),
-            queue=QUEUE_EXTRACTION,
-        )
-
-        task_signatures.append(task_signature)
-
-    print(f"Creating the task signatures (and FeatureExtractionTasks)")
-    print(toc())
-    print(f"---------------------------------------------------------")
-
-    finalize_signature = current_app.my_celery.signature(
-        "quantimage2tasks.finalize_extraction",
-        args=[feature_extraction.id],
-        queue=QUEUE_EXTRACTION,
-    )
-
-    tic()
     db.session.commit()
 
-    print(f"Committing the session")
-    print(toc())
-    print(f"---------------------------------------------------------")
-
-    # Start the tasks as a chord
-    job = chord(task_signatures, body=finalize_signature).apply_async(countdown=1)
-    job.parent.save()
-
-    # Persist group result manually, because by default it's using 24 hours
-    # (not clear why, it should respect the result_expires setting used for normal results)
-    current_app.my_celery.backend.client.persist(
-        current_app.my_celery.backend.get_key_for_group(job.parent.id)
-    )
-
-    tic()
-
-    feature_extraction.result_id = job.parent.id
-
-    extraction_status = fetch_extraction_result(
-        current_app.my_celery, feature_extraction.result_id
+    current_app.my_celery.send_task(
+        "quantimage2tasks.dispatch_extraction",
+        kwargs={
+            "feature_extraction_id": feature_extraction.id,
+            "user_id": user_id,
+            "album_id": album_id,
+            "album_name": album_name,
+            "album_token": user_token,
+            "config_path": config_path,
+            "rois": rois,
+            "previous_extraction_id": previous_extraction.id
+            if previous_extraction
+            else None,
+        },
+        queue=QUEUE_EXTRACTION,
+        # Ahead of the remaining studies of the extractions that are running
+        priority=EXTRACTION_PRIORITY_STEPS[0],
     )
 
-    print(f"Getting the extraction status")
-    print(toc())
-    print(f"---------------------------------------------------------")
-
-    tic()
-    db.session.commit()
-
-    print(f"Committing the session (again)")
-    print(toc())
-    print(f"---------------------------------------------------------")
-
-    # Send a Socket.IO message to inform that the extraction has started
-    if not album_id:
-        socketio_body = get_socketio_body_extraction(
-            feature_extraction.id, vars(extraction_status)
-        )
-
-        current_app.my_socketio.emit(MessageType.EXTRACTION_STATUS.value, socketio_body)
-
-    feature_extraction = FeatureExtraction.find_by_id(feature_extraction.id)
-
     return feature_extraction
 
 
-def get_album_details(album_id, token):
-    album_url = f"{endpoints.albums}/{album_id}"
-
-    access_token = get_token_header(token)
-
-    album_details = requests.get(album_url, headers=access_token).json()
-
-    return album_details
-
-
-def get_studies_from_album(album_id, token):
-    album_studies_url = f"{endpoints.studies}?{endpoints.album_parameter}={album_id}"
-
-    access_token = get_token_header(token)
-
-    album_studies = requests.get(album_studies_url, headers=access_token).json()
-
-    return album_studies
-
+def cancel_feature_extraction(feature_extraction):
+    """
+    Cancel a feature extraction, the studies not started yet are revoked & the
+    running ones stop at their next step (the completed ones are kept)
 
-def get_series_from_study(study_uid, modalities, album_id, token):
-    study_series_url = f"{endpoints.studies}/{study_uid}/series?album={album_id}"
+    :param feature_extraction: The feature extraction to cancel
+    """
+    # Also stops the dispatcher if the tasks are not created yet
+    request_cancellation(get_extraction_cancellation_key(feature_extraction.id))
 
-    if modalities is not None:
-        params = [
-            f"&{dicomFields.MODALITY}={modality}"
-            for i, modality in enumerate(modalities)
-        ]
+    if feature_extraction.result_id is not None:
+        result = current_app.my_celery.GroupResult.restore(
+            feature_extraction.result_id
+        )
 
-        study_series_url += "".join(params)
+        if result is not None:
+            result.revoke()
 
-    access_token = get_token_header(token)
 
-    study_series = requests.get(study_series_url, headers=access_token).json()
+def get_config_hash(feature_extraction_config, rois):
+    # Extractions with identical configs & ROIs produce the same features
+    serialized_config = json.dumps(
+        {"config": feature_extraction_config, "rois": rois}, sort_keys=True
+    )
 
-    return study_series
+    return hashlib.sha256(serialized_config.encode("utf-8")).hexdigest()
 
 
 def get_series_metadata(study_uid, series_uid, album_id, token):
@@ -202,7 +129,8 @@ def get_series_metadata(study_uid, series_uid, album_id, token):
 
     access_token = get_token_header(token)
 
-    series_metadata = requests.get(series_metadata_url, headers=access_token).json()
+    with KHEOPS_REQUEST_DURATION.labels("series_metadata").time():
+        series_metadata = requests.get(series_metadata_url, headers=access_token).json()
 
     return series_metadata
 
@@ -1,6 +1,5 @@
 import csv
 import io
-import pandas
 import itertools
 from ttictoc import tic, toc
 
@@ -40,6 +39,9 @@ def get_extraction_features(feature_extraction, studies):
 
 
 def transform_feature_values_to_tabular(values, studies):
+    # Imported on first use, the webapp can start without pandas in memory
+    import pandas
+
     tic()
     df = pandas.DataFrame(
         values, columns=["study_uid", "modality", "roi", "name", "value"]
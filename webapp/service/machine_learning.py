@@ -1,5 +1,3 @@
-import pandas
-
 from quantimage2_backend_common.models import FeatureExtraction, FeatureCollection
 from service.feature_transformation import (
     transform_studies_collection_features_to_df,
@@ -17,15 +15,9 @@ def get_features_labels(
     gt,
     outcome_columns=[OUTCOME_FIELD_CLASSIFICATION],
 ):
-    extraction = FeatureExtraction.find_by_id(extraction_id)
+    import pandas
 
-    if collection_id:
-        collection = FeatureCollection.find_by_id(collection_id)
-        header, features_df = transform_studies_collection_features_to_df(
-            collection, studies
-        )
-    else:
-        header, features_df = transform_studies_features_to_df(extraction, studies)
+    features_df = get_studies_features_df(extraction_id, collection_id, studies)
 
     # Get Labels DataFrame
     # TODO - Allow choosing a mode (Patient only or Patient + ROI)
@@ -51,21 +43,50 @@ def get_features_labels(
     features_df = features_df[features_df.PatientID.isin(labelled_patients)]
     labels_df_indexed = labels_df_indexed.filter(items=labelled_patients, axis=0)
 
+    # Sort both dataframe by index to ensure same order
+    labels_df_indexed.sort_index(inplace=True)
+
+    return prepare_features_df(features_df), labels_df_indexed
+
+
+def get_features(extraction_id, collection_id, studies):
+    # Features of all patients (e.g. for applying an existing model)
+    features_df = get_studies_features_df(extraction_id, collection_id, studies)
+
+    return prepare_features_df(features_df)
+
+
+def get_studies_features_df(extraction_id, collection_id, studies):
+    extraction = FeatureExtraction.find_by_id(extraction_id)
+
+    if collection_id:
+        collection = FeatureCollection.find_by_id(collection_id)
+        header, features_df = transform_studies_collection_features_to_df(
+            collection, studies
+        )
+    else:
+        header, features_df = transform_studies_features_to_df(extraction, studies)
+
+    return features_df
+
+
+def prepare_features_df(features_df):
     # Concatenate features by modality & ROI
     features_df = concatenate_modalities_rois(features_df)
 
-    # Sort both dataframe by index to ensure same order
-    labels_df_indexed.sort_index(inplace=True)
+    # Sort dataframe by index to ensure same order as the labels
     features_df.sort_index(inplace=True)
 
     # TODO - This will be done in Melampus also in the future
     # Impute mean for NaNs
     features_df = features_df.fillna(features_df.mean())
 
-    return features_df, labels_df_indexed
+    return features_df
 
 
 def concatenate_modalities_rois(features_df):
+    import pandas
+
     # Concatenate features from the various modalities & ROIs (if necessary)
 
     # Keep PatientID
@@ -0,0 +1,154 @@
+import json
+
+import numpy
+from celery import uuid
+from flask import current_app
+
+from quantimage2_backend_common.const import QUEUE_PREDICTION
+from quantimage2_backend_common.utils import InvalidUsage
+from modeling.utils import preprocess_features
+from service.machine_learning import get_features
+
+# Number of patients sent to a worker at once (chunks are predicted in parallel)
+PREDICTION_CHUNK_SIZE = 1000
+
+# Maximum time to wait for the worker by the streaming variant (in seconds)
+PREDICTION_TIMEOUT = 300
+
+
+def predict_model(model, extraction_id, collection_id, studies):
+    """
+    Send the prediction of a trained model on the features of a feature extraction
+    (or collection) to the prediction workers, without waiting for the result
+
+    :param model: The trained Model
+    :param extraction_id: The ID of the feature extraction to get the features from
+    :param collection_id: The ID of the feature collection (optional)
+    :param studies: The studies of the album
+    :returns: The ID of the prediction, to get its result with get_prediction
+    """
+    patient_ids, X = get_prediction_features(
+        model, extraction_id, collection_id, studies
+    )
+
+    # The prediction ID is random, only the user who sent the prediction knows it
+    group_result = current_app.my_celery.GroupResult(
+        uuid(), send_prediction_chunks(model, patient_ids, X)
+    )
+    group_result.save()
+
+    return group_result.id
+
+
+def get_prediction(prediction_id):
+    """
+    Get the result of a prediction sent with predict_model
+
+    :param prediction_id: The ID of the prediction
+    :returns: The number of completed & total chunks of the prediction and the
+              prediction (& probabilities, if available) of each patient, or
+              None if the prediction is not complete yet
+    """
+    group_result = current_app.my_celery.GroupResult.restore(prediction_id)
+
+    if group_result is None:
+        raise InvalidUsage(f"Prediction {prediction_id} does not exist")
+
+    completed = group_result.completed_count()
+    total = len(group_result.results)
+
+    if not group_result.ready():
+        return completed, total, None
+
+    # Raises the error of the first failed chunk (if any)
+    predictions = [
+        prediction
+        for result in group_result.get()
+        for prediction in format_predictions(result)
+    ]
+
+    return completed, total, predictions
+
+
+def stream_model_predictions(model, extraction_id, collection_id, studies):
+    """
+    Same as predict_model, but waits for the chunks of patients & sends them
+    back as soon as they are ready
+
+    :returns: A generator of JSON lines (one per patient)
+    """
+    patient_ids, X = get_prediction_features(
+        model, extraction_id, collection_id, studies
+    )
+
+    # Send all the chunks at once, the workers can process them in parallel
+    chunks = send_prediction_chunks(model, patient_ids, X)
+
+    def generate_predictions():
+        for async_result in chunks:
+            result = async_result.get(timeout=PREDICTION_TIMEOUT)
+
+            for prediction in format_predictions(result):
+                yield json.dumps(prediction) + "\n"
+
+    return generate_predictions()
+
+
+def get_prediction_features(model, extraction_id, collection_id, studies):
+    features_df = preprocess_features(
+        get_features(extraction_id, collection_id, studies)
+    )
+
+    # Align the columns with the features used for training the model
+    missing_features = [
+        feature for feature in model.feature_names if feature not in features_df
+    ]
+
+    if missing_features:
+        raise InvalidUsage(
+            f"{len(missing_features)} features used by the model are missing : {', '.join(missing_features[:10])}"
+        )
+
+    X = numpy.asarray(features_df[model.feature_names], dtype=float)
+
+    return list(features_df.index), X
+
+
+def send_prediction_chunks(model, patient_ids, X):
+    """
+    Send the prediction tasks of a feature matrix, in chunks of PREDICTION_CHUNK_SIZE
+
+    :param model: The trained Model
+    :param patient_ids: The ID of each patient (returned with the predictions)
+    :param X: The feature matrix (one row per patient)
+    :returns: The async result of each chunk
+    """
+    return [
+        current_app.my_celery.send_task(
+            "quantimage2tasks.predict",
+            kwargs={
+                "model_path": model.model_path,
+                "patient_ids": patient_ids[start : start + PREDICTION_CHUNK_SIZE],
+                "X": X[start : start + PREDICTION_CHUNK_SIZE],
+            },
+            serializer="pickle",
+            queue=QUEUE_PREDICTION,
+        )
+        for start in range(0, len(patient_ids), PREDICTION_CHUNK_SIZE)
+    ]
+
+
+def format_predictions(result):
+    patient_ids = result["patient-ids"]
+    probabilities = result["probabilities"] or [None] * len(patient_ids)
+
+    return [
+        {
+            "patient-id": patient_id,
+            "prediction": prediction,
+            "probabilities": patient_probabilities,
+        }
+        for patient_id, prediction, patient_probabilities in zip(
+            patient_ids, result["predictions"], probabilities
+        )
+    ]
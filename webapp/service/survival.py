@@ -1,6 +1,6 @@
 import os
 
-from quantimage2_backend_common.const import ESTIMATOR_STEP
+from quantimage2_backend_common.const import ESTIMATOR_STEP, SEARCH_STRATEGIES
 from quantimage2_backend_common.utils import get_training_id
 from modeling.survival import Survival
 from service.feature_transformation import (
@@ -24,6 +24,7 @@ def train_survival_model(
     training_patients,
     test_patients,
     gt,
+    search_strategy=SEARCH_STRATEGIES.GRID.value,
 ):
     features_df, labels_df_indexed = get_features_labels(
         extraction_id,
@@ -60,6 +61,7 @@ def train_survival_model(
         refit_metric="c-index",
         n_jobs=int(os.environ["GRID_SEARCH_CONCURRENCY"]),
         training_id=training_id,
+        search_strategy=search_strategy,
     )
 
     # Run modeling pipeline depending on the type of validation (full CV, train/test)
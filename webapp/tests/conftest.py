@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# Must be set before prometheus_client is imported, as in the containers
+os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prometheus-")
@@ -0,0 +1,91 @@
+import pytest
+from flask import Flask
+
+import routes.metrics
+from quantimage2_backend_common.extraction_memory import ADMITTED_METRIC
+
+METRICS_TOKEN = "metrics-token"
+
+
+class FakeRedisClient(object):
+    def llen(self, key):
+        return 3 if key == "extraction" else 0
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("METRICS_TOKEN", METRICS_TOKEN)
+    monkeypatch.setattr(routes.metrics, "get_redis_client", FakeRedisClient)
+    monkeypatch.setattr(
+        routes.metrics,
+        "get_memory_admission_metrics",
+        lambda: {
+            "extraction@worker": {
+                "reserved_bytes": 1024,
+                "running_tasks": 2,
+                ADMITTED_METRIC: 5,
+            }
+        },
+    )
+
+    app = Flask(__name__)
+    app.register_blueprint(routes.metrics.bp)
+
+    @app.route("/ping")
+    def ping():
+        return "pong"
+
+    return app.test_client()
+
+
+def scrape(client):
+    response = client.get(
+        "/metrics", headers={"Authorization": f"Bearer {METRICS_TOKEN}"}
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+
+    return response.get_data(as_text=True)
+
+
+def test_metrics_scrape(client):
+    client.get("/ping")
+
+    metrics = scrape(client)
+
+    # Request metrics, aggregated from the files of the multiprocess directory
+    assert (
+        'quantimage2_http_request_duration_seconds_count{endpoint="ping",'
+        'method="GET",status="200"} 1.0'
+    ) in metrics
+    assert 'quantimage2_db_queries_per_request_count{endpoint="ping"} 1.0' in metrics
+
+    # Metrics kept in Redis
+    assert (
+        'quantimage2_celery_queue_depth{priority="0",queue="extraction"} 3.0' in metrics
+    )
+    assert (
+        'quantimage2_celery_queue_depth{priority="0",queue="prediction"} 0.0' in metrics
+    )
+    assert (
+        'quantimage2_extraction_reserved_memory_bytes{worker="extraction@worker"} '
+        "1024.0"
+    ) in metrics
+    assert (
+        "quantimage2_extraction_memory_admissions_total"
+        '{decision="admitted",worker="extraction@worker"} 5.0'
+    ) in metrics
+
+
+@pytest.mark.parametrize("authorization", [None, "Bearer wrong-token", METRICS_TOKEN])
+def test_metrics_unauthorized(client, authorization):
+    headers = {"Authorization": authorization} if authorization else {}
+
+    assert client.get("/metrics", headers=headers).status_code == 401
+
+
+def test_metrics_disabled_without_token(client, monkeypatch):
+    monkeypatch.delenv("METRICS_TOKEN")
+
+    assert client.get("/metrics").status_code == 404
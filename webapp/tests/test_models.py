@@ -0,0 +1,33 @@
+import pytest
+from flask import Flask, g, jsonify
+
+import routes.models
+from quantimage2_backend_common.utils import InvalidUsage
+
+
+def authenticate(request):
+    g.user = "user-id"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(routes.models, "validate_decorate", authenticate)
+
+    app = Flask(__name__)
+    app.register_blueprint(routes.models.bp)
+
+    # Same as the error handler of the webapp
+    @app.errorhandler(InvalidUsage)
+    def handle_invalid_usage(error):
+        response = jsonify(error.to_dict())
+        response.status_code = error.status_code
+        return response
+
+    return app.test_client()
+
+
+def test_train_model_unknown_search_strategy(client):
+    response = client.post("/models/album-id", json={"search-strategy": "exhaustive"})
+
+    assert response.status_code == 400
+    assert "Unknown search strategy exhaustive" in response.get_json()["message"]
@@ -0,0 +1,169 @@
+"""
+Simulate the extraction queue to compare the latency of small extractions
+queued behind a large one, with & without fair-share scheduling
+
+Usage: python benchmark_scheduling.py [--workers 4] [--large 2000] [--small 5]
+
+The simulation only models the broker & the workers (no actual extraction):
+- fifo: all the tasks have the same priority (previous behaviour)
+- priority: the tasks get priorities with get_extraction_priority
+- priority+cap: same, with a maximum number of running tasks per user
+"""
+import argparse
+import heapq
+import random
+from dataclasses import dataclass, field
+
+from quantimage2_backend_common.extraction_scheduling import get_extraction_priority
+
+# Average duration of the extraction of a study (in seconds)
+TASK_DURATION = 60
+
+# Variation of the duration of the extraction of a study (in seconds)
+TASK_DURATION_JITTER = 30
+
+
+@dataclass(order=True)
+class SimulatedTask:
+    priority: int
+    sequence: int
+    user_id: str = field(compare=False)
+    job_id: str = field(compare=False)
+    duration: float = field(compare=False)
+
+
+def make_job(job_id, user_id, n_studies, fair_share, rng):
+    return [
+        (
+            get_extraction_priority(index) if fair_share else 0,
+            user_id,
+            job_id,
+            TASK_DURATION + rng.uniform(-TASK_DURATION_JITTER, TASK_DURATION_JITTER),
+        )
+        for index in range(n_studies)
+    ]
+
+
+def simulate(jobs, n_workers, user_cap=0):
+    """
+    Run the simulation
+
+    :param jobs: List of (submission time, job ID, tasks) with the tasks from make_job
+    :param n_workers: The number of tasks that can run at the same time
+    :param user_cap: The maximum number of running tasks per user (0 for no limit)
+    :returns: The latency (from submission to completion) of each job
+    """
+    events = []  # (time, order, type, payload)
+    order = 0
+    queue = []
+    running_per_user = {}
+    remaining_per_job = {}
+    submitted_at = {}
+    latencies = {}
+    sequence = 0
+    idle_workers = n_workers
+
+    for submission_time, job_id, tasks in jobs:
+        heapq.heappush(events, (submission_time, order, "submit", (job_id, tasks)))
+        order += 1
+
+    def start_tasks(now):
+        nonlocal idle_workers, order
+
+        # Tasks of capped users are retried later, the others run in queue order
+        deferred = []
+
+        while idle_workers and queue:
+            task = heapq.heappop(queue)
+
+            if user_cap and running_per_user.get(task.user_id, 0) >= user_cap:
+                deferred.append(task)
+                continue
+
+            idle_workers -= 1
+            running_per_user[task.user_id] = running_per_user.get(task.user_id, 0) + 1
+            heapq.heappush(events, (now + task.duration, order, "finish", task))
+            order += 1
+
+        for task in deferred:
+            heapq.heappush(queue, task)
+
+    while events:
+        now, event_order, event_type, payload = heapq.heappop(events)
+
+        if event_type == "submit":
+            job_id, tasks = payload
+            submitted_at[job_id] = now
+            remaining_per_job[job_id] = len(tasks)
+
+            for priority, user_id, task_job_id, duration in tasks:
+                heapq.heappush(
+                    queue,
+                    SimulatedTask(priority, sequence, user_id, task_job_id, duration),
+                )
+                sequence += 1
+        else:
+            task = payload
+            idle_workers += 1
+            running_per_user[task.user_id] -= 1
+            remaining_per_job[task.job_id] -= 1
+
+            if remaining_per_job[task.job_id] == 0:
+                latencies[task.job_id] = now - submitted_at[task.job_id]
+
+        start_tasks(now)
+
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--large", type=int, default=2000)
+    parser.add_argument("--small", type=int, default=5)
+    parser.add_argument("--small-jobs", type=int, default=3)
+    parser.add_argument("--user-cap", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    scenarios = [("fifo", False, 0), ("priority", True, 0)]
+
+    if args.user_cap:
+        scenarios.append(("priority+cap", True, args.user_cap))
+
+    print(
+        f"{args.workers} workers, 1 extraction of {args.large} studies, then "
+        f"{args.small_jobs} extractions of {args.small} studies (other users)"
+    )
+
+    for name, fair_share, user_cap in scenarios:
+        rng = random.Random(args.seed)
+
+        # The small extractions are launched by other users once the large one runs
+        large_job = make_job("large", "user-large", args.large, fair_share, rng)
+        jobs = [(0, "large", large_job)]
+        jobs += [
+            (
+                (i + 1) * TASK_DURATION * 5,
+                f"small-{i}",
+                make_job(f"small-{i}", f"user-{i}", args.small, fair_share, rng),
+            )
+            for i in range(args.small_jobs)
+        ]
+
+        latencies = simulate(jobs, args.workers, user_cap=user_cap)
+        small_latencies = [
+            latency for job_id, latency in latencies.items() if job_id != "large"
+        ]
+
+        mean_small_latency = sum(small_latencies) / len(small_latencies)
+
+        print(
+            f"{name:>14}: small extractions {mean_small_latency / 60:.1f}min"
+            f" on average (max {max(small_latencies) / 60:.1f}min),"
+            f" large extraction {latencies['large'] / 60:.1f}min"
+        )
+
+
+if __name__ == "__main__":
+    main()
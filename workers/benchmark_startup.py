@@ -0,0 +1,112 @@
+"""
+Measure the startup cost of each worker (import time & memory) and check that
+the workers of a queue don't load the libraries of the other queue
+
+Usage (in a worker container): python benchmark_startup.py
+Exits with an error if a task module imports one of its excluded packages.
+"""
+import re
+import subprocess
+import sys
+
+# Task module loaded by the workers of each queue & packages it should not import
+EXCLUDED_PACKAGES = {
+    "tasks_extraction": ["sklearn", "sksurv", "pydevd_pycharm"],
+    "tasks_training": ["okapy", "SimpleITK", "pydevd_pycharm"],
+}
+
+# Number of slowest imports to report
+N_SLOWEST_IMPORTS = 10
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(.+)")
+
+RESULT_PREFIX = "Startup result:"
+
+CHECK_SCRIPT = """
+import resource
+import sys
+import {module}
+loaded = [p for p in {excluded!r} if p in sys.modules]
+max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print("{prefix}" + str(max_rss) + ";" + ",".join(loaded))
+"""
+
+
+def run_startup(module, excluded_packages):
+    process = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            CHECK_SCRIPT.format(
+                module=module, excluded=excluded_packages, prefix=RESULT_PREFIX
+            ),
+        ],
+        capture_output=True,
+        text=True,
+    )
+
+    if process.returncode != 0:
+        print(process.stderr)
+        sys.exit(process.returncode)
+
+    result = [
+        line[len(RESULT_PREFIX) :]
+        for line in process.stdout.splitlines()
+        if line.startswith(RESULT_PREFIX)
+    ][0]
+
+    # Maximum resident set size of the worker process (in kilobytes on Linux)
+    max_rss, loaded_packages = result.split(";")
+
+    return process.stderr, loaded_packages, int(max_rss)
+
+
+def parse_import_times(import_time_output):
+    # Imports with their cumulative time (in microseconds) & if they are top-level
+    import_times = []
+
+    for line in import_time_output.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+
+        if match:
+            self_time, cumulative_time, indent, module = match.groups()
+            import_times.append((int(cumulative_time), len(indent) == 1, module))
+
+    return import_times
+
+
+def main():
+    failed = False
+
+    for module, excluded_packages in EXCLUDED_PACKAGES.items():
+        import_time_output, loaded_packages, max_rss = run_startup(
+            module, excluded_packages
+        )
+        import_times = parse_import_times(import_time_output)
+
+        total_time = sum(
+            cumulative for cumulative, top_level, name in import_times if top_level
+        )
+
+        print(f"{module}")
+        print(f"  Total import time: {total_time / 1e6:.2f}s")
+        print(f"  Max RSS: {max_rss / 1024:.1f}MB")
+        print("  Slowest imports:")
+
+        for cumulative, top_level, name in sorted(import_times, reverse=True)[
+            :N_SLOWEST_IMPORTS
+        ]:
+            print(f"    {cumulative / 1e6:.3f}s {name.strip()}")
+
+        if loaded_packages:
+            print(f"  Excluded packages loaded at startup: {loaded_packages}")
+            failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
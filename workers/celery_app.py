@@ -0,0 +1,132 @@
+"""
+Common core of the Celery workers (Celery app, debugger, Socket.IO & metrics setup)
+
+The tasks are split by queue (tasks_extraction & tasks_training), so that each
+worker only imports the libraries of the tasks it executes.
+"""
+import os
+import logging
+import socket
+import tempfile
+from time import perf_counter
+
+# Port of the metrics exporter of the worker (disabled if not set)
+WORKER_METRICS_PORT = os.environ.get("WORKER_METRICS_PORT")
+
+# The tasks run in the pool processes, which write their metrics to files read
+# by the exporter. Must be set before prometheus_client is imported, in a new
+# directory on each start so that the files of a previous run are ignored.
+if WORKER_METRICS_PORT and "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prometheus-")
+
+from flask_socketio import SocketIO
+from celery import Celery
+from celery.signals import (
+    celeryd_after_setup,
+    task_prerun,
+    task_postrun,
+    worker_process_shutdown,
+)
+from prometheus_client import CollectorRegistry, multiprocess, start_http_server
+
+from quantimage2_backend_common.extraction_scheduling import (
+    CELERY_BROKER_TRANSPORT_OPTIONS,
+)
+from quantimage2_backend_common.flask_init import create_app
+from quantimage2_backend_common.metrics import CELERY_TASK_DURATION, SOCKETIO_EMITS
+
+# Setup Debugger
+if "DEBUGGER_IP" in os.environ and os.environ["DEBUGGER_IP"] != "":
+    # Only needed for debugging, don't load it in every worker
+    import pydevd_pycharm
+
+    try:
+        pydevd_pycharm.settrace(
+            os.environ["DEBUGGER_IP"],
+            port=int(os.environ["DEBUGGER_PORT"]),
+            suspend=False,
+            stderrToServer=True,
+            stdoutToServer=True,
+        )
+    except ConnectionRefusedError:
+        logging.warning("No debug server running")
+    except socket.timeout:
+        logging.warning("Could not connect to the debugger")
+
+
+celery = Celery(
+    "tasks",
+    backend=os.environ["CELERY_RESULT_BACKEND"],
+    broker=os.environ["CELERY_BROKER_URL"],
+)
+celery.conf.accept_content = ["pickle", "json"]
+celery.conf.broker_transport_options = CELERY_BROKER_TRANSPORT_OPTIONS
+
+# Only reserve one task at a time, so that the task priorities are respected
+celery.conf.worker_prefetch_multiplier = 1
+
+# Backend client, initialized once the worker has started
+socketio = None
+
+# Start time of the tasks running in the current process, by task ID
+task_started_at = {}
+
+
+class MeteredSocketIO(SocketIO):
+    # Count the messages sent to the clients, by event
+    def emit(self, event, *args, **kwargs):
+        SOCKETIO_EMITS.labels(event).inc()
+
+        return super().emit(event, *args, **kwargs)
+
+
+@celeryd_after_setup.connect
+def setup(sender, instance, **kwargs):
+    """
+    Run once the Celery worker has started.
+
+    Initialize the Flask-SocketIO instance & start the metrics exporter.
+    """
+
+    # Backend client
+    global socketio
+
+    socketio = MeteredSocketIO(message_queue=os.environ["SOCKET_MESSAGE_QUEUE"])
+
+    # Create basic Flask app and push an app context to allow DB operations
+    flask_app = create_app()
+    flask_app.app_context().push()
+
+    if WORKER_METRICS_PORT:
+        start_metrics_exporter(int(WORKER_METRICS_PORT))
+
+
+def start_metrics_exporter(port):
+    # Aggregate the metrics of all the processes of the worker
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+
+    start_http_server(port, registry=registry)
+
+    print(f"Serving the worker metrics on port {port}")
+
+
+@task_prerun.connect
+def start_task_timer(task_id, task, **kwargs):
+    task_started_at[task_id] = perf_counter()
+
+
+@task_postrun.connect
+def observe_task_duration(task_id, task, state=None, **kwargs):
+    started_at = task_started_at.pop(task_id, None)
+
+    if started_at is not None:
+        CELERY_TASK_DURATION.labels(task.name, state or "UNKNOWN").observe(
+            perf_counter() - started_at
+        )
+
+
+@worker_process_shutdown.connect
+def remove_process_metrics(pid=None, **kwargs):
+    if WORKER_METRICS_PORT:
+        multiprocess.mark_process_dead(pid or os.getpid())
@@ -1,2 +0,0 @@
-# Models
-MODELS_BASE_DIR = "/quantimage2-data/models"
@@ -0,0 +1,1356 @@
+"""
+Celery tasks for running and finalizing feature extractions
+(run by the workers of the extraction queue)
+"""
+import os
+import logging
+import shutil
+import tempfile
+import threading
+import traceback
+
+import billiard
+import pandas as pd
+import requests
+import warnings
+import yaml
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+from datetime import datetime
+from email.message import Message
+from time import sleep
+from typing import Dict, Any, Iterable, List
+
+from celery import chord
+from celery.result import GroupResult
+from celery.utils import uuid
+from celery import states as celerystates
+from celery.exceptions import Ignore
+from celery.signals import task_revoked, worker_ready
+from kombu.utils.json import dumps, loads
+
+import celery_app
+from celery_app import celery
+
+from quantimage2_backend_common.cancellation import (
+    TaskCancelled,
+    get_extraction_cancellation_key,
+    check_cancellation,
+    is_cancelled,
+)
+from quantimage2_backend_common.const import QUEUE_EXTRACTION
+from quantimage2_backend_common.extraction_checkpoint import (
+    get_checkpoint_dir,
+    register_attempt,
+    get_partial_download_dir,
+    save_download_checkpoint,
+    get_download_checkpoint,
+    save_features_checkpoint,
+    has_features_checkpoint,
+    load_features_checkpoint,
+    delete_checkpoint,
+    get_checkpoints_disk_usage,
+    delete_stale_checkpoints,
+)
+from quantimage2_backend_common.extraction_memory import (
+    get_study_image_bytes,
+    reserve_extraction_memory,
+    release_extraction_memory,
+    clear_extraction_memory,
+)
+from quantimage2_backend_common.extraction_timing import (
+    QUEUE_STAGE,
+    DOWNLOAD_STAGE,
+    EXTRACT_STAGE,
+    STORE_STAGE,
+    STATUS_STAGE,
+    start_timings,
+    stop_timings,
+    record_stage,
+    time_stage,
+    timed_stage,
+    get_directory_bytes,
+)
+from quantimage2_backend_common.extraction_prefetch import (
+    claim_download,
+    release_download,
+)
+from quantimage2_backend_common.extraction_scheduling import (
+    get_extraction_priority,
+    acquire_extraction_slot,
+    release_extraction_slot,
+    get_waiting_extraction_users,
+)
+from quantimage2_backend_common.feature_storage import store_features
+from quantimage2_backend_common.metrics import (
+    KHEOPS_REQUEST_DURATION,
+    record_cache_lookups,
+)
+from quantimage2_backend_common.models import (
+    FeatureExtractionTask,
+    FeatureExtractionTaskTiming,
+    db,
+    FeatureExtraction,
+    FeatureValue,
+)
+from quantimage2_backend_common.kheops_utils import (
+    get_token_header,
+    get_studies_from_album,
+    get_series_from_study,
+    dicomFields,
+)
+from quantimage2_backend_common.utils import (
+    get_socketio_body_feature_task,
+    get_socketio_body_extraction,
+    ExtractionStatus,
+    MessageType,
+    task_status_message,
+    fetch_extraction_result,
+    send_extraction_status_message,
+)
+
+from okapy.dicomconverter.converter import ExtractorConverter
+
+warnings.filterwarnings("ignore", message="Failed to parse headers")
+
+from quantimage2_backend_common.kheops_utils import endpoints
+
+# Modalities of the series containing the ROIs
+ROI_MODALITIES = ["RTSTRUCT", "SEG"]
+
+# Number of series of a study downloaded in parallel
+SERIES_DOWNLOAD_THREADS = int(os.environ.get("SERIES_DOWNLOAD_THREADS", 4))
+
+# Size of the chunks streamed from the backend (in bytes)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Number of processes computing the features of a study (1 to compute them in the task)
+EXTRACTION_STUDY_PROCESSES = int(os.environ.get("EXTRACTION_STUDY_PROCESSES", 1))
+
+# How the features of a study are split between its processes
+STUDY_SPLIT_MODALITY = "modality"
+STUDY_SPLIT_MODALITY_ROI = "modality_roi"
+EXTRACTION_STUDY_SPLIT = os.environ.get(
+    "EXTRACTION_STUDY_SPLIT", STUDY_SPLIT_MODALITY_ROI
+)
+
+# Interval between the cancellation checks of a study's processes (in seconds)
+STUDY_CANCELLATION_POLL_INTERVAL = 5
+
+# Maximum number of studies of a user extracted at the same time (0 for no limit)
+EXTRACTION_USER_CONCURRENCY = int(os.environ.get("EXTRACTION_USER_CONCURRENCY", 0))
+
+# Disk space for the studies downloaded ahead of their task (in bytes, 0 to disable)
+EXTRACTION_PREFETCH_DISK_BUDGET = int(
+    float(os.environ.get("EXTRACTION_PREFETCH_DISK_BUDGET_GB", 0)) * 1024**3
+)
+
+# Number of studies downloaded ahead by each task
+EXTRACTION_PREFETCH_DEPTH = int(os.environ.get("EXTRACTION_PREFETCH_DEPTH", 1))
+
+# Number of next studies considered for prefetching (skipping those already claimed)
+EXTRACTION_PREFETCH_WINDOW = 20
+
+# Interval between the checks of a study being prefetched by another task (in seconds)
+PREFETCH_WAIT_INTERVAL = 5
+
+# Part of the worker's memory that the running studies can use (0 for no limit)
+EXTRACTION_MEMORY_BUDGET = float(os.environ.get("EXTRACTION_MEMORY_BUDGET", 0))
+
+# Memory used by the extraction of a study, relative to the size of its images
+# (DICOM conversion, resampling & feature computation)
+EXTRACTION_MEMORY_FACTOR = float(os.environ.get("EXTRACTION_MEMORY_FACTOR", 8))
+
+# Memory used by the extraction of a study regardless of its size (in bytes)
+EXTRACTION_BASE_MEMORY = 512 * 1024 * 1024
+
+# Size of the images of a study whose series metadata can't be fetched (in bytes)
+DEFAULT_STUDY_IMAGE_BYTES = 300 * 512 * 512 * 2
+
+# Delay before sending a task again when its worker doesn't have enough memory
+# (in seconds, not counted as a retry)
+EXTRACTION_MEMORY_RETRY_DELAY = 30
+
+# Number of attempts of a study before it is marked as failed
+EXTRACTION_MAX_ATTEMPTS = int(os.environ.get("EXTRACTION_MAX_ATTEMPTS", 3))
+
+# Delay before retrying a failed study, doubled at each attempt (in seconds)
+EXTRACTION_RETRY_BACKOFF = 60
+EXTRACTION_RETRY_BACKOFF_MAX = 10 * 60
+
+
+@worker_ready.connect
+def reset_memory_reservations(sender, **kwargs):
+    # The reservations of the tasks running before a restart are not used anymore
+    if EXTRACTION_MEMORY_BUDGET:
+        clear_extraction_memory(sender.hostname)
+
+    # Don't let the studies of revoked tasks use the prefetch budget
+    delete_stale_checkpoints()
+
+    # Start the waiting tasks whose slots were released by crashed workers
+    for user_id in get_waiting_extraction_users():
+        start_waiting_tasks(user_id, None)
+
+
+@celery.task(name="quantimage2tasks.dispatch_extraction", bind=True)
+def dispatch_extraction(
+    self,
+    *,
+    feature_extraction_id,
+    user_id,
+    album_id,
+    album_name,
+    album_token,
+    config_path,
+    rois,
+    previous_extraction_id=None,
+):
+    """
+    Launch a feature extraction created by the webapp : list the studies of
+    the album, create one task per study & start them as a chord
+
+    For incremental extractions, the features of the studies that were
+    successfully extracted by the previous extraction (with the same config) are
+    copied, only the new & failed studies are extracted again
+
+    :param feature_extraction_id: The ID of the Feature Extraction to launch
+    :param user_id: The ID of the user running the extraction
+    :param album_id: The ID of the Kheops album to extract
+    :param album_name: The name of the Kheops album
+    :param album_token: The album token created by the webapp (valid for 24 hours)
+    :param config_path: The path of the saved extraction configuration
+    :param rois: The ROIs to extract the features from
+    :param previous_extraction_id: The ID of the extraction to reuse (optional)
+    """
+    try:
+        feature_extraction = FeatureExtraction.find_by_id(feature_extraction_id)
+
+        send_dispatch_progress(feature_extraction_id, "Listing album studies")
+
+        # Assemble study UIDs
+        album_studies = get_studies_from_album(album_id, album_token)
+        study_uids = [
+            study[dicomFields.STUDY_UID][dicomFields.VALUE][0]
+            for study in album_studies
+        ]
+
+        # Successfully extracted studies of the previous extraction, by study UID
+        reused_tasks = {}
+
+        if previous_extraction_id is not None:
+            album_study_uids = set(study_uids)
+            reused_tasks = {
+                task.study_uid: task
+                for task in FeatureExtractionTask.find_successful_by_extraction(
+                    previous_extraction_id
+                )
+                if task.study_uid in album_study_uids
+            }
+
+        reused_study_uids = list(reused_tasks)
+        new_study_uids = [
+            study_uid for study_uid in study_uids if study_uid not in reused_tasks
+        ]
+
+        if previous_extraction_id is not None:
+            record_cache_lookups(
+                "extraction_studies", len(reused_study_uids), len(new_study_uids)
+            )
+
+        send_dispatch_progress(
+            feature_extraction_id,
+            f"Creating {len(new_study_uids)} extraction tasks"
+            f" (reusing {len(reused_study_uids)} studies)",
+        )
+
+        # Reused studies get a Celery task that is already successful, so that
+        # they are counted as completed in the status of the extraction
+        reused_task_ids = [uuid() for _ in reused_study_uids]
+        task_ids = reused_task_ids + [None] * len(new_study_uids)
+
+        # Create all the extraction tasks at once (reused studies first)
+        feature_extraction_task_ids = FeatureExtractionTask.create_tasks_batch(
+            feature_extraction_id, reused_study_uids + new_study_uids, task_ids
+        )
+
+        if reused_study_uids:
+            FeatureValue.copy_features_batch(
+                previous_extraction_id, feature_extraction_id, reused_study_uids
+            )
+
+            previous_extraction = FeatureExtraction.find_by_id(previous_extraction_id)
+            feature_extraction.modalities = list(previous_extraction.modalities)
+            feature_extraction.rois = list(previous_extraction.rois)
+            feature_extraction.feature_definitions = list(
+                previous_extraction.feature_definitions
+            )
+
+        task_signatures = [
+            celery.signature(
+                "quantimage2tasks.extract",
+                args=[
+                    feature_extraction_id,
+                    user_id,
+                    feature_extraction_task_id,
+                    study_uid,
+                    album_id,
+                    album_name,
+                    album_token,
+                    config_path,
+                    rois,
+                ],
+                kwargs={},
+                countdown=1,
+                link=celery.signature(
+                    "quantimage2tasks.finalize_extraction_task",
+                    args=[feature_extraction_id, feature_extraction_task_id],
+                    queue=QUEUE_EXTRACTION,
+                ),
+                queue=QUEUE_EXTRACTION,
+                priority=get_extraction_priority(task_index),
+            )
+            for task_index, (feature_extraction_task_id, study_uid) in enumerate(
+                zip(
+                    feature_extraction_task_ids[len(reused_study_uids) :],
+                    new_study_uids,
+                )
+            )
+        ]
+
+        finalize_signature = celery.signature(
+            "quantimage2tasks.finalize_extraction",
+            args=[feature_extraction_id],
+            queue=QUEUE_EXTRACTION,
+        )
+
+        # Stop before any task is created if the extraction was cancelled meanwhile
+        check_cancellation(get_extraction_cancellation_key(feature_extraction_id))
+
+        # The tasks must be in the DB before the workers start them
+        db.session.commit()
+
+        for task_id, feature_extraction_task_id in zip(
+            reused_task_ids, feature_extraction_task_ids
+        ):
+            celery.backend.store_result(
+                task_id,
+                get_reused_task_result(feature_extraction_task_id),
+                celerystates.SUCCESS,
+            )
+
+        extracted_results = []
+
+        if task_signatures:
+            # Start the tasks as a chord
+            job = chord(task_signatures, body=finalize_signature).apply_async(
+                countdown=1
+            )
+            extracted_results = job.parent.results
+
+        # The results of the reused & extracted studies (in the order of the tasks)
+        group_result = GroupResult(
+            uuid(),
+            [celery.AsyncResult(task_id) for task_id in reused_task_ids]
+            + extracted_results,
+            app=celery,
+        )
+        group_result.save()
+
+        # Persist group result manually, because by default it's using 24 hours
+        # (not clear why, it should respect the result_expires setting used for
+        # normal results)
+        celery.backend.client.persist(celery.backend.get_key_for_group(group_result.id))
+
+        feature_extraction.result_id = group_result.id
+        db.session.commit()
+
+        if not task_signatures:
+            finalize_signature.apply_async()
+
+        # Send the whole extraction (with its tasks) now that it has started
+        send_extraction_status_message(
+            feature_extraction_id, celery, celery_app.socketio, send_extraction=True
+        )
+    except TaskCancelled:
+        db.session.rollback()
+
+        send_dispatch_progress(
+            feature_extraction_id,
+            "Cancelled",
+            status=ExtractionStatus(ready=True, failed=True),
+        )
+    except Exception as e:
+        logging.error(e)
+        db.session.rollback()
+
+        send_dispatch_progress(
+            feature_extraction_id,
+            f"Failure! {e}",
+            status=ExtractionStatus(ready=True, failed=True),
+        )
+
+        raise e
+    finally:
+        db.session.remove()
+
+
+def get_reused_task_result(feature_extraction_task_id):
+    # Same format as the result of a completed extraction task
+    return {
+        "feature_extraction_task_id": feature_extraction_task_id,
+        "current": 1,
+        "total": 1,
+        "completed": 1,
+        "status_message": "Reused from the previous extraction",
+    }
+
+
+def send_dispatch_progress(feature_extraction_id, status_message, status=None):
+    # Before the chord is started, the extraction has no tasks to report on
+    if status is None:
+        status = ExtractionStatus()
+
+    socketio_body = get_socketio_body_extraction(
+        feature_extraction_id, vars(status), status_message=status_message
+    )
+
+    celery_app.socketio.emit(MessageType.EXTRACTION_STATUS.value, socketio_body)
+
+
+# Acknowledged once complete, so that the tasks of crashed workers are redelivered
+# (the failures are limited by EXTRACTION_MAX_ATTEMPTS, not by Celery's retries)
+@celery.task(
+    name="quantimage2tasks.extract",
+    bind=True,
+    acks_late=True,
+    reject_on_worker_lost=True,
+    max_retries=None,
+)
+def run_extraction(
+    self,
+    feature_extraction_id,
+    user_id,
+    feature_extraction_task_id,
+    study_uid,
+    album_id,
+    album_name,
+    album_token,
+    config_path,
+    rois,
+    memory_estimate=None,
+):
+    # Let the tasks of other users run if this user has too many running tasks,
+    # this task waits in a list of the user until one of them completes
+    if not acquire_extraction_slot(
+        user_id,
+        self.request.id,
+        EXTRACTION_USER_CONCURRENCY,
+        dumps(self.signature_from_request()),
+    ):
+        raise Ignore()
+
+    # Estimated once (it needs a request to Kheops), then sent along with the task
+    if EXTRACTION_MEMORY_BUDGET and memory_estimate is None:
+        memory_estimate = estimate_study_memory(
+            album_token, study_uid, album_id, config_path
+        )
+
+    # Let another worker (or this one later) run the study if it lacks memory
+    if EXTRACTION_MEMORY_BUDGET and not reserve_extraction_memory(
+        self.request.hostname,
+        self.request.id,
+        memory_estimate,
+        EXTRACTION_MEMORY_BUDGET,
+    ):
+        if EXTRACTION_USER_CONCURRENCY:
+            start_waiting_tasks(user_id, self.request.id)
+
+        # Sent again without counting a retry, deferrals are not failures
+        self.signature_from_request(
+            kwargs={**self.request.kwargs, "memory_estimate": memory_estimate}
+        ).apply_async(countdown=EXTRACTION_MEMORY_RETRY_DELAY)
+
+        raise Ignore()
+
+    cancellation_key = get_extraction_cancellation_key(feature_extraction_id)
+
+    # Completed stages of previous attempts are resumed from their checkpoint
+    checkpoint_dir = get_checkpoint_dir(feature_extraction_task_id)
+    attempt = register_attempt(checkpoint_dir)
+
+    # Durations of the stages of the task, saved once it ends
+    timings_token = start_timings()
+
+    try:
+
+        current_step = 1
+        steps = 2
+
+        db.session.commit()
+
+        # Keep failing a study whose worker keeps dying (e.g. out of memory)
+        if attempt > EXTRACTION_MAX_ATTEMPTS:
+            raise Exception(f"The extraction was interrupted {attempt - 1} times")
+
+        # Affect celery task ID to task (if needed)
+        print(f"Getting Feature Extraction Task with id {feature_extraction_task_id}")
+        feature_extraction_task = FeatureExtractionTask.find_by_id(
+            feature_extraction_task_id
+        )
+
+        feature_extraction = FeatureExtraction.find_by_id(feature_extraction_id)
+
+        if not feature_extraction_task:
+            raise Exception("Didn't find the task in the DB!!!")
+
+        if not feature_extraction_task.task_id:
+            feature_extraction_task.task_id = self.request.id
+            feature_extraction_task.save_to_db()
+
+        # Time spent waiting for a worker (including deferrals)
+        if attempt == 1:
+            queued_for = datetime.utcnow() - feature_extraction_task.created_at
+            record_stage(QUEUE_STAGE, queued_for.total_seconds())
+
+        features = load_features_checkpoint(checkpoint_dir)
+
+        if features is None:
+            # Status update - DOWNLOAD
+            status_message = "Fetching DICOM files"
+            update_progress(
+                self,
+                feature_extraction_id,
+                feature_extraction_task_id,
+                current_step,
+                steps,
+                status_message,
+            )
+
+            # Download the needed series of the study and write files to directory
+            with time_stage(DOWNLOAD_STAGE) as download_timing:
+                dicom_dir = get_study_download(
+                    self,
+                    checkpoint_dir,
+                    feature_extraction_task_id,
+                    study_uid,
+                    album_id,
+                    album_token,
+                    config_path,
+                    cancellation_key,
+                )
+                download_timing["bytes"] = get_directory_bytes(dicom_dir)
+
+            # Download the next studies while this one is computed
+            start_prefetch(
+                self,
+                feature_extraction_id,
+                feature_extraction_task_id,
+                album_id,
+                album_token,
+                config_path,
+                cancellation_key,
+            )
+
+            # Extract all the features
+            features = extract_all_features(
+                self,
+                dicom_dir,
+                config_path,
+                rois,
+                feature_extraction_id,
+                feature_extraction_task_id=feature_extraction_task_id,
+                current_step=current_step,
+                steps=steps,
+                album_name=album_name,
+            )
+
+            save_features_checkpoint(checkpoint_dir, features)
+        else:
+            print(f"Resuming study {study_uid} from its extracted features")
+
+        # Don't store the features of a cancelled extraction
+        check_cancellation(cancellation_key)
+
+        # Save the features (replacing those of an interrupted attempt)
+        with time_stage(STORE_STAGE) as store_timing:
+            store_features(
+                feature_extraction_task_id,
+                feature_extraction_id,
+                features,
+            )
+            store_timing["rows"] = len(features)
+
+        delete_checkpoint(checkpoint_dir)
+
+        # Extraction is complete
+        status_message = "Extraction Complete"
+
+        # TODO Find a better way to do this, not from the task level hopefully
+        # Check if parent is done
+        extraction_status = fetch_extraction_result(
+            celery, feature_extraction.result_id
+        )
+
+        return {
+            "feature_extraction_task_id": feature_extraction_task_id,
+            "current": steps,
+            "total": steps,
+            "completed": steps,
+            "status_message": status_message,
+        }
+    except TaskCancelled:
+        delete_checkpoint(checkpoint_dir)
+
+        current_step = 0
+        status_message = "Cancelled"
+        print(
+            f"Feature extraction task {feature_extraction_task_id} - {current_step}/{steps} - {status_message}"
+        )
+
+        meta = {
+            "feature_extraction_task_id": feature_extraction_task_id,
+            "current": current_step,
+            "total": steps,
+            "status_message": status_message,
+        }
+
+        update_task_state(self, celerystates.REVOKED, meta)
+
+        socketio_body = get_socketio_body_feature_task(
+            self.request.id,
+            feature_extraction_task_id,
+            celerystates.REVOKED,
+            task_status_message(current_step, steps, status_message),
+        )
+        celery_app.socketio.emit(MessageType.FEATURE_TASK_STATUS.value, socketio_body)
+
+        send_extraction_status_message(
+            feature_extraction_id, celery, celery_app.socketio
+        )
+
+        # Keep the REVOKED state instead of marking the task as successful
+        raise Ignore()
+    except Exception as e:
+
+        logging.error(e)
+
+        db.session.rollback()
+
+        if attempt < EXTRACTION_MAX_ATTEMPTS:
+            countdown = min(
+                EXTRACTION_RETRY_BACKOFF * 2 ** (attempt - 1),
+                EXTRACTION_RETRY_BACKOFF_MAX,
+            )
+
+            update_progress(
+                self,
+                feature_extraction_id,
+                feature_extraction_task_id,
+                current_step,
+                steps,
+                f"Retrying in {countdown}s (attempt {attempt}/{EXTRACTION_MAX_ATTEMPTS}"
+                f" failed)",
+            )
+
+            raise self.retry(
+                exc=e,
+                countdown=countdown,
+                kwargs={**self.request.kwargs, "memory_estimate": memory_estimate},
+            )
+
+        delete_checkpoint(checkpoint_dir)
+
+        current_step = 0
+        status_message = "Failure!"
+        print(
+            f"Feature extraction task {feature_extraction_task_id} - {current_step}/{steps} - {status_message}"
+        )
+
+        meta = {
+            "exc_type": type(e).__name__,
+            "exc_message": traceback.format_exc().split("\n"),
+            "feature_extraction_task_id": feature_extraction_task_id,
+            "current": current_step,
+            "total": steps,
+            "status_message": status_message,
+        }
+
+        update_task_state(self, celerystates.FAILURE, meta)
+
+        # Send Socket.IO message
+        socketio_body = get_socketio_body_feature_task(
+            self.request.id,
+            feature_extraction_task_id,
+            celerystates.FAILURE,
+            task_status_message(current_step, steps, status_message),
+        )
+
+        # Send Socket.IO message to clients about task
+        celery_app.socketio.emit(MessageType.FEATURE_TASK_STATUS.value, socketio_body)
+
+        # Send Socket.IO message to clients about extraction
+        send_extraction_status_message(
+            feature_extraction_id, celery, celery_app.socketio
+        )
+
+        print("PROBLEM WHEN EXTRACTING STUDY WITH UID  " + study_uid)
+
+        raise e
+
+    finally:
+        if EXTRACTION_USER_CONCURRENCY:
+            start_waiting_tasks(user_id, self.request.id)
+
+        if EXTRACTION_MEMORY_BUDGET:
+            release_extraction_memory(self.request.hostname, self.request.id)
+
+        save_timings(feature_extraction_task_id, attempt, stop_timings(timings_token))
+
+        db.session.remove()
+
+
+def start_waiting_tasks(user_id, task_id):
+    # Send the waiting tasks of the user that got the released slot(s)
+    for task in release_extraction_slot(user_id, task_id, EXTRACTION_USER_CONCURRENCY):
+        celery.signature(loads(task)).apply_async()
+
+
+@task_revoked.connect
+def release_revoked_slot(sender=None, request=None, **kwargs):
+    # A waiting task can be handed a slot after it was revoked (e.g. cancelled
+    # extraction), the worker then discards it without running it
+    if EXTRACTION_USER_CONCURRENCY and sender.name == run_extraction.name:
+        start_waiting_tasks(request.args[1], request.id)
+
+
+@celery.task(name="quantimage2tasks.finalize_extraction", bind=True)
+def finalize_extraction(task, results, feature_extraction_id):
+    send_extraction_status_message(
+        feature_extraction_id, celery, celery_app.socketio, send_extraction=True
+    )
+    db.session.remove()
+
+
+@celery.task(name="quantimage2tasks.finalize_extraction_task", bind=True)
+def finalize_extraction_task(
+    task, result, feature_extraction_id, feature_extraction_task_id
+):
+    # Send Socket.IO message
+    socketio_body = get_socketio_body_feature_task(
+        task.request.id,
+        feature_extraction_task_id,
+        celerystates.SUCCESS,
+        "Extraction Complete",
+    )
+
+    # Send Socket.IO message to clients about task
+    celery_app.socketio.emit(MessageType.FEATURE_TASK_STATUS.value, socketio_body)
+
+    # Send Socket.IO message to clients about extraction
+    send_extraction_status_message(feature_extraction_id, celery, celery_app.socketio)
+
+    db.session.remove()
+
+
+def save_timings(
+    feature_extraction_task_id: int, attempt: int, timings: List[Dict[str, Any]]
+) -> None:
+    # The timings are only used for profiling, don't fail the task because of them
+    try:
+        FeatureExtractionTaskTiming.save_timings_batch(
+            feature_extraction_task_id, attempt, timings
+        )
+    except Exception as e:
+        db.session.rollback()
+        logging.warning(
+            f"Could not save the timings of task {feature_extraction_task_id}: {e}"
+        )
+
+
+@timed_stage(STATUS_STAGE)
+def update_progress(
+    task: celery.Task,
+    feature_extraction_id: int,
+    feature_extraction_task_id: int,
+    current_step: int,
+    steps: int,
+    status_message: str,
+) -> None:
+    """
+    Update the progress of a feature extraction Task
+
+    :param task: The Celery Task associated with the Feature Extraction Task
+    :param feature_extraction_id: The ID of the Feature Extraction to update (can include several tasks)
+    :param feature_extraction_task_id: The ID of the specific Feature Task to update
+    :param current_step: The current step (out of N steps) in the extraction process
+    :param steps: The total number of steps in the extraction process
+    :param status_message: The status message to show for the task (Downloading, Converting, etc.)
+    :returns: None
+    """
+    print(
+        f"Feature extraction task {feature_extraction_task_id} - {current_step}/{steps} - {status_message}"
+    )
+
+    # TODO : Make this an enum
+    status = "PROGRESS"
+
+    meta = {
+        "task_id": task.request.id,
+        "feature_extraction_task_id": feature_extraction_task_id,
+        "current": current_step,
+        "total": steps,
+        "completed": current_step - 1,
+        "status_message": status_message,
+    }
+
+    # Update task state in Celery
+    update_task_state(task, status, meta)
+
+    # Send Socket.IO message
+    socketio_body = get_socketio_body_feature_task(
+        task.request.id,
+        feature_extraction_task_id,
+        status,
+        task_status_message(current_step, steps, status_message),
+    )
+
+    # Send Socket.IO message to clients about task
+    celery_app.socketio.emit(MessageType.FEATURE_TASK_STATUS.value, socketio_body)
+
+    # Send Socket.IO message to clients about extraction
+    send_extraction_status_message(feature_extraction_id, celery, celery_app.socketio)
+
+
+def update_task_state(task: celery.Task, state: str, meta: Dict[str, Any]) -> None:
+    """
+    Update the State of a Celery Task
+
+    :param task: The Celery Task to update
+    :param state: DICOM Study UID
+    :param meta: A Dictionary with state values
+    :returns: None
+    """
+    task.update_state(state=state, meta=meta)
+
+
+def download_study(
+    token: str, study_uid: str, album_id: str, modalities: List[str], output_dir: str
+) -> str:
+    """
+    Download the series of a study that are needed for the extraction (images of
+    the extracted modalities & ROI series) and write all files to a directory
+
+    :param token: Valid access token for the backend
+    :param study_uid: The UID of the study to download
+    :param album_id: The ID of the Kheops album to filter the output by
+    :param modalities: The image modalities to download (e.g. CT, PT)
+    :param output_dir: The directory to write the files to
+    :returns: Path to the directory of downloaded files
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    study_series = get_series_from_study(
+        study_uid, modalities + ROI_MODALITIES, album_id, token
+    )
+    series_uids = [
+        series[dicomFields.SERIES_UID][dicomFields.VALUE][0] for series in study_series
+    ]
+
+    print(f"Downloading {len(series_uids)} series of study {study_uid}")
+
+    try:
+        with ThreadPoolExecutor(max_workers=SERIES_DOWNLOAD_THREADS) as executor:
+            futures = [
+                executor.submit(
+                    download_series,
+                    token,
+                    study_uid,
+                    series_uid,
+                    album_id,
+                    os.path.join(output_dir, "DICOM", series_uid),
+                )
+                for series_uid in series_uids
+            ]
+
+            # Raise any download error
+            for future in futures:
+                future.result()
+    except Exception:
+        # Don't leave partially downloaded studies behind
+        shutil.rmtree(output_dir, True)
+        raise
+
+    return output_dir
+
+
+def download_series(
+    token: str, study_uid: str, series_uid: str, album_id: str, series_dir: str
+) -> int:
+    """
+    Download the instances of a series (WADO-RS) and write them to a directory,
+    the multipart response is streamed to the files without being held in memory
+
+    :param token: Valid access token for the backend
+    :param study_uid: The UID of the study of the series
+    :param series_uid: The UID of the series to download
+    :param album_id: The ID of the Kheops album to filter the output by
+    :param series_dir: The directory to write the instances to
+    :returns: The number of downloaded instances
+    """
+    os.makedirs(series_dir, exist_ok=True)
+
+    series_download_url = (
+        f"{endpoints.studies}/{study_uid}/series/{series_uid}?album={album_id}"
+    )
+
+    headers = {
+        **get_token_header(token),
+        "Accept": 'multipart/related; type="application/dicom"',
+    }
+
+    # Timed until the whole series is written, the body is streamed
+    with KHEOPS_REQUEST_DURATION.labels("series_download").time(), requests.get(
+        series_download_url, headers=headers, stream=True
+    ) as response:
+        response.raise_for_status()
+
+        return write_multipart_parts(
+            response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE),
+            get_multipart_boundary(response.headers["Content-Type"]),
+            series_dir,
+        )
+
+
+def get_multipart_boundary(content_type: str) -> bytes:
+    message = Message()
+    message["Content-Type"] = content_type
+
+    return message.get_param("boundary").encode()
+
+
+def write_multipart_parts(
+    chunks: Iterable[bytes], boundary: bytes, output_dir: str
+) -> int:
+    """
+    Write each part of a multipart body to a separate file
+
+    :param chunks: The chunks of the multipart body
+    :param boundary: The boundary of the multipart body
+    :param output_dir: The directory to write the parts to
+    :returns: The number of written parts
+    """
+    delimiter = b"\r\n--" + boundary
+    delimiter_end = len(delimiter) + 2
+
+    # The first delimiter is not preceded by a line break
+    buffer = b"\r\n"
+    part_file = None
+    n_parts = 0
+
+    for chunk in chunks:
+        buffer += chunk
+
+        while True:
+            if part_file is None:
+                # Look for the next delimiter & the end of the part headers
+                start = buffer.find(delimiter)
+
+                if start == -1 or len(buffer) < start + delimiter_end:
+                    break
+
+                # Close delimiter, there are no more parts
+                if buffer[start + len(delimiter) : start + delimiter_end] == b"--":
+                    return n_parts
+
+                headers_end = buffer.find(b"\r\n\r\n", start + len(delimiter))
+
+                if headers_end == -1:
+                    break
+
+                n_parts += 1
+                part_file = open(os.path.join(output_dir, f"{n_parts}.dcm"), "wb")
+                buffer = buffer[headers_end + 4 :]
+            else:
+                end = buffer.find(delimiter)
+
+                if end == -1:
+                    # Keep what could be the beginning of the next delimiter
+                    safe_length = len(buffer) - len(delimiter)
+
+                    if safe_length > 0:
+                        part_file.write(buffer[:safe_length])
+                        buffer = buffer[safe_length:]
+
+                    break
+
+                part_file.write(buffer[:end])
+                part_file.close()
+                part_file = None
+                buffer = buffer[end:]
+
+    if part_file is not None:
+        part_file.close()
+
+    raise ValueError("Incomplete multipart response")
+
+
+def get_study_download(
+    task: celery.Task,
+    checkpoint_dir: str,
+    feature_extraction_task_id: int,
+    study_uid: str,
+    album_id: str,
+    token: str,
+    config_path: str,
+    cancellation_key: str,
+) -> str:
+    """
+    Get the downloaded files of a study, from its checkpoint if the study was
+    already downloaded (by a previous attempt or prefetched by another task)
+
+    :param task: The Celery Task extracting the study
+    :param checkpoint_dir: The checkpoint directory of the study's task
+    :param feature_extraction_task_id: The ID of the specific Feature Task
+    :param study_uid: The UID of the study to download
+    :param album_id: The ID of the Kheops album to filter the output by
+    :param token: Valid access token for the backend
+    :param config_path: Path to the YAML config file with the extraction parameters
+    :param cancellation_key: The cancellation key of the extraction
+    :returns: Path to the directory of downloaded files
+    """
+    dicom_dir = get_download_checkpoint(checkpoint_dir)
+
+    # Wait for the end of a prefetch of the study
+    while dicom_dir is None and not claim_download(
+        feature_extraction_task_id, task.request.id
+    ):
+        check_cancellation(cancellation_key)
+        sleep(PREFETCH_WAIT_INTERVAL)
+        dicom_dir = get_download_checkpoint(checkpoint_dir)
+
+    if dicom_dir is not None:
+        print(f"Using the downloaded files of study {study_uid}")
+        return dicom_dir
+
+    try:
+        check_cancellation(cancellation_key)
+
+        return save_download_checkpoint(
+            checkpoint_dir,
+            download_study(
+                token,
+                study_uid,
+                album_id,
+                get_config_modalities(config_path),
+                get_partial_download_dir(checkpoint_dir),
+            ),
+        )
+    finally:
+        release_download(feature_extraction_task_id)
+
+
+def start_prefetch(
+    task: celery.Task,
+    feature_extraction_id: int,
+    feature_extraction_task_id: int,
+    album_id: str,
+    token: str,
+    config_path: str,
+    cancellation_key: str,
+) -> None:
+    """
+    Download the next studies of an extraction in a background thread, so that
+    their tasks don't wait for their download (bounded by the disk budget)
+
+    :param task: The Celery Task extracting the current study
+    :param feature_extraction_id: The ID of the Feature Extraction
+    :param feature_extraction_task_id: The ID of the current Feature Task
+    :param album_id: The ID of the Kheops album to filter the output by
+    :param token: Valid access token for the backend
+    :param config_path: Path to the YAML config file with the extraction parameters
+    :param cancellation_key: The cancellation key of the extraction
+    :returns: None
+    """
+    if not EXTRACTION_PREFETCH_DISK_BUDGET:
+        return
+
+    # The thread has no app context, get the next studies from the DB here
+    next_tasks = [
+        (next_task.id, next_task.study_uid)
+        for next_task in FeatureExtractionTask.find_pending_after(
+            feature_extraction_id,
+            feature_extraction_task_id,
+            EXTRACTION_PREFETCH_WINDOW,
+        )
+    ]
+
+    if not next_tasks:
+        return
+
+    threading.Thread(
+        target=prefetch_studies,
+        args=(
+            next_tasks,
+            f"prefetch-{task.request.id}",
+            album_id,
+            token,
+            get_config_modalities(config_path),
+            cancellation_key,
+        ),
+        daemon=True,
+    ).start()
+
+
+def prefetch_studies(
+    next_tasks: List[tuple],
+    prefetcher_id: str,
+    album_id: str,
+    token: str,
+    modalities: List[str],
+    cancellation_key: str,
+) -> None:
+    prefetched = 0
+
+    for feature_extraction_task_id, study_uid in next_tasks:
+        if prefetched >= EXTRACTION_PREFETCH_DEPTH or is_cancelled(cancellation_key):
+            return
+
+        try:
+            checkpoint_dir = get_checkpoint_dir(feature_extraction_task_id)
+
+            # Already downloaded (or even extracted) by its task or another prefetch
+            is_downloaded = get_download_checkpoint(checkpoint_dir) is not None
+            if is_downloaded or has_features_checkpoint(checkpoint_dir):
+                continue
+
+            study_bytes = get_study_image_bytes(
+                get_series_from_study(study_uid, modalities, album_id, token)
+            )
+            disk_usage = get_checkpoints_disk_usage() + study_bytes
+
+            if disk_usage > EXTRACTION_PREFETCH_DISK_BUDGET:
+                print(f"Not prefetching study {study_uid}, the disk budget is used")
+                return
+
+            # Being downloaded by its task or another prefetch
+            if not claim_download(feature_extraction_task_id, prefetcher_id):
+                continue
+
+            try:
+                print(f"Prefetching study {study_uid}")
+
+                save_download_checkpoint(
+                    checkpoint_dir,
+                    download_study(
+                        token,
+                        study_uid,
+                        album_id,
+                        modalities,
+                        get_partial_download_dir(checkpoint_dir),
+                    ),
+                )
+                prefetched += 1
+            finally:
+                release_download(feature_extraction_task_id)
+        except Exception as e:
+            # The study's task downloads it itself
+            logging.warning(f"Could not prefetch study {study_uid}: {e}")
+
+
+def estimate_study_memory(
+    token: str, study_uid: str, album_id: str, config_path: str
+) -> int:
+    """
+    Estimate the memory needed to extract the features of a study, from the
+    size of its images (known from the Kheops metadata, before downloading)
+
+    :param token: Valid access token for the backend
+    :param study_uid: The UID of the study to extract
+    :param album_id: The ID of the Kheops album to filter the output by
+    :param config_path: Path to the YAML config file with the extraction parameters
+    :returns: The estimated memory (in bytes)
+    """
+    try:
+        study_series = get_series_from_study(
+            study_uid, get_config_modalities(config_path), album_id, token
+        )
+        image_bytes = get_study_image_bytes(study_series)
+    except Exception as e:
+        logging.warning(f"Could not estimate the size of study {study_uid}: {e}")
+        image_bytes = DEFAULT_STUDY_IMAGE_BYTES
+
+    # Each process of the study loads its own copy of the images
+    return EXTRACTION_STUDY_PROCESSES * int(
+        EXTRACTION_BASE_MEMORY + image_bytes * EXTRACTION_MEMORY_FACTOR
+    )
+
+
+def get_config_modalities(config_path: str) -> List[str]:
+    # The modalities to extract are the keys of the feature extraction config
+    with open(config_path) as config_file:
+        config = yaml.safe_load(config_file)
+
+    return list(config["feature_extraction"].keys())
+
+
+def get_study_jobs(modalities: List[str], rois: list, split: str) -> List[tuple]:
+    """
+    Split the extraction of a study into independent jobs
+
+    :param modalities: The modalities to extract (keys of the extraction config)
+    :param rois: The ROIs to extract the features from (empty for all the ROIs)
+    :param split: How to split the extraction (STUDY_SPLIT_MODALITY or
+                  STUDY_SPLIT_MODALITY_ROI)
+    :returns: The (modality, ROIs) of each job
+    """
+    # Without a list of ROIs, okapy finds them itself so they can't be split
+    if split == STUDY_SPLIT_MODALITY_ROI and rois:
+        return [(modality, [roi]) for modality in modalities for roi in rois]
+
+    return [(modality, rois) for modality in modalities]
+
+
+def write_modality_config(config_path: str, modality: str, output_dir: str) -> str:
+    # Same config, restricted to the features of a single modality
+    with open(config_path) as config_file:
+        config = yaml.safe_load(config_file)
+
+    config["feature_extraction"] = {modality: config["feature_extraction"][modality]}
+
+    modality_config_path = os.path.join(output_dir, f"{modality}.yaml")
+
+    with open(modality_config_path, "w") as modality_config_file:
+        yaml.dump(config, modality_config_file)
+
+    return modality_config_path
+
+
+def run_converter(config_path: str, dicom_dir: str, rois: list) -> pd.DataFrame:
+    converter = ExtractorConverter.from_params(config_path)
+
+    return converter(dicom_dir, labels=rois)
+
+
+def run_converter_parallel(
+    config_path: str, dicom_dir: str, rois: list, cancellation_key: str
+) -> pd.DataFrame:
+    """
+    Extract the features of a study with a pool of processes, one job per
+    modality (and ROI, see EXTRACTION_STUDY_SPLIT)
+
+    :param config_path: Path to the YAML config file with the extraction parameters
+    :param dicom_dir: Path to the folder containing all DICOM images
+    :param rois: The ROIs to extract the features from
+    :param cancellation_key: The cancellation key of the extraction
+    :returns: The features of all the jobs, as returned by okapy for the whole study
+    """
+    jobs = get_study_jobs(
+        get_config_modalities(config_path), rois, EXTRACTION_STUDY_SPLIT
+    )
+
+    print(f"Extracting the features in {len(jobs)} jobs")
+
+    config_dir = tempfile.mkdtemp()
+
+    try:
+        modality_configs = {
+            modality: write_modality_config(config_path, modality, config_dir)
+            for modality in {modality for modality, job_rois in jobs}
+        }
+
+        # Each job converts the images it needs itself (in its own process), the
+        # processes are started by billiard because the processes of the prefork
+        # pool are daemonic (multiprocessing doesn't let them have children)
+        with ProcessPoolExecutor(
+            max_workers=min(EXTRACTION_STUDY_PROCESSES, len(jobs)),
+            mp_context=billiard.get_context("fork"),
+        ) as executor:
+            futures = [
+                executor.submit(
+                    run_converter, modality_configs[modality], dicom_dir, job_rois
+                )
+                for modality, job_rois in jobs
+            ]
+
+            # Don't start the remaining jobs of a cancelled extraction
+            pending = futures
+            while pending:
+                done, pending = wait(pending, timeout=STUDY_CANCELLATION_POLL_INTERVAL)
+
+                if pending and is_cancelled(cancellation_key):
+                    for future in pending:
+                        future.cancel()
+
+                    raise TaskCancelled("Cancelled by the user")
+
+            job_features = [future.result() for future in futures]
+    finally:
+        shutil.rmtree(config_dir, True)
+
+    return pd.concat(job_features, ignore_index=True)
+
+
+def get_bytes_from_file(filename):
+    return open(filename, "rb").read()
+
+
+def extract_all_features(
+    task: celery.Task,
+    dicom_dir: str,
+    config_path: str,
+    rois: list,
+    feature_extraction_id: int,
+    feature_extraction_task_id: int = None,
+    current_step: int = None,
+    steps: int = None,
+    album_name: str = None,
+) -> Dict[str, Any]:
+    """
+    Update the progress of a feature extraction Task
+
+    :param task: Celery Task associated with the Feature Extraction Task
+    :param dicom_dir: Path to the folder containing all DICOM images
+    :param config_path: Path to the YAML config file with the extraction parameters (TODO - Detail more)
+    :param feature_extraction_id: The ID of the Feature Extraction (global, can include multiple patients)
+    :param feature_extraction_task_id: The ID of the specific Feature Task (for a given study)
+    :param current_step: The current step (out of N steps) in the extraction process (should be 1 at this point)
+    :param steps: The total number of steps in the extraction process (currently 3 - Download, Conversion, Extraction)
+    :param album_name: The name of the Kheops album to which the study belongs (for customizing label extraction)
+    :returns: A dictionary with the extracted features
+    """
+    # Status update - PROCESS
+    current_step += 1
+    status_message = "Processing data"
+    update_progress(
+        task,
+        feature_extraction_id,
+        feature_extraction_task_id,
+        current_step,
+        steps,
+        status_message,
+    )
+
+    cancellation_key = get_extraction_cancellation_key(feature_extraction_id)
+
+    # The conversion & extraction can't be interrupted, check before starting
+    check_cancellation(cancellation_key)
+
+    # Get results directly from Okapy (failures are reported by run_extraction,
+    # which retries the study), the conversion & computation are a single call
+    with time_stage(EXTRACT_STAGE) as extract_timing:
+        if EXTRACTION_STUDY_PROCESSES > 1:
+            conversion_result = run_converter_parallel(
+                config_path, dicom_dir, rois, cancellation_key
+            )
+        else:
+            conversion_result = run_converter(config_path, dicom_dir, rois)
+
+        extract_timing["rows"] = len(conversion_result)
+
+    print(f"!!!!!!!!!!!!Final Features!!!!!!!!!")
+    print(conversion_result)
+
+    result = conversion_result
+
+    return result
@@ -0,0 +1,728 @@
+"""
+Celery tasks for training machine learning models & predicting with them
+(run by the workers of the training queue)
+"""
+import os
+import logging
+from time import time
+
+from flask import jsonify
+from celery import chord
+
+import sklearn
+from joblib import parallel_backend
+from sklearn.base import clone
+from sklearn.model_selection import cross_validate
+from ttictoc import tic, toc
+
+import celery_app
+from celery_app import celery
+
+from quantimage2_backend_common.cancellation import (
+    TaskCancelled,
+    get_training_cancellation_key,
+    is_cancelled,
+    check_cancellation,
+    clear_cancellation,
+)
+from quantimage2_backend_common.const import (
+    TRAINING_PHASES,
+    SEARCH_STRATEGIES,
+    MODEL_TYPES,
+    QUEUE_TRAINING,
+)
+from quantimage2_backend_common.metrics import record_cache_lookups
+from quantimage2_backend_common.models import (
+    db,
+    Model,
+    LabelCategory,
+    CandidateCVResult,
+)
+from quantimage2_backend_common.training_data import (
+    load_training_data,
+    load_training_setting,
+    save_training_settings,
+    delete_training_data,
+    get_transform_cache_dir,
+)
+from quantimage2_backend_common.training_lock import (
+    refresh_training_lock,
+    release_training_lock,
+    unregister_training_run,
+)
+from quantimage2_backend_common.model_store import save_model, load_cached_model
+from quantimage2_backend_common.utils import MessageType, format_model
+
+from utils import (
+    calculate_training_metrics,
+    run_bootstrap,
+    calculate_test_metrics,
+    get_model_name,
+    make_halving_search,
+    get_search_candidates,
+    fit_and_score,
+    aggregate_cv_results,
+    get_best_index,
+    get_training_data_fingerprint,
+    get_candidate_fingerprint,
+    split_results_from_stored,
+    stored_results_from_split,
+    resolve_scorers,
+    split_results_from_cross_validation,
+    add_best_candidate_results,
+    get_transform_cache_hit_ratio,
+)
+
+
+@celery.task(name="quantimage2tasks.train", bind=True)
+def train_model(
+    self,
+    *,
+    feature_extraction_id,
+    collection_id,
+    album,
+    feature_selection,
+    estimator_step,
+    scoring,
+    refit_metric,
+    n_jobs,
+    training_data_dir,
+    label_category_id,
+    data_splitting_type,
+    train_test_splitting_type,
+    is_train_test,
+    random_seed,
+    training_id,
+    user_id,
+    search_strategy=SEARCH_STRATEGIES.GRID.value,
+    training_fingerprint=None,
+    run_id=None,
+):
+    db.session.commit()
+
+    # The lock expires if the training stops being refreshed (e.g. worker crash)
+    refresh_training_lock(training_fingerprint, run_id)
+
+    # Everything needed to finalize the training once the search is complete
+    # (the other settings are loaded from the training data directory)
+    training_kwargs = {
+        "feature_extraction_id": feature_extraction_id,
+        "collection_id": collection_id,
+        "album": album,
+        "feature_selection": feature_selection,
+        "estimator_step": estimator_step,
+        "scoring": scoring,
+        "refit_metric": refit_metric,
+        "n_jobs": n_jobs,
+        "training_data_dir": training_data_dir,
+        "label_category_id": label_category_id,
+        "data_splitting_type": data_splitting_type,
+        "train_test_splitting_type": train_test_splitting_type,
+        "is_train_test": is_train_test,
+        "random_seed": random_seed,
+        "training_id": training_id,
+        "user_id": user_id,
+    }
+
+    is_dispatched = False
+    socketio_body = None
+
+    try:
+        # Memory-mapped arrays, the fits only read the rows they need
+        X_train = load_training_data(training_data_dir, "X_train")
+        y_train_encoded = load_training_data(training_data_dir, "y_train")
+
+        pipeline = load_training_pipeline(training_data_dir)
+        parameter_grid = load_training_setting(training_data_dir, "parameter_grid")
+        cv = load_training_setting(training_data_dir, "cv")
+
+        if SEARCH_STRATEGIES(search_strategy) == SEARCH_STRATEGIES.HALVING:
+            label_category = LabelCategory.find_by_id(label_category_id)
+
+            tic()
+
+            best_estimator, best_index, cv_results, n_fits = run_halving_search(
+                X_train,
+                y_train_encoded,
+                parameter_grid,
+                label_category.label_type,
+                pipeline=pipeline,
+                cv=cv,
+                training_fingerprint=training_fingerprint,
+                run_id=run_id,
+                **training_kwargs,
+            )
+
+            print(f"Fitting the model took {toc()}")
+
+            socketio_body = complete_training(
+                best_estimator, best_index, cv_results, n_fits, **training_kwargs
+            )
+        else:
+            # Fit & score each candidate on each split in a separate task,
+            # spread over all the training workers
+            candidates = get_search_candidates(
+                search_strategy, parameter_grid, random_seed
+            )
+            splits = list(cv.split(X_train, y_train_encoded))
+
+            # Loaded by the fits, the indices of the splits grow with the dataset
+            save_training_settings(training_data_dir, splits=splits)
+
+            # Reuse the results of candidates already evaluated on the same data & splits
+            data_fingerprint = get_training_data_fingerprint(
+                X_train, y_train_encoded, splits
+            )
+            fingerprints = [
+                get_candidate_fingerprint(data_fingerprint, pipeline, parameters)
+                for parameters in candidates
+            ]
+            stored_results = CandidateCVResult.find_by_fingerprints(fingerprints)
+
+            reused_results = []
+            for candidate_index, fingerprint in enumerate(fingerprints):
+                if fingerprint in stored_results:
+                    reused_results += (
+                        split_results_from_stored(
+                            candidate_index, stored_results[fingerprint], scoring
+                        )
+                        or []
+                    )
+            reused_candidates = {r["candidate_index"] for r in reused_results}
+            record_cache_lookups(
+                "training_candidates",
+                len(reused_candidates),
+                len(candidates) - len(reused_candidates),
+            )
+
+            fit_signatures = [
+                fit_and_score_candidate.s(
+                    parameters=parameters,
+                    candidate_index=candidate_index,
+                    split_index=split_index,
+                    scoring=scoring,
+                    training_data_dir=training_data_dir,
+                    training_id=training_id,
+                    training_fingerprint=training_fingerprint,
+                    run_id=run_id,
+                ).set(queue=QUEUE_TRAINING, serializer="pickle")
+                for candidate_index, parameters in enumerate(candidates)
+                if candidate_index not in reused_candidates
+                for split_index in range(len(splits))
+            ]
+
+            finalize_signature = finalize_training.s(
+                training_fingerprint=training_fingerprint,
+                run_id=run_id,
+                candidates=candidates,
+                fingerprints=fingerprints,
+                reused_results=reused_results,
+                started_at=time(),
+                **training_kwargs,
+            ).set(queue=QUEUE_TRAINING, serializer="pickle")
+
+            # Stop before dispatching the fits if the training was cancelled meanwhile
+            check_cancellation(get_training_cancellation_key(run_id))
+
+            # Reused fits count as completed steps
+            for _ in reused_results:
+                send_training_progress(training_id)
+
+            if fit_signatures:
+                # Cleans up if a fit task can't return its result (e.g. worker lost)
+                finalize_signature.on_error(
+                    fail_training.s(
+                        training_data_dir=training_data_dir,
+                        training_id=training_id,
+                        user_id=user_id,
+                        training_fingerprint=training_fingerprint,
+                        run_id=run_id,
+                    )
+                )
+                chord(fit_signatures, body=finalize_signature).apply_async()
+            else:
+                finalize_signature.apply_async(args=([],))
+            is_dispatched = True
+
+            print(
+                f"Dispatched {len(fit_signatures)} fits ({len(candidates)} candidates x {len(splits)} splits, {len(reused_candidates)} candidates reused)"
+            )
+    except TaskCancelled as e:
+        socketio_body = get_cancelled_training_body(training_id, e)
+        clear_cancellation(get_training_cancellation_key(run_id))
+    except Exception as e:
+        socketio_body = {"training-id": training_id, "failed": True, "error": str(e)}
+        logging.error(e)
+    finally:
+        if not is_dispatched:
+            delete_training_data(training_data_dir)
+            release_training_lock(training_fingerprint, run_id)
+            unregister_training_run(user_id, training_id, run_id)
+        if socketio_body:
+            celery_app.socketio.emit(
+                MessageType.TRAINING_STATUS.value, jsonify(socketio_body).get_json()
+            )
+        db.session.remove()
+
+
+@celery.task(name="quantimage2tasks.fit_and_score", bind=True)
+def fit_and_score_candidate(
+    self,
+    *,
+    parameters,
+    candidate_index,
+    split_index,
+    scoring,
+    training_data_dir,
+    training_id,
+    training_fingerprint=None,
+    run_id=None,
+):
+    # Skip the remaining fits of a cancelled training, finalize_training cleans up
+    if is_cancelled(get_training_cancellation_key(run_id)):
+        return None
+
+    try:
+        refresh_training_lock(training_fingerprint, run_id)
+
+        X_train = load_training_data(training_data_dir, "X_train")
+        y_train_encoded = load_training_data(training_data_dir, "y_train")
+
+        pipeline = load_training_pipeline(training_data_dir)
+        train_index, test_index = load_training_setting(training_data_dir, "splits")[
+            split_index
+        ]
+
+        scores, fit_time = fit_and_score(
+            pipeline,
+            parameters,
+            X_train,
+            y_train_encoded,
+            train_index,
+            test_index,
+            resolve_scorers(scoring),
+        )
+    except Exception as e:
+        # A failed task would stop the chord before finalize_training, which
+        # fails the training with this error & cleans up
+        logging.error(e)
+        return {
+            "candidate_index": candidate_index,
+            "split_index": split_index,
+            "error": str(e),
+        }
+
+    # Progress report (one step per fit)
+    send_training_progress(training_id)
+
+    return {
+        "candidate_index": candidate_index,
+        "split_index": split_index,
+        "scores": scores,
+        "fit_time": fit_time,
+    }
+
+
+@celery.task(name="quantimage2tasks.finalize_training", bind=True)
+def finalize_training(
+    self,
+    results,
+    *,
+    training_fingerprint,
+    run_id=None,
+    candidates,
+    fingerprints,
+    reused_results,
+    started_at,
+    training_data_dir,
+    training_id,
+    **kwargs,
+):
+    cancellation_key = get_training_cancellation_key(run_id)
+
+    refresh_training_lock(training_fingerprint, run_id)
+
+    try:
+        db.session.commit()
+
+        check_cancellation(cancellation_key)
+
+        failed_results = [
+            result for result in results if result is not None and "error" in result
+        ]
+
+        if failed_results:
+            raise RuntimeError(
+                f"{len(failed_results)} fits failed, e.g. {failed_results[0]['error']}"
+            )
+
+        print(f"Fitting the model took {time() - started_at}")
+
+        cv = load_training_setting(training_data_dir, "cv")
+        scoring = kwargs["scoring"]
+        n_splits = cv.get_n_splits()
+
+        # Keep the results of the new candidates for later trainings
+        CandidateCVResult.save_results_batch(
+            stored_results_from_split(results, fingerprints)
+        )
+
+        cv_results = aggregate_cv_results(
+            results + reused_results, candidates, n_splits, scoring
+        )
+        best_index = get_best_index(cv_results, kwargs["refit_metric"])
+
+        # Refit the best candidate on the whole training set
+        X_train = load_training_data(training_data_dir, "X_train")
+        y_train_encoded = load_training_data(training_data_dir, "y_train")
+
+        best_estimator = load_training_pipeline(training_data_dir).set_params(
+            **candidates[best_index]
+        )
+        best_estimator.fit(X_train, y_train_encoded)
+
+        # All new candidates on all splits + the final refit
+        n_fits = len(results) + 1
+
+        socketio_body = complete_training(
+            best_estimator,
+            best_index,
+            cv_results,
+            n_fits,
+            training_data_dir=training_data_dir,
+            training_id=training_id,
+            **kwargs,
+        )
+    except TaskCancelled as e:
+        socketio_body = get_cancelled_training_body(training_id, e)
+        clear_cancellation(cancellation_key)
+    except Exception as e:
+        socketio_body = {"training-id": training_id, "failed": True, "error": str(e)}
+        logging.error(e)
+    finally:
+        delete_training_data(training_data_dir)
+        release_training_lock(training_fingerprint, run_id)
+        unregister_training_run(kwargs["user_id"], training_id, run_id)
+        celery_app.socketio.emit(
+            MessageType.TRAINING_STATUS.value, jsonify(socketio_body).get_json()
+        )
+        db.session.remove()
+
+
+@celery.task(name="quantimage2tasks.fail_training")
+def fail_training(
+    request,
+    exc,
+    traceback,
+    *,
+    training_data_dir,
+    training_id,
+    user_id,
+    training_fingerprint,
+    run_id,
+):
+    """
+    Error callback of the fits of a training, called instead of finalize_training
+    when one of them fails (the others may still be running)
+    """
+    logging.error(exc)
+
+    delete_training_data(training_data_dir)
+    release_training_lock(training_fingerprint, run_id)
+    unregister_training_run(user_id, training_id, run_id)
+
+    socketio_body = {"training-id": training_id, "failed": True, "error": str(exc)}
+    celery_app.socketio.emit(
+        MessageType.TRAINING_STATUS.value, jsonify(socketio_body).get_json()
+    )
+
+
+def run_halving_search(
+    X_train,
+    y_train_encoded,
+    parameter_grid,
+    label_type,
+    *,
+    pipeline,
+    scoring,
+    refit_metric,
+    cv,
+    n_jobs,
+    random_seed,
+    training_id,
+    training_fingerprint,
+    run_id,
+    **kwargs,
+):
+    """
+    Run a successive halving search, whose iterations depend on each other
+    and are therefore run in the current task (using threads for parallelism)
+
+    :param X_train: The training features
+    :param y_train_encoded: The training labels
+    :param parameter_grid: The grid of parameters to explore
+    :param label_type: The type of model (see MODEL_TYPES)
+    :returns: The refit best estimator, its index in the CV results, the CV results
+              (of all iterations, with the best estimator on all metrics) & the
+              number of fits
+    """
+    # Use Outcome for classification models & Event for survival models
+    label_values_to_count = (
+        y_train_encoded
+        if MODEL_TYPES(label_type) == MODEL_TYPES.CLASSIFICATION
+        else [y[0] for y in y_train_encoded]
+    )
+
+    # Successive halving only supports a single metric, report progress along with it
+    refit_scorer = resolve_scorers(scoring)[refit_metric]
+    cancellation_key = get_training_cancellation_key(run_id)
+
+    def search_scoring(estimator, X, y):
+        send_training_progress(training_id)
+        refresh_training_lock(training_fingerprint, run_id)
+
+        # scikit-learn turns scoring errors into NaN scores, so once cancelled
+        # the remaining candidates are not scored (their fits can't be skipped)
+        check_cancellation(cancellation_key)
+
+        return refit_scorer(estimator, X, y)
+
+    search = make_halving_search(
+        pipeline,
+        parameter_grid,
+        search_scoring,
+        cv,
+        n_jobs,
+        random_seed,
+        len(X_train),
+        len(set(label_values_to_count)),
+    )
+
+    splits = list(cv.split(X_train, y_train_encoded))
+
+    # Worker processes are daemonic and cannot start child processes
+    with parallel_backend("threading", n_jobs=n_jobs):
+        fitted_model = search.fit(X_train, y_train_encoded)
+
+        check_cancellation(cancellation_key)
+
+        # Score the best candidate on all metrics with the full training set
+        split_results = split_results_from_cross_validation(
+            cross_validate(
+                clone(fitted_model.best_estimator_),
+                X_train,
+                y_train_encoded,
+                scoring=scoring,
+                cv=splits,
+                n_jobs=n_jobs,
+            ),
+            scoring,
+        )
+
+    # Same results as a fit of the best candidate by a grid or randomized search
+    data_fingerprint = get_training_data_fingerprint(X_train, y_train_encoded, splits)
+    CandidateCVResult.save_results_batch(
+        stored_results_from_split(
+            split_results,
+            [
+                get_candidate_fingerprint(
+                    data_fingerprint, pipeline, fitted_model.best_params_
+                )
+            ],
+        )
+    )
+
+    # All candidates on all splits + the final refit
+    n_fits = len(fitted_model.cv_results_["params"]) * cv.get_n_splits() + 1
+
+    return (
+        fitted_model.best_estimator_,
+        fitted_model.best_index_,
+        add_best_candidate_results(
+            fitted_model.cv_results_, fitted_model.best_index_, split_results, scoring
+        ),
+        n_fits,
+    )
+
+
+def complete_training(
+    best_estimator,
+    best_index,
+    cv_results,
+    n_fits,
+    *,
+    feature_extraction_id,
+    collection_id,
+    album,
+    feature_selection,
+    estimator_step,
+    scoring,
+    refit_metric,
+    n_jobs,
+    training_data_dir,
+    label_category_id,
+    data_splitting_type,
+    train_test_splitting_type,
+    is_train_test,
+    random_seed,
+    training_id,
+    user_id,
+):
+    """
+    Calculate the metrics of the best estimator found by the search & save it
+
+    :param best_estimator: The best estimator, refit on the whole training set
+    :param best_index: The index of the best estimator in the CV results
+    :param cv_results: The cross-validation results (same format as GridSearchCV)
+    :param n_fits: The total number of pipeline fits (for the cache statistics)
+    :returns: The body of the Socket.IO message announcing the new model
+    """
+    label_category = LabelCategory.find_by_id(label_category_id)
+
+    feature_names = load_training_setting(training_data_dir, "feature_names")
+    cv = load_training_setting(training_data_dir, "cv")
+
+    cache_dir = get_transform_cache_dir(training_data_dir)
+    cache_hit_ratio = get_transform_cache_hit_ratio(cache_dir, n_fits)
+    print(f"Preprocessing cache hit ratio was {cache_hit_ratio:.2%} ({n_fits} fits)")
+
+    # Calculate Training Metrics
+    training_metrics = calculate_training_metrics(
+        best_index,
+        cv_results,
+        scoring,
+        random_seed,
+    )
+    test_metrics = None
+
+    # Train/test only - Perform Bootstrap on the Test set
+    if is_train_test:
+        X_test = load_training_data(training_data_dir, "X_test")
+        y_test_encoded = load_training_data(training_data_dir, "y_test")
+
+        tic()
+        scores, n_bootstrap = run_bootstrap(
+            X_test,
+            y_test_encoded,
+            best_estimator,
+            random_seed,
+            scoring,
+            training_id=training_id,
+            socket_io=celery_app.socketio,
+            n_bootstrap=100,
+            n_jobs=n_jobs,
+        )
+        elapsed = toc()
+        print(f"Running bootstrap took {elapsed}")
+
+        test_metrics = calculate_test_metrics(scores, scoring, random_seed)
+
+    # Do not keep a reference to the (temporary) cache in the saved model
+    best_estimator.set_params(memory=None)
+
+    # Save model in the DB
+    best_params = best_estimator.get_params()
+    best_algorithm = best_params[estimator_step].__class__.__name__
+    best_normalization = best_params["preprocessor"].__class__.__name__
+
+    # Persist only the best estimator (& its metadata) on disk
+    model_path = save_model(
+        best_estimator,
+        {
+            "feature_names": list(feature_names),
+            "label_type": label_category.label_type,
+            "algorithm": best_algorithm,
+            "normalization": best_normalization,
+            "sklearn_version": sklearn.__version__,
+        },
+        user_id,
+        album["album_id"],
+        compress=int(os.environ.get("MODEL_COMPRESSION", 0)),
+    )
+
+    # Generate model name (for now)
+    model_name = get_model_name(album["name"], label_category.label_type)
+
+    # Get all other metadata for the model to be saved in the DB
+    training_validation = "Repeated Stratified K-Fold Cross-Validation"
+    training_validation_params = {"k": cv.cvargs["n_splits"], "n": cv.n_repeats}
+    test_validation = "Bootstrap" if is_train_test else None
+    test_validation_params = {"n": n_bootstrap} if is_train_test else None
+
+    db_model = Model(
+        model_name,
+        best_algorithm,
+        data_splitting_type,
+        train_test_splitting_type,
+        f"{training_validation} ({training_validation_params['k']} folds, {training_validation_params['n']} repetitions)",
+        (
+            f"{test_validation} ({test_validation_params['n']} repetitions)"
+            if test_validation
+            else None
+        ),
+        best_normalization,
+        feature_selection,
+        feature_names,
+        load_training_setting(training_data_dir, "training_patients"),
+        load_training_setting(training_data_dir, "test_patients"),
+        model_path,
+        training_metrics,
+        test_metrics,
+        user_id,
+        album["album_id"],
+        label_category.id,
+        feature_extraction_id,
+        collection_id,
+    )
+    db_model.save_to_db()
+
+    return {
+        "training-id": training_id,
+        "complete": True,
+        "model": format_model(db_model),
+    }
+
+
+def get_cancelled_training_body(training_id, e):
+    return {
+        "training-id": training_id,
+        "failed": True,
+        "cancelled": True,
+        "error": str(e),
+    }
+
+
+def load_training_pipeline(training_data_dir):
+    pipeline = load_training_setting(training_data_dir, "pipeline")
+
+    # Cache the preprocessing transforms, which only depend on the fold & normalizer
+    # (not on the hyper-parameters of the estimator), shared by all training workers
+    return pipeline.set_params(memory=get_transform_cache_dir(training_data_dir))
+
+
+def send_training_progress(training_id):
+    # Plain dictionary, can be sent from threads without a Flask app context
+    socketio_body = {
+        "training-id": training_id,
+        "phase": TRAINING_PHASES.TRAINING.value,
+    }
+    celery_app.socketio.emit(MessageType.TRAINING_STATUS.value, socketio_body)
+
+
+@celery.task(name="quantimage2tasks.predict", bind=True)
+def predict_model(self, *, model_path, patient_ids, X):
+    model, metadata = load_cached_model(model_path)
+
+    predictions = model.predict(X)
+    probabilities = None
+
+    try:
+        probabilities = model.predict_proba(X).tolist()
+    except AttributeError:
+        pass  # The model can't predict probabilities (e.g. survival), ignore this
+
+    return {
+        "patient-ids": patient_ids,
+        "predictions": predictions.tolist(),
+        "probabilities": probabilities,
+    }
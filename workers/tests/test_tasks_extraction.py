@@ -0,0 +1,81 @@
+import multiprocessing
+from time import perf_counter, sleep
+
+import billiard
+import pandas as pd
+import pytest
+
+import tasks_extraction
+from quantimage2_backend_common.cancellation import TaskCancelled
+
+
+def convert_job(config_path, dicom_dir, rois):
+    return pd.DataFrame({"config": [config_path], "rois": [",".join(rois)]})
+
+
+def convert_job_slowly(config_path, dicom_dir, rois):
+    sleep(1)
+
+
+@pytest.fixture
+def daemon_worker_process(monkeypatch):
+    # Same as a task running in a process of the prefork pool
+    monkeypatch.setitem(multiprocessing.current_process()._config, "daemon", True)
+    monkeypatch.setitem(billiard.current_process()._config, "daemon", True)
+
+
+@pytest.fixture
+def study_jobs(monkeypatch):
+    monkeypatch.setattr(tasks_extraction, "EXTRACTION_STUDY_PROCESSES", 2)
+    monkeypatch.setattr(tasks_extraction, "STUDY_CANCELLATION_POLL_INTERVAL", 0.1)
+    monkeypatch.setattr(
+        tasks_extraction, "get_config_modalities", lambda config_path: ["CT", "PT"]
+    )
+    monkeypatch.setattr(
+        tasks_extraction,
+        "write_modality_config",
+        lambda config_path, modality, output_dir: f"{modality}.yaml",
+    )
+
+
+def test_multiprocessing_fails_in_daemon_process(daemon_worker_process):
+    # The reason for starting the processes with billiard
+    with pytest.raises(AssertionError, match="daemonic processes"):
+        multiprocessing.Process(target=sleep, args=(0,)).start()
+
+
+def test_run_converter_parallel_in_daemon_process(
+    daemon_worker_process, study_jobs, monkeypatch
+):
+    monkeypatch.setattr(tasks_extraction, "run_converter", convert_job)
+    monkeypatch.setattr(tasks_extraction, "is_cancelled", lambda key: False)
+
+    features = tasks_extraction.run_converter_parallel(
+        "config.yaml", "dicom", ["GTV", "GTVn"], "cancellation-key"
+    )
+
+    # One job per modality & ROI, in the order of the jobs
+    assert features.to_dict("records") == [
+        {"config": "CT.yaml", "rois": "GTV"},
+        {"config": "CT.yaml", "rois": "GTVn"},
+        {"config": "PT.yaml", "rois": "GTV"},
+        {"config": "PT.yaml", "rois": "GTVn"},
+    ]
+
+
+def test_run_converter_parallel_cancelled(
+    daemon_worker_process, study_jobs, monkeypatch
+):
+    monkeypatch.setattr(tasks_extraction, "EXTRACTION_STUDY_PROCESSES", 1)
+    monkeypatch.setattr(tasks_extraction, "run_converter", convert_job_slowly)
+    monkeypatch.setattr(tasks_extraction, "is_cancelled", lambda key: True)
+
+    started_at = perf_counter()
+
+    with pytest.raises(TaskCancelled):
+        tasks_extraction.run_converter_parallel(
+            "config.yaml", "dicom", ["GTV", "GTVn"], "cancellation-key"
+        )
+
+    # Only the running job completes, the 3 others are not started
+    assert perf_counter() - started_at < 3
@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+from flask import Flask
+
+import celery_app
+import tasks_training
+
+TRAINING_KWARGS = {
+    "training_data_dir": "training-data-dir",
+    "training_id": "training-id",
+    "training_fingerprint": "training-fingerprint",
+    "run_id": "run-id",
+}
+
+
+@pytest.fixture
+def training_cleanup(monkeypatch):
+    cleanup = mock.Mock()
+
+    monkeypatch.setattr(tasks_training, "delete_training_data", cleanup.delete)
+    monkeypatch.setattr(tasks_training, "release_training_lock", cleanup.release)
+    monkeypatch.setattr(tasks_training, "unregister_training_run", cleanup.unregister)
+    monkeypatch.setattr(tasks_training, "refresh_training_lock", mock.Mock())
+    monkeypatch.setattr(tasks_training, "is_cancelled", lambda key: False)
+    monkeypatch.setattr(tasks_training, "check_cancellation", lambda key: None)
+    monkeypatch.setattr(tasks_training, "db", SimpleNamespace(session=mock.Mock()))
+    monkeypatch.setattr(celery_app, "socketio", mock.Mock(), raising=False)
+
+    with Flask(__name__).app_context():
+        yield cleanup
+
+
+def assert_training_failed(cleanup, error):
+    cleanup.delete.assert_called_once_with("training-data-dir")
+    cleanup.release.assert_called_once_with("training-fingerprint", "run-id")
+    cleanup.unregister.assert_called_once_with("user-id", "training-id", "run-id")
+
+    (message, socketio_body), _ = celery_app.socketio.emit.call_args
+    assert socketio_body["training-id"] == "training-id"
+    assert socketio_body["failed"] is True
+    assert error in socketio_body["error"]
+
+
+def test_fit_and_score_candidate_failure(training_cleanup, monkeypatch):
+    monkeypatch.setattr(
+        tasks_training,
+        "load_training_data",
+        mock.Mock(side_effect=FileNotFoundError("X_train.npy")),
+    )
+
+    result = tasks_training.fit_and_score_candidate.run(
+        parameters={},
+        candidate_index=1,
+        split_index=2,
+        scoring={"auc": "roc_auc"},
+        **TRAINING_KWARGS,
+    )
+
+    # Returned instead of raised, so that the chord still calls finalize_training
+    assert result == {"candidate_index": 1, "split_index": 2, "error": "X_train.npy"}
+
+
+def test_finalize_training_with_failed_fit(training_cleanup):
+    tasks_training.finalize_training.run(
+        [
+            {"candidate_index": 0, "split_index": 0, "scores": {}, "fit_time": 1},
+            {"candidate_index": 1, "split_index": 0, "error": "X_train.npy"},
+        ],
+        candidates=[{}, {}],
+        fingerprints=["a", "b"],
+        reused_results=[],
+        started_at=0,
+        user_id="user-id",
+        **TRAINING_KWARGS,
+    )
+
+    assert_training_failed(training_cleanup, "1 fits failed, e.g. X_train.npy")
+
+
+def test_fail_training(training_cleanup):
+    # Called by the chord with the request & the error of the failed fit
+    tasks_training.fail_training(
+        SimpleNamespace(id="fit-id"),
+        RuntimeError("Worker exited prematurely"),
+        None,
+        user_id="user-id",
+        **TRAINING_KWARGS,
+    )
+
+    assert_training_failed(training_cleanup, "Worker exited prematurely")
@@ -0,0 +1,251 @@
+import re
+
+import numpy as np
+import pytest
+from sklearn.metrics import accuracy_score, precision_score, recall_score, roc_auc_score
+from sklearn.utils import resample
+
+from utils import (
+    calculate_scores,
+    calculate_test_metrics,
+    calculate_training_metrics,
+    resolve_scorers,
+    score_bootstrap_chunk,
+    score_bootstrap_indices,
+)
+
+SEEDS = [0, 1, 42, 1234]
+SCORING = {"auc": "roc_auc", "accuracy": "accuracy", "precision": "precision"}
+
+
+# Loop-based implementation of the metrics before vectorization, kept as reference
+def baseline_bootstrap_on_results(results, random_seed, n_bootstrap=20):
+    return [
+        resample(
+            results,
+            replace=True,
+            n_samples=len(results),
+            random_state=random_seed + i,
+        )
+        for i in range(n_bootstrap)
+    ]
+
+
+def baseline_confidence_interval_quartiles(
+    metric_scores, bootstrapped_means, confidence
+):
+    return {
+        "mean": np.mean(metric_scores),
+        "inf_value": np.quantile(bootstrapped_means, ((1 - confidence) / 2)),
+        "sup_value": np.quantile(bootstrapped_means, 1 - ((1 - confidence) / 2)),
+    }
+
+
+def baseline_calculate_training_metrics(
+    best_index, cv_results, scoring, random_seed, confidence=0.95
+):
+    metrics = {}
+
+    for index, metric in enumerate(scoring.keys()):
+        metric_splits = {
+            k: v
+            for k, v in cv_results.items()
+            if re.match(rf"split\d_test_{metric}", k)
+        }
+        split_values = [v[best_index] for v in metric_splits.values()]
+
+        bootstrapped_values = baseline_bootstrap_on_results(
+            split_values, random_seed, n_bootstrap=20
+        )
+        bootstrapped_means = [np.mean(values) for values in bootstrapped_values]
+
+        metrics[metric] = baseline_confidence_interval_quartiles(
+            split_values, bootstrapped_means, confidence
+        )
+        metrics[metric]["order"] = index
+
+    return metrics
+
+
+def baseline_calculate_test_metrics(scores, scoring, random_seed, confidence=0.95):
+    metrics = {}
+
+    for index, metric in enumerate(scoring.keys()):
+        metric_scores = [score[metric] for score in scores]
+
+        bootstrapped_values = baseline_bootstrap_on_results(
+            metric_scores, random_seed, n_bootstrap=50
+        )
+        bootstrapped_means = [np.mean(values) for values in bootstrapped_values]
+
+        metrics[metric] = baseline_confidence_interval_quartiles(
+            metric_scores, bootstrapped_means, confidence
+        )
+        metrics[metric]["order"] = index
+
+    return metrics
+
+
+def make_cv_results(random_state, n_candidates, n_splits):
+    return {
+        f"split{split}_test_{metric}": random_state.rand(n_candidates)
+        for metric in SCORING
+        for split in range(n_splits)
+    }
+
+
+def assert_metrics_equal(result, expected):
+    assert list(result) == list(expected)
+
+    for metric, values in expected.items():
+        assert result[metric]["order"] == values["order"]
+
+        for key in ["mean", "inf_value", "sup_value"]:
+            assert result[metric][key] == pytest.approx(values[key], rel=1e-12)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("n_splits", [2, 5, 10])
+def test_training_metrics_match_baseline(seed, n_splits):
+    random_state = np.random.RandomState(seed)
+    cv_results = make_cv_results(random_state, n_candidates=8, n_splits=n_splits)
+    best_index = random_state.randint(8)
+
+    # The baseline only matches single-digit split numbers
+    expected_cv_results = {
+        key: value for key, value in cv_results.items() if re.match(r"split\d_", key)
+    }
+
+    result = calculate_training_metrics(best_index, cv_results, SCORING, seed)
+    expected = baseline_calculate_training_metrics(
+        best_index, expected_cv_results, SCORING, seed
+    )
+
+    if n_splits < 10:
+        assert_metrics_equal(result, expected)
+    else:
+        # The vectorized version uses all the splits
+        assert result["auc"]["mean"] == pytest.approx(
+            np.mean([cv_results[f"split{i}_test_auc"][best_index] for i in range(10)])
+        )
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("n_bootstrap", [1, 10, 1000])
+def test_test_metrics_match_baseline(seed, n_bootstrap):
+    random_state = np.random.RandomState(seed)
+    scores = [
+        {metric: random_state.rand() for metric in SCORING} for _ in range(n_bootstrap)
+    ]
+
+    result = calculate_test_metrics(
+        {metric: np.array([score[metric] for score in scores]) for metric in SCORING},
+        SCORING,
+        seed,
+    )
+    expected = baseline_calculate_test_metrics(scores, SCORING, seed)
+
+    assert_metrics_equal(result, expected)
+
+
+def test_metrics_pinned_output():
+    # Fixed inputs & seed, guards against changes of the bootstrap draws
+    cv_results = {
+        "split0_test_auc": [0.5, 0.7],
+        "split1_test_auc": [0.6, 0.8],
+        "split2_test_auc": [0.4, 0.9],
+        "split3_test_auc": [0.7, 0.75],
+    }
+
+    training_metrics = calculate_training_metrics(1, cv_results, {"auc": "roc_auc"}, 42)
+    test_metrics = calculate_test_metrics(
+        {"auc": np.array([0.6, 0.65, 0.7, 0.8, 0.9])}, {"auc": "roc_auc"}, 42
+    )
+
+    assert training_metrics["auc"] == pytest.approx(
+        {"mean": 0.7875, "inf_value": 0.7375, "sup_value": 0.8440625, "order": 0}
+    )
+    assert test_metrics["auc"] == pytest.approx(
+        {"mean": 0.73, "inf_value": 0.62225, "sup_value": 0.8155, "order": 0}
+    )
+
+
+def make_bootstrap_data(random_state, n_samples, n_bootstrap):
+    # Rounded probabilities, so that some scores are tied
+    y_true = random_state.randint(2, size=n_samples)
+    y_true[:2] = [0, 1]
+    probabilities = np.round(random_state.rand(n_samples), 1)
+    y_pred_proba = np.column_stack([1 - probabilities, probabilities])
+    y_pred = (probabilities > 0.5).astype(int)
+
+    bootstrap_indices = random_state.randint(n_samples, size=(n_bootstrap, n_samples))
+
+    # A repetition with only negative samples
+    bootstrap_indices[0] = np.flatnonzero(y_true == 0)[0]
+
+    return y_true, y_pred, y_pred_proba, bootstrap_indices
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_batch_metrics_match_sklearn(seed):
+    random_state = np.random.RandomState(seed)
+    y_true, y_pred, y_pred_proba, bootstrap_indices = make_bootstrap_data(
+        random_state, n_samples=30, n_bootstrap=20
+    )
+    scoring = {**SCORING, "recall": "recall"}
+
+    scores = score_bootstrap_chunk(
+        bootstrap_indices, y_true, y_pred, y_pred_proba, resolve_scorers(scoring)
+    )
+
+    for repetition, indices in enumerate(bootstrap_indices):
+        y_true_resampled = y_true[indices]
+        y_pred_resampled = y_pred[indices]
+
+        assert scores["accuracy"][repetition] == pytest.approx(
+            accuracy_score(y_true_resampled, y_pred_resampled)
+        )
+        assert scores["precision"][repetition] == pytest.approx(
+            precision_score(y_true_resampled, y_pred_resampled, zero_division=0)
+        )
+        assert scores["recall"][repetition] == pytest.approx(
+            recall_score(y_true_resampled, y_pred_resampled, zero_division=0)
+        )
+
+        if len(np.unique(y_true_resampled)) == 1:
+            # Undefined with a single class (scikit-learn raises an error)
+            assert np.isnan(scores["auc"][repetition])
+        else:
+            assert scores["auc"][repetition] == pytest.approx(
+                roc_auc_score(y_true_resampled, y_pred_proba[indices, 1])
+            )
+
+    assert np.isnan(scores["auc"][0])
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_batch_metrics_match_calculate_scores(seed):
+    random_state = np.random.RandomState(seed)
+    y_true, y_pred, y_pred_proba, bootstrap_indices = make_bootstrap_data(
+        random_state, n_samples=30, n_bootstrap=20
+    )
+
+    # Without the single-class repetition, on which roc_auc_score fails
+    bootstrap_indices = bootstrap_indices[1:]
+
+    scores = score_bootstrap_indices(
+        bootstrap_indices,
+        y_true,
+        y_pred,
+        y_pred_proba,
+        resolve_scorers(SCORING),
+        n_jobs=2,
+    )
+
+    for repetition, indices in enumerate(bootstrap_indices):
+        expected = calculate_scores(
+            y_true[indices], y_pred[indices], y_pred_proba[indices], SCORING
+        )
+
+        for metric in SCORING:
+            assert scores[metric][repetition] == pytest.approx(expected[metric])
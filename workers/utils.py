@@ -3,16 +3,339 @@ import math
 import re
 from time import time
 
+import joblib
 import numpy as np
 from flask import jsonify
-from sklearn.metrics import get_scorer
-from sklearn.utils import resample
+from joblib import Parallel, delayed, effective_n_jobs
+from sklearn.base import clone
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.metrics import (
+    get_scorer,
+    roc_auc_score,
+    accuracy_score,
+    precision_score,
+    recall_score,
+)
+from sklearn.model_selection import (
+    HalvingGridSearchCV,
+    ParameterGrid,
+    ParameterSampler,
+)
 from scipy import stats
 
-from config_workers import MODELS_BASE_DIR
+from quantimage2_backend_common.const import (
+    SEARCH_STRATEGIES,
+    HALVING_FACTOR,
+    RANDOM_SEARCH_ITERATIONS,
+)
+from quantimage2_backend_common.modeling_utils import (
+    c_index_score,
+    batch_c_index_score,
+    get_halving_schedule,
+)
 from quantimage2_backend_common.utils import MessageType
 
 
+def make_halving_search(
+    pipeline,
+    parameter_grid,
+    scoring,
+    cv,
+    n_jobs,
+    random_seed,
+    n_samples,
+    n_classes,
+):
+    """
+    Create the successive halving search object, which needs the results of
+    each iteration before starting the next one and therefore runs in a single task
+
+    :param pipeline: The pipeline of steps to optimize
+    :param parameter_grid: The grid of parameters to explore
+    :param scoring: The scorer (successive halving only supports a single metric)
+    :param cv: The cross-validation object
+    :param n_jobs: The number of parallel jobs
+    :param random_seed: The random seed for reproducibility
+    :param n_samples: The number of training samples
+    :param n_classes: The number of classes (or event values for survival)
+    :returns: The (unfitted) search object
+    """
+    min_resources, n_candidates_per_iteration = get_halving_schedule(
+        len(ParameterGrid(parameter_grid)),
+        n_samples,
+        cv.get_n_splits(),
+        n_classes,
+    )
+
+    # Refit on the best candidate
+    return HalvingGridSearchCV(
+        pipeline,
+        parameter_grid,
+        factor=HALVING_FACTOR,
+        min_resources=min_resources,
+        scoring=scoring,
+        refit=True,
+        cv=cv,
+        n_jobs=n_jobs,
+        random_state=random_seed,
+        return_train_score=False,
+        verbose=1,
+    )
+
+
+def get_search_candidates(search_strategy, parameter_grid, random_seed):
+    """
+    Get the parameter combinations evaluated by a grid or randomized search
+
+    :param search_strategy: The search strategy (see SEARCH_STRATEGIES)
+    :param parameter_grid: The grid of parameters to explore
+    :param random_seed: The random seed for reproducibility
+    :returns: The list of parameter combinations (same order as GridSearchCV & RandomizedSearchCV)
+    """
+    if SEARCH_STRATEGIES(search_strategy) == SEARCH_STRATEGIES.RANDOM:
+        n_candidates = len(ParameterGrid(parameter_grid))
+
+        return list(
+            ParameterSampler(
+                parameter_grid,
+                min(RANDOM_SEARCH_ITERATIONS, n_candidates),
+                random_state=random_seed,
+            )
+        )
+
+    return list(ParameterGrid(parameter_grid))
+
+
+def fit_and_score(pipeline, parameters, X, y, train_index, test_index, scorers):
+    """
+    Fit one candidate of the search on one cross-validation split and score it
+
+    :param pipeline: The pipeline of steps to optimize
+    :param parameters: The parameters of the candidate
+    :param X: The training features
+    :param y: The training labels
+    :param train_index: The indices of the samples to fit on
+    :param test_index: The indices of the samples to score on
+    :param scorers: The resolved scorers (see resolve_scorers)
+    :returns: The score for each metric (NaN if fitting failed, like GridSearchCV) & the fit time
+    """
+    estimator = clone(pipeline).set_params(**parameters)
+
+    start = time()
+
+    try:
+        estimator.fit(X[train_index], y[train_index])
+        fit_time = time() - start
+
+        scores = {
+            score_name: float(scorer(estimator, X[test_index], y[test_index]))
+            for score_name, scorer in scorers.items()
+        }
+    except Exception as e:
+        fit_time = time() - start
+
+        print(f"Fitting failed for parameters {parameters} - {e}")
+        scores = {score_name: np.nan for score_name in scorers}
+
+    return scores, fit_time
+
+
+def get_training_data_fingerprint(X, y, splits):
+    # Content hash of the feature matrix, the labels & the cross-validation splits
+    return joblib.hash((np.asarray(X), np.asarray(y), splits))
+
+
+def get_candidate_fingerprint(data_fingerprint, pipeline, parameters):
+    """
+    Identify the cross-validation results of a candidate, which can be reused
+    by any later search on the same training data & splits
+
+    :param data_fingerprint: The fingerprint of the training data & splits
+    :param pipeline: The pipeline of steps to optimize
+    :param parameters: The parameters of the candidate
+    :returns: The fingerprint of the candidate
+    """
+    # The location of the transform cache does not change the results
+    candidate = clone(pipeline).set_params(**parameters).set_params(memory=None)
+
+    return joblib.hash((data_fingerprint, candidate))
+
+
+def split_results_from_stored(candidate_index, stored_result, scoring):
+    """
+    Convert the stored cross-validation results of a candidate to split results
+
+    :param candidate_index: The index of the candidate in the current search
+    :param stored_result: The stored results (see CandidateCVResult)
+    :param scoring: The scoring dictionary
+    :returns: The results of each split (None if a metric was not stored)
+    """
+    if any(metric not in stored_result.scores for metric in scoring):
+        return None
+
+    return [
+        {
+            "candidate_index": candidate_index,
+            "split_index": split_index,
+            "scores": {
+                metric: stored_result.scores[metric][split_index] for metric in scoring
+            },
+            "fit_time": fit_time,
+        }
+        for split_index, fit_time in enumerate(stored_result.fit_times)
+    ]
+
+
+def stored_results_from_split(split_results, fingerprints):
+    """
+    Group the split results by candidate in order to store them
+
+    :param split_results: The results of the fits (see aggregate_cv_results)
+    :param fingerprints: The fingerprint of each candidate
+    :returns: The results to store, candidates with a failed split are left out
+    """
+    candidates_results = {}
+
+    for result in sorted(
+        split_results, key=lambda r: (r["candidate_index"], r["split_index"])
+    ):
+        candidate_results = candidates_results.setdefault(
+            result["candidate_index"],
+            {
+                "fingerprint": fingerprints[result["candidate_index"]],
+                "scores": {},
+                "fit_times": [],
+            },
+        )
+        candidate_results["fit_times"].append(result["fit_time"])
+
+        for metric, score in result["scores"].items():
+            candidate_results["scores"].setdefault(metric, []).append(score)
+
+    return [
+        candidate_results
+        for candidate_results in candidates_results.values()
+        if not np.isnan(list(candidate_results["scores"].values())).any()
+    ]
+
+
+def aggregate_cv_results(split_results, candidates, n_splits, scoring):
+    """
+    Assemble the results of all (candidate, split) fits like the cv_results_ of GridSearchCV
+
+    :param split_results: The results of the fits, with the candidate & split indices,
+                          the scores & the fit time
+    :param candidates: The list of parameter combinations
+    :param n_splits: The total number of cross-validation splits
+    :param scoring: The scoring dictionary
+    :returns: The cross-validation results, by key (split0_test_auc, mean_test_auc, etc.)
+    """
+    fit_times = np.full((len(candidates), n_splits), np.nan)
+    split_scores = {
+        metric: np.full((len(candidates), n_splits), np.nan) for metric in scoring
+    }
+
+    for result in split_results:
+        candidate_index = result["candidate_index"]
+        split_index = result["split_index"]
+
+        fit_times[candidate_index, split_index] = result["fit_time"]
+
+        for metric, score in result["scores"].items():
+            split_scores[metric][candidate_index, split_index] = score
+
+    cv_results = {
+        "params": candidates,
+        "mean_fit_time": np.mean(fit_times, axis=1),
+        "std_fit_time": np.std(fit_times, axis=1),
+    }
+
+    for metric, scores in split_scores.items():
+        for split in range(n_splits):
+            cv_results[f"split{split}_test_{metric}"] = scores[:, split]
+
+        means = np.mean(scores, axis=1)
+
+        cv_results[f"mean_test_{metric}"] = means
+        cv_results[f"std_test_{metric}"] = np.std(scores, axis=1)
+
+        # Candidates that failed are ranked last (same as GridSearchCV)
+        cv_results[f"rank_test_{metric}"] = stats.rankdata(
+            np.where(np.isnan(means), np.inf, -means), method="min"
+        ).astype(np.int32)
+
+    return cv_results
+
+
+def get_best_index(cv_results, refit_metric):
+    # First candidate with the best mean score (same as GridSearchCV)
+    return int(np.argmin(cv_results[f"rank_test_{refit_metric}"]))
+
+
+def get_transform_cache_hit_ratio(cache_dir, n_fits):
+    """
+    Estimate the hit ratio of the pipeline transform cache
+
+    Each transform that was actually computed leaves one output file in the
+    cache directory, all other fits of the pipeline were served from the cache.
+
+    :param cache_dir: The directory used as memory by the pipeline
+    :param n_fits: The total number of pipeline fits
+    :returns: The proportion of fits that reused a cached transform
+    """
+    n_computed = sum(
+        1 for root, dirs, files in os.walk(cache_dir) if "output.pkl" in files
+    )
+
+    return max(0, 1 - n_computed / n_fits) if n_fits else 0
+
+
+def split_results_from_cross_validation(cross_validation_results, scoring):
+    # Format the output of cross_validate like the results of fit_and_score
+    return [
+        {
+            "candidate_index": 0,
+            "split_index": split_index,
+            "scores": {
+                metric: cross_validation_results[f"test_{metric}"][split_index]
+                for metric in scoring
+            },
+            "fit_time": fit_time,
+        }
+        for split_index, fit_time in enumerate(cross_validation_results["fit_time"])
+    ]
+
+
+def add_best_candidate_results(cv_results, best_index, split_results, scoring):
+    """
+    Add the scores of the best candidate on all metrics to the cv_results_ of a
+    successive halving search, which only scores the refit metric
+
+    :param cv_results: The cv_results_ of the search (one row per candidate & iteration)
+    :param best_index: The index of the best candidate in the CV results
+    :param split_results: The results of the best candidate on each split
+    :param scoring: The scoring dictionary
+    :returns: The CV results with the split, mean & rank of every metric (NaN
+              for the other candidates, which were not scored on all metrics)
+    """
+    cv_results = dict(cv_results)
+    n_rows = len(cv_results["params"])
+
+    for metric in scoring:
+        scores = np.array([result["scores"][metric] for result in split_results])
+
+        for split, score in enumerate(scores):
+            cv_results[f"split{split}_test_{metric}"] = np.full(n_rows, np.nan)
+            cv_results[f"split{split}_test_{metric}"][best_index] = score
+
+        cv_results[f"mean_test_{metric}"] = np.full(n_rows, np.nan)
+        cv_results[f"mean_test_{metric}"][best_index] = np.mean(scores)
+        cv_results[f"std_test_{metric}"] = np.full(n_rows, np.nan)
+        cv_results[f"std_test_{metric}"][best_index] = np.std(scores)
+
+    return cv_results
+
+
 def mean_confidence_interval_student(mean, std, n_samples, confidence=0.95):
     inf_value, sup_value = stats.t.interval(
         alpha=confidence, df=n_samples - 1, loc=mean, scale=std
@@ -28,89 +351,102 @@ def mean_confidence_interval_student(mean, std, n_samples, confidence=0.95):
 def calculate_training_metrics(
     best_index, cv_results, scoring, random_seed, confidence=0.95
 ):
-    metrics = {}
-
-    for index, metric in enumerate(scoring.keys()):
-
-        # Filter the CV results to keep only the splits for the current metric
-        metric_splits = {
-            k: v
-            for k, v in cv_results.items()
-            if re.match(rf"split\d_test_{metric}", k)
-        }
-
-        # Get the metric values for the best index
-        split_values = [v[best_index] for v in metric_splits.values()]
-
-        # Run bootstrap on the split values
-        bootstrapped_values = bootstrap_on_results(
-            split_values, random_seed, n_bootstrap=20
-        )
-
-        # Calculate mean for each of the boostrap repetitions
-        bootstrapped_means = [np.mean(values) for values in bootstrapped_values]
+    # Scores of the best candidate (one row per metric, one column per split)
+    split_scores = get_best_split_scores(best_index, cv_results, scoring)
 
-        # Calculate confidence interval based on the bootstrapped means
-
-        metrics[metric] = get_confidence_interval_quartiles(
-            split_values, bootstrapped_means, confidence
-        )
-        metrics[metric]["order"] = index
-
-    return metrics
+    # Run bootstrap on the split values
+    return get_bootstrapped_metrics(
+        split_scores, scoring, random_seed, n_bootstrap=20, confidence=confidence
+    )
 
 
 def calculate_test_metrics(scores, scoring, random_seed, confidence=0.95):
+    # Bootstrapped test scores (one row per metric, one column per repetition)
+    test_scores = np.array([scores[metric] for metric in scoring], dtype=float)
 
-    metrics = {}
+    # Run bootstrap on the bootstrapped values
+    return get_bootstrapped_metrics(
+        test_scores, scoring, random_seed, n_bootstrap=50, confidence=confidence
+    )
 
-    for index, metric in enumerate(scoring.keys()):
-        metric_scores = [score[metric] for score in scores]
 
-        # Run bootstrap on the bootstrapped values
-        bootstrapped_values = bootstrap_on_results(
-            metric_scores, random_seed, n_bootstrap=50
-        )
+def get_best_split_scores(best_index, cv_results, scoring):
+    """
+    Stack the cross-validation scores of the best candidate in a matrix
+
+    :param best_index: The index of the best candidate in the CV results
+    :param cv_results: The cross-validation results (same format as GridSearchCV)
+    :param scoring: The scoring dictionary
+    :returns: A (n_metrics x n_splits) matrix of scores
+    """
+    first_metric = next(iter(scoring))
+    n_splits = sum(
+        1
+        for key in cv_results
+        if re.fullmatch(rf"split\d+_test_{re.escape(first_metric)}", key)
+    )
 
-        # Calculate mean for each of the 2nd-level boostrap repetitions
-        bootstrapped_means = [np.mean(values) for values in bootstrapped_values]
+    return np.array(
+        [
+            [
+                cv_results[f"split{split}_test_{metric}"][best_index]
+                for split in range(n_splits)
+            ]
+            for metric in scoring
+        ],
+        dtype=float,
+    )
 
-        metrics[metric] = get_confidence_interval_quartiles(
-            metric_scores, bootstrapped_means, confidence
-        )
-        metrics[metric]["order"] = index
 
-    return metrics
+def get_bootstrapped_metrics(
+    scores, metric_names, random_seed, n_bootstrap, confidence=0.95
+):
+    """
+    Calculate the mean & the confidence interval of all metrics at once, using
+    the same bootstrap repetitions for every metric
+
+    :param scores: A (n_metrics x n_values) matrix of scores
+    :param metric_names: The name of each metric (same order as the rows)
+    :param random_seed: The random seed for reproducibility
+    :param n_bootstrap: The number of bootstrap repetitions
+    :param confidence: The confidence level of the interval
+    :returns: The mean, lower & upper bounds of the interval, by metric
+    """
+    bootstrap_indices = get_bootstrap_indices(
+        scores.shape[1], n_bootstrap, random_seed
+    )
 
+    # Calculate mean for each of the bootstrap repetitions (n_metrics x n_bootstrap)
+    bootstrapped_means = np.mean(scores[:, bootstrap_indices], axis=2)
 
-def get_confidence_interval_quartiles(metric_scores, bootstrapped_means, confidence):
     # Calculate confidence interval based on the bootstrapped means
-    inf_value = np.quantile(bootstrapped_means, ((1 - confidence) / 2))
-    sup_value = np.quantile(bootstrapped_means, 1 - ((1 - confidence) / 2))
+    inf_values = np.quantile(bootstrapped_means, (1 - confidence) / 2, axis=1)
+    sup_values = np.quantile(bootstrapped_means, 1 - (1 - confidence) / 2, axis=1)
 
     # Report the true mean of the metric scores
-    mean_value = np.mean(metric_scores)
+    mean_values = np.mean(scores, axis=1)
 
     return {
-        "mean": mean_value,
-        "inf_value": inf_value,
-        "sup_value": sup_value,
+        metric: {
+            "mean": mean_values[index],
+            "inf_value": inf_values[index],
+            "sup_value": sup_values[index],
+            "order": index,
+        }
+        for index, metric in enumerate(metric_names)
     }
 
 
-def bootstrap_on_results(results, random_seed, n_bootstrap=20):
-    bootstrapped_results = []
-
-    for i in range(n_bootstrap):
-        resampled_results = resample(
-            results,
-            replace=True,
-            n_samples=len(results),
-            random_state=random_seed + i,
-        )
-        bootstrapped_results.append(resampled_results)
-
-    return bootstrapped_results
+def get_bootstrap_indices(n_values, n_bootstrap, random_seed):
+    # Same draws as sklearn.utils.resample with random_state=random_seed + repetition
+    return np.array(
+        [
+            np.random.RandomState(random_seed + repetition).randint(
+                n_values, size=n_values
+            )
+            for repetition in range(n_bootstrap)
+        ]
+    )
 
 
 def run_bootstrap(
@@ -122,6 +458,7 @@ def run_bootstrap(
     n_bootstrap=1000,
     training_id=None,
     socket_io=None,
+    n_jobs=1,
 ):
 
     all_test_predictions = model.predict(X_test)
@@ -132,66 +469,256 @@ def run_bootstrap(
     except AttributeError:
         pass  # The model can't predict probabilities, ignore this
 
-    all_scores = []
+    y_test = np.asarray(y_test)
+
+    # Stratify on the Outcome for classification & on the Event for survival
+    stratify = (
+        y_test[y_test.dtype.names[0]] if y_test.dtype.names is not None else y_test
+    )
+
+    # Draw all the resampled indices at once (one row per bootstrap repetition)
+    bootstrap_indices = get_stratified_bootstrap_indices(
+        stratify, n_bootstrap, random_seed
+    )
+
+    scorers = resolve_scorers(scoring)
+
+    # Score the repetitions in blocks of 10% to keep sending progress updates
+    all_scores = {score_name: [] for score_name in scorers}
+    n_blocks = min(10, n_bootstrap)
+    completed = 0
+
+    for block_indices in np.array_split(bootstrap_indices, n_blocks):
+        block_scores = score_bootstrap_indices(
+            block_indices,
+            y_test,
+            all_test_predictions,
+            all_test_predictions_probabilities,
+            scorers,
+            n_jobs=n_jobs,
+        )
+
+        for score_name, values in block_scores.items():
+            all_scores[score_name].append(values)
+
+        completed += len(block_indices)
+
+        print(f"Ran {completed}/{n_bootstrap} iterations of the Bootstrap run")
+
+        # Status update
+        if training_id and socket_io:
+            socketio_body = {
+                "training-id": training_id,
+                "phase": "testing",
+                "current": completed,
+                "total": n_bootstrap,
+            }
+            socket_io.emit(
+                MessageType.TRAINING_STATUS.value, jsonify(socketio_body).get_json()
+            )
+
+    all_scores = {
+        score_name: np.concatenate(values) for score_name, values in all_scores.items()
+    }
+
+    return all_scores, n_bootstrap
+
+
+def get_stratified_bootstrap_indices(stratify, n_bootstrap, random_seed):
+    """
+    Generate the indices of all bootstrap repetitions at once, resampling
+    with replacement inside each class so that class proportions are kept
+    (same behavior as sklearn.utils.resample with stratify).
+
+    :param stratify: The class of each sample
+    :param n_bootstrap: The number of bootstrap repetitions
+    :param random_seed: The random seed for reproducibility
+    :returns: A (n_bootstrap x n_samples) matrix of sample indices
+    """
+    random_state = np.random.RandomState(random_seed)
+
+    classes_indices = [
+        np.flatnonzero(stratify == label) for label in np.unique(stratify)
+    ]
+
+    return np.concatenate(
+        [
+            class_indices[
+                random_state.randint(
+                    0, len(class_indices), size=(n_bootstrap, len(class_indices))
+                )
+            ]
+            for class_indices in classes_indices
+        ],
+        axis=1,
+    )
+
+
+def resolve_scorers(scoring):
+    return {
+        score_name: get_scorer(scorer) if type(scorer) == str else scorer
+        for score_name, scorer in scoring.items()
+    }
+
+
+def score_bootstrap_indices(
+    bootstrap_indices, y_true, y_pred, y_pred_proba, scorers, n_jobs=1
+):
+    """
+    Calculate the scores of many bootstrap repetitions, optionally splitting
+    the repetitions in chunks that are scored in parallel
+
+    :param bootstrap_indices: A (n_repetitions x n_samples) matrix of sample indices
+    :param y_true: The true labels of the test set
+    :param y_pred: The predictions on the test set
+    :param y_pred_proba: The predicted probabilities on the test set (or None)
+    :param scorers: The resolved scorers (see resolve_scorers)
+    :param n_jobs: The number of parallel jobs to use
+    :returns: A dictionary with an array of scores (one per repetition) for each metric
+    """
+    if n_jobs == 1 or len(bootstrap_indices) < 2:
+        return score_bootstrap_chunk(
+            bootstrap_indices, y_true, y_pred, y_pred_proba, scorers
+        )
+
+    n_chunks = min(len(bootstrap_indices), effective_n_jobs(n_jobs))
+
+    # NumPy releases the GIL, threads avoid starting processes from the Celery worker
+    chunks_scores = Parallel(n_jobs=n_chunks, prefer="threads")(
+        delayed(score_bootstrap_chunk)(
+            chunk_indices, y_true, y_pred, y_pred_proba, scorers
+        )
+        for chunk_indices in np.array_split(bootstrap_indices, n_chunks)
+    )
+
+    return {
+        score_name: np.concatenate(
+            [chunk_scores[score_name] for chunk_scores in chunks_scores]
+        )
+        for score_name in scorers
+    }
+
+
+def score_bootstrap_chunk(bootstrap_indices, y_true, y_pred, y_pred_proba, scorers):
+    y_true_resampled = y_true[bootstrap_indices]
+    y_pred_resampled = y_pred[bootstrap_indices]
 
-    probabilities_resampled = None
+    # Metrics that need a score use the "greater label" probability (if available)
+    y_score_resampled = (
+        y_pred_proba[:, 1][bootstrap_indices]
+        if y_pred_proba is not None
+        else y_pred_resampled
+    )
+
+    scores = {}
 
-    for i in range(n_bootstrap):
+    for score_name, scorer in scorers.items():
+        batch_score_func = get_batch_score_func(scorer)
 
-        if all_test_predictions_probabilities is not None:
-            predictions_resampled, probabilities_resampled, y_test_resampled = resample(
-                all_test_predictions,
-                all_test_predictions_probabilities,
-                y_test,
-                replace=True,
-                n_samples=len(y_test),
-                random_state=random_seed + i,
-                stratify=y_test,
+        if batch_score_func is not None:
+            scores[score_name] = batch_score_func(
+                y_true_resampled,
+                y_pred_resampled,
+                y_score_resampled,
+                **scorer._kwargs,
             )
         else:
-            predictions_resampled, y_test_resampled = resample(
-                all_test_predictions,
-                y_test,
-                replace=True,
-                n_samples=len(y_test),
-                random_state=random_seed + i,
-                stratify=[o[0] for o in y_test],
+            # No vectorized implementation, score each repetition separately
+            scores[score_name] = np.array(
+                [
+                    calculate_scores(
+                        y_true_resampled[i],
+                        y_pred_resampled[i],
+                        y_pred_proba[bootstrap_indices[i]]
+                        if y_pred_proba is not None
+                        else None,
+                        {score_name: scorer},
+                    )[score_name]
+                    for i in range(len(bootstrap_indices))
+                ]
             )
 
-        scores = calculate_scores(
-            y_test_resampled, predictions_resampled, probabilities_resampled, scoring
-        )
+    return scores
 
-        all_scores.append(scores)
-
-        if i % (n_bootstrap / 10) == 0:
-            print(f"Ran {i}/{n_bootstrap} iterations of the Bootstrap run")
-
-            # Status update
-            if training_id and socket_io:
-                socketio_body = {
-                    "training-id": training_id,
-                    "phase": "testing",
-                    "current": i,
-                    "total": n_bootstrap,
-                }
-                socket_io.emit(
-                    MessageType.TRAINING_STATUS.value, jsonify(socketio_body).get_json()
-                )
 
-    # Final status update
-    if training_id and socket_io:
-        socketio_body = {
-            "training-id": training_id,
-            "phase": "testing",
-            "current": n_bootstrap,
-            "total": n_bootstrap,
-        }
-        socket_io.emit(
-            MessageType.TRAINING_STATUS.value, jsonify(socketio_body).get_json()
+def get_batch_score_func(scorer):
+    batch_score_func = BATCH_SCORE_FUNCTIONS.get(scorer._score_func)
+
+    # Only binary metrics are vectorized
+    if scorer._kwargs.get("average", "binary") != "binary":
+        return None
+
+    return batch_score_func
+
+
+def batch_roc_auc_score(y_true, y_pred, y_score, average="binary"):
+    # Mann-Whitney U statistic on the ranks of the scores (ties get the average rank)
+    ranks = stats.rankdata(y_score, axis=1)
+    positives = y_true == np.max(y_true)
+
+    n_positives = np.sum(positives, axis=1)
+    n_negatives = y_true.shape[1] - n_positives
+
+    sum_positive_ranks = np.sum(ranks * positives, axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (sum_positive_ranks - n_positives * (n_positives + 1) / 2) / (
+            n_positives * n_negatives
         )
 
-    return all_scores, n_bootstrap
+
+def batch_accuracy_score(y_true, y_pred, y_score, average="binary"):
+    return np.mean(y_true == y_pred, axis=1)
+
+
+def batch_precision_score(y_true, y_pred, y_score, pos_label=1, average="binary"):
+    true_positives, false_positives, false_negatives = batch_confusion_counts(
+        y_true, y_pred, pos_label
+    )
+
+    return safe_divide(true_positives, true_positives + false_positives)
+
+
+def batch_recall_score(y_true, y_pred, y_score, pos_label=1, average="binary"):
+    true_positives, false_positives, false_negatives = batch_confusion_counts(
+        y_true, y_pred, pos_label
+    )
+
+    return safe_divide(true_positives, true_positives + false_negatives)
+
+
+def batch_concordance_index_score(y_true, y_pred, y_score):
+    return batch_c_index_score(y_true, y_score)
+
+
+def batch_confusion_counts(y_true, y_pred, pos_label):
+    true_is_positive = y_true == pos_label
+    pred_is_positive = y_pred == pos_label
+
+    true_positives = np.sum(true_is_positive & pred_is_positive, axis=1)
+    false_positives = np.sum(~true_is_positive & pred_is_positive, axis=1)
+    false_negatives = np.sum(true_is_positive & ~pred_is_positive, axis=1)
+
+    return true_positives, false_positives, false_negatives
+
+
+def safe_divide(numerator, denominator):
+    # Same as scikit-learn, return 0 when the metric is ill-defined
+    return np.divide(
+        numerator,
+        denominator,
+        out=np.zeros(numerator.shape, dtype=float),
+        where=denominator != 0,
+    )
+
+
+BATCH_SCORE_FUNCTIONS = {
+    roc_auc_score: batch_roc_auc_score,
+    accuracy_score: batch_accuracy_score,
+    precision_score: batch_precision_score,
+    recall_score: batch_recall_score,
+    c_index_score: batch_concordance_index_score,
+}
 
 
 def calculate_scores(y_true, y_pred, y_pred_proba, scoring):
@@ -220,14 +747,5 @@ def calculate_scores(y_true, y_pred, y_pred_proba, scoring):
     return scores
 
 
-def get_model_path(user_id, album_id, model_type):
-    # Define features path for storing the results
-    models_dir = os.path.join(MODELS_BASE_DIR, user_id, album_id)
-
-    models_filename = f"model_{model_type}"
-
-    models_filename += f"_{str(int(time()))}"
-    models_filename += ".joblib"
-    models_path = os.path.join(models_dir, models_filename)
-
-    return models_path
+def get_model_name(album_name, model_type):
+    return f"{album_name}_model_{model_type}_{int(time())}"